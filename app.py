@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, send_file
 import os
 from urllib.parse import urlparse
 from dotenv import load_dotenv
@@ -6,8 +6,7 @@ import logging
 from logging.handlers import RotatingFileHandler
 import threading
 import uuid
-import time
-import json
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 log_file = 'app.log'
@@ -16,13 +15,144 @@ file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(mes
 
 logging.basicConfig(level=logging.INFO, handlers=[file_handler])
 
-from video_processing import process_video_with_recipe
+from video_processing import process_video_with_recipe, process_source_group
+from utils.task_events import TaskStatusStore, stream_task_events, TERMINAL_STATUSES
+from utils.checkpoint import load_manifest, completed_stages, merge_recipe
+from utils.batch import plan_batch, analysis_recipe, BatchProgress
+from utils.metrics import render_metrics, update_queue_gauges
+from utils.job_queue import get_job_queue_from_env, QueueStatusRelay
+from utils.cancellation import request_cancel, discard_cancel_request
+from utils.waveform import peak_window, review_intervals
+from utils.artifacts import current_sha256
+from utils.retention import DiskBudget, estimate_job_bytes, default_job_bytes, touch_task, start_gc_thread
+from utils.estimator import Estimator
+from utils.media_probe import probe_url_metadata
 
 app = Flask(__name__)
+# Behind a front server that supports it (Apache mod_xsendfile, lighttpd), artifact
+# downloads hand the file over in an X-Sendfile header instead of streaming it here.
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
 
 load_dotenv()
 
-task_status = {}
+task_status = TaskStatusStore()
+
+# With JOB_QUEUE_PATH set, jobs go to the durable queue and run in worker.py processes;
+# their status is relayed from the shared store into task_status. Otherwise jobs run
+# as threads inside this process.
+job_queue = get_job_queue_from_env()
+status_relay = QueueStatusRelay(job_queue, task_status).start() if job_queue else None
+
+# New jobs are refused while their projected disk use doesn't fit; finished tasks'
+# outputs are expired after ARTIFACT_TTL_SECONDS and evicted under DISK_QUOTA_BYTES.
+disk_budget = DiskBudget(task_status)
+start_gc_thread()
+
+# Predicts a job's run time and Gemini tokens from the stage timings of recent tasks. The
+# queue runs the shortest jobs first, and a job that can't meet its deadline is refused.
+estimator = Estimator()
+
+DEFAULT_RECIPE = {
+    "apply_noise_reduction": True,
+    "transcribe": True,
+    "detect_silence": True,
+    "classify_content": True,
+    "classify_silence": True,
+    "detect_filler_words": True,
+    "detect_retakes": True,
+    "cut_video": True,
+    "remove_silence": True,
+    "remove_filler_words": True,
+    "remove_retakes": True,
+    "export_to_premiere": False,
+    "burn_captions": True,
+    "waveform": True,
+    "ass_style": {
+        "position": "Bottom",  # Options: "Top", "Middle", "Bottom"
+        "words_per_line": 10,
+        "Fontname": "Arial",
+        "Fontsize": "72",
+        "PrimaryColour": "&H00FFFFFF",
+        "Outline": 3,
+        "Shadow": 2
+    }
+}
+
+def insufficient_storage(required_bytes, available_bytes):
+    return jsonify({
+        "error": "Not enough disk space for this job; try again later.",
+        "required_bytes": required_bytes,
+        "available_bytes": max(0, available_bytes)
+    }), 507
+
+def deadline_unreachable(**details):
+    return jsonify({"error": "The job is not expected to finish within its deadline_seconds.", **details}), 422
+
+def probe_source(video_url):
+    """Size and duration of the source for an estimate, or None if it can't be probed."""
+    try:
+        return probe_url_metadata(video_url)
+    except Exception as e:
+        logging.warning(f"Could not probe {video_url} for an estimate: {e}")
+        return None
+
+def estimate_group(video_url, members):
+    """
+    Estimate of a batch source group: the shared analysis, then each member's render in
+    turn, so a member's deadline (counted from the start of the group) covers the
+    analysis and every render before its own. None if the source can't be probed.
+    """
+    media = probe_source(video_url)
+    if media is None:
+        return None
+    analysis = estimator.estimate(analysis_recipe([member["recipe"] for member in members]), media, phases=("analysis",))
+    elapsed = analysis["total_seconds"]
+    late_task_ids = []
+    for member in members:
+        elapsed += estimator.estimate(member["recipe"], media, phases=("render",))["total_seconds"]
+        deadline = member["recipe"].get("deadline_seconds")
+        if deadline and elapsed > float(deadline):
+            late_task_ids.append(member["task_id"])
+    return {"total_seconds": round(elapsed, 3), "late_task_ids": late_task_ids}
+
+def estimate_job_seconds(video_url, recipe):
+    media = probe_source(video_url)
+    return estimator.estimate(recipe, media)["total_seconds"] if media else None
+
+def estimate_in_background(job_id, estimate_seconds):
+    """
+    Probes the source and stores the queued job's estimated_seconds off the request
+    thread, so submission latency doesn't depend on the source host. Until then the
+    job is ordered as if it were short.
+    """
+    def run():
+        try:
+            seconds = estimate_seconds()
+            if seconds is not None:
+                job_queue.set_estimate(job_id, seconds)
+        except Exception as e:
+            logging.warning(f"[{job_id}] Estimating the job failed: {e}")
+    threading.Thread(target=run, name="job-estimate", daemon=True).start()
+
+def reserve_disk(sources):
+    """
+    Admits a job with {task_id: video_url} sources on their projected disk use, probing
+    the sources concurrently. Sources that don't report a size in time reserve the
+    default, corrected in the background. Returns (admitted, required_bytes, available_bytes).
+    """
+    with ThreadPoolExecutor(max_workers=min(len(sources), 8)) as pool:
+        sizes = dict(zip(sources, pool.map(estimate_job_bytes, sources.values())))
+    reservations = {task_id: default_job_bytes() if size is None else size for task_id, size in sizes.items()}
+    admitted, available_bytes = disk_budget.admit(reservations)
+    unknown = {task_id: sources[task_id] for task_id, size in sizes.items() if size is None}
+    if admitted and unknown:
+        disk_budget.correct_later(unknown)
+    return admitted, sum(reservations.values()), available_bytes
+
+def task_is_known(task_id):
+    if task_id in task_status:
+        return True
+    return status_relay is not None and status_relay.ensure_loaded(task_id)
 
 @app.route('/process_video', methods=['POST'])
 def process_video():
@@ -31,49 +161,257 @@ def process_video():
         return jsonify({"error": "video_url is required in the JSON body"}), 400
 
     video_url = data['video_url']
-    recipe = data.get('recipe', {
-        "apply_noise_reduction": True,
-        "transcribe": True,
-        "detect_silence": True,
-        "classify_content": True,
-        "classify_silence": True,
-        "detect_filler_words": True,
-        "detect_retakes": True,
-        "cut_video": True,
-        "remove_silence": True,
-        "remove_filler_words": True,
-        "remove_retakes": True,
-        "export_to_premiere": False,
-        "burn_captions": True,
-        "ass_style": {
-            "position": "Bottom",  # Options: "Top", "Middle", "Bottom"
-            "words_per_line": 10,
-            "Fontname": "Arial",
-            "Fontsize": "72",
-            "PrimaryColour": "&H00FFFFFF",
-            "Outline": 3,
-            "Shadow": 2
-        }
-    })
+    recipe = data.get('recipe', DEFAULT_RECIPE)
     task_id = str(uuid.uuid4())
+    initial_status = {"status": "PENDING", "progress": 0, "message": "Queued for processing."}
 
-    thread = threading.Thread(target=process_video_with_recipe, args=(task_id, video_url, recipe, task_status))
-    thread.start()
+    # A deadline needs an answer before the job is accepted; otherwise the queue estimates it later.
+    estimate = None
+    if recipe.get("deadline_seconds"):
+        media = probe_source(video_url)
+        estimate = estimator.estimate(recipe, media) if media else None
+    if estimate and not estimate.get("meets_deadline", True):
+        return deadline_unreachable(estimate=estimate)
+
+    admitted, required_bytes, available_bytes = reserve_disk({task_id: video_url})
+    if not admitted:
+        return insufficient_storage(required_bytes, available_bytes)
+
+    if job_queue:
+        job_queue.enqueue(task_id, video_url, recipe, initial_status, estimated_seconds=estimate["total_seconds"] if estimate else None)
+        status_relay.ensure_loaded(task_id)
+        disk_budget.watch([task_id])
+        if estimate is None:
+            estimate_in_background(task_id, lambda: estimate_job_seconds(video_url, recipe))
+    else:
+        # Registered before the thread starts so a status stream opened right after the 202 finds it.
+        task_status[task_id] = initial_status
+        disk_budget.watch([task_id])
+        thread = threading.Thread(target=process_video_with_recipe, args=(task_id, video_url, recipe, task_status))
+        thread.start()
+
+    response = {"task_id": task_id, "message": "Video processing started."}
+    if estimate:
+        response["estimated_seconds"] = estimate["total_seconds"]
+    return jsonify(response), 202
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    data = request.json
+    jobs = data.get('jobs') if data else None
+    if not jobs or not isinstance(jobs, list) or not all(isinstance(job, dict) and 'video_url' in job for job in jobs):
+        return jsonify({"error": "jobs, a list of objects with a video_url and an optional recipe, is required in the JSON body"}), 400
+
+    jobs = [{"video_url": job['video_url'], "recipe": job.get('recipe', DEFAULT_RECIPE)} for job in jobs]
+    batch_id = str(uuid.uuid4())
+    task_ids = [str(uuid.uuid4()) for _ in jobs]
+    groups = []
+    for group in plan_batch(jobs):
+        members = [{"task_id": task_ids[index], "recipe": jobs[index]["recipe"]} for index in group["job_indexes"]]
+        groups.append({"source_task_id": str(uuid.uuid4()), "video_url": group["video_url"], "members": members})
+
+    for group in groups:
+        if any(member["recipe"].get("deadline_seconds") for member in group["members"]):
+            group["estimate"] = estimate_group(group["video_url"], group["members"])
+    # Like disk admission, a batch with a job that would miss its deadline is refused as a whole.
+    late_task_ids = [task_id for group in groups if group.get("estimate") for task_id in group["estimate"]["late_task_ids"]]
+    if late_task_ids:
+        return deadline_unreachable(late_jobs=sorted(task_ids.index(task_id) for task_id in late_task_ids))
+
+    # The whole batch is admitted or refused, so it never runs half its sources.
+    source_task_ids = [group["source_task_id"] for group in groups]
+    admitted, required_bytes, available_bytes = reserve_disk({group["source_task_id"]: group["video_url"] for group in groups})
+    if not admitted:
+        return insufficient_storage(required_bytes, available_bytes)
+
+    initial_status = {"status": "PENDING", "progress": 0, "message": "Queued for processing."}
+    for group in groups:
+        if job_queue:
+            recipe = analysis_recipe([member["recipe"] for member in group["members"]])
+            estimated_seconds = group["estimate"]["total_seconds"] if group.get("estimate") else None
+            job_queue.enqueue_group(group["source_task_id"], group["video_url"], recipe, group["members"], initial_status, estimated_seconds=estimated_seconds)
+            if estimated_seconds is None:
+                estimate_in_background(group["source_task_id"], lambda group=group: (estimate_group(group["video_url"], group["members"]) or {}).get("total_seconds"))
+            for task_id in [group["source_task_id"]] + [member["task_id"] for member in group["members"]]:
+                status_relay.ensure_loaded(task_id)
+        else:
+            task_status[group["source_task_id"]] = initial_status
+            for member in group["members"]:
+                task_status[member["task_id"]] = initial_status
+    disk_budget.watch(source_task_ids)
 
-    return jsonify({"task_id": task_id, "message": "Video processing started."}), 202
+    BatchProgress(task_status, batch_id, source_task_ids, task_ids).start()
+    if not job_queue:
+        for group in groups:
+            thread = threading.Thread(target=process_source_group, args=(group["source_task_id"], group["video_url"], group["members"], task_status))
+            thread.start()
+
+    return jsonify({
+        "batch_id": batch_id,
+        "task_ids": task_ids,
+        "sources": len(groups),
+        "message": f"Batch of {len(jobs)} tasks over {len(groups)} sources started."
+    }), 202
+
+@app.route('/estimate', methods=['POST'])
+def estimate_job():
+    data = request.json
+    metadata = data.get('metadata') if data else None
+    if not data or not ('video_url' in data or isinstance(metadata, dict)):
+        return jsonify({"error": "video_url (or metadata with duration, width and height) is required in the JSON body"}), 400
+
+    if isinstance(metadata, dict):
+        # bool is an int subclass, but true/false is no duration or size.
+        if not all(isinstance(metadata.get(key), (int, float)) and not isinstance(metadata.get(key), bool) and metadata[key] >= 0
+                   for key in ("duration", "width", "height")):
+            return jsonify({"error": "metadata needs numeric duration, width and height"}), 400
+
+    recipe = data.get('recipe', DEFAULT_RECIPE)
+    media = metadata if isinstance(metadata, dict) else probe_source(data['video_url'])
+    if media is None:
+        return jsonify({"error": "Could not read the video's metadata from video_url"}), 422
+    return jsonify(estimator.estimate(recipe, media))
 
 @app.route('/task_status/<task_id>')
 def get_task_status(task_id):
-    def generate_updates():
-        while True:
-            if task_id in task_status:
-                status = task_status[task_id]
-                yield f"data: {json.dumps(status)}\n\n"
-                if status["status"] in ["COMPLETED", "FAILED"]:
-                    break
-            time.sleep(1) # Poll every 1 second
-
-    return Response(generate_updates(), mimetype='text/event-stream')
+    if not task_is_known(task_id):
+        return jsonify({"error": "Unknown or expired task_id"}), 404
+
+    last_event_id = request.headers.get("Last-Event-ID")
+    return Response(stream_task_events(task_status, task_id, last_event_id), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def restart_task(task_id, video_url, recipe, status):
+    """Runs a known task again under the same task_id. Returns False if it is still running."""
+    if job_queue:
+        if not job_queue.requeue(task_id, video_url, recipe, status):
+            return False
+        status_relay.ensure_loaded(task_id)
+        return True
+    if task_id in task_status and task_status[task_id].get("status") not in TERMINAL_STATUSES:
+        return False
+    discard_cancel_request(task_id)
+    task_status[task_id] = status
+    thread = threading.Thread(target=process_video_with_recipe, args=(task_id, video_url, recipe, task_status))
+    thread.start()
+    return True
+
+@app.route('/task/<task_id>/retry', methods=['POST'])
+def retry_task(task_id):
+    manifest = load_manifest(task_id)
+    if manifest is None:
+        return jsonify({"error": "No checkpoint found for task_id"}), 404
+    if manifest.get("status") == "COMPLETED":
+        return jsonify({"error": "Task already completed"}), 409
+
+    retry_status = {"status": "PENDING", "progress": 0, "message": "Queued for retry."}
+    if not restart_task(task_id, manifest["video_url"], manifest["recipe"], retry_status):
+        return jsonify({"error": "Task is still running"}), 409
+    return jsonify({"task_id": task_id, "message": "Retry started.", "completed_stages": completed_stages(manifest)}), 202
+
+@app.route('/task/<task_id>/rerender', methods=['POST'])
+def rerender_task(task_id):
+    data = request.json
+    if not data or not isinstance(data.get('recipe'), dict):
+        return jsonify({"error": "recipe (the keys to change) is required in the JSON body"}), 400
+    manifest = load_manifest(task_id)
+    if manifest is None:
+        return jsonify({"error": "No checkpoint found for task_id"}), 404
+
+    recipe = merge_recipe(manifest["recipe"], data['recipe'])
+    changed_keys = sorted(key for key in set(recipe) | set(manifest["recipe"]) if recipe.get(key) != manifest["recipe"].get(key))
+    rerender_status = {"status": "PENDING", "progress": 0, "message": "Queued for re-render."}
+    if not restart_task(task_id, manifest["video_url"], recipe, rerender_status):
+        return jsonify({"error": "Task is still running"}), 409
+    return jsonify({"task_id": task_id, "message": "Re-render started.", "changed_keys": changed_keys}), 202
+
+@app.route('/task/<task_id>', methods=['DELETE'])
+def cancel_task(task_id):
+    if not task_is_known(task_id):
+        return jsonify({"error": "Unknown or expired task_id"}), 404
+    status = task_status[task_id]
+    if status.get("status") in TERMINAL_STATUSES:
+        return jsonify({"error": f"Task already finished with status {status.get('status')}"}), 409
+
+    # A batch id cancels every task of the batch, including the shared source analyses.
+    task_ids = status.get("source_task_ids", []) + status.get("task_ids", []) if "task_ids" in status else [task_id]
+    for cancel_id in task_ids:
+        if task_status.get(cancel_id, {}).get("status") in TERMINAL_STATUSES:
+            continue
+        if job_queue:
+            job_queue.request_cancel(cancel_id)
+        else:
+            request_cancel(cancel_id)
+    return jsonify({"task_id": task_id, "message": "Cancellation requested."}), 202
+
+def completed_result(task_id):
+    manifest = load_manifest(task_id)
+    if manifest is None or manifest.get("status") != "COMPLETED":
+        return None
+    return manifest.get("result") or {}
+
+def send_artifact(artifact):
+    """
+    Serves an artifact file with Range, If-Range and conditional-GET support. The ETag
+    is the content hash recorded when the task completed, so it is strong and stable
+    across servers and restarts.
+    """
+    if not os.path.exists(artifact["path"]):
+        return jsonify({"error": "Artifact file is no longer available"}), 410
+    return send_file(artifact["path"], conditional=True, etag=current_sha256(artifact),
+                     download_name=os.path.basename(artifact["path"]))
+
+@app.route('/task/<task_id>/artifact/<name>')
+def get_artifact(task_id, name):
+    result = completed_result(task_id)
+    if result is None:
+        return jsonify({"error": "Unknown task_id or task not completed"}), 404
+    artifacts = result.get("artifacts") or {}
+    if name not in artifacts:
+        return jsonify({"error": f"No artifact named {name}", "artifacts": sorted(artifacts)}), 404
+    touch_task(task_id)
+    return send_artifact(artifacts[name])
+
+def completed_waveform(task_id):
+    """(waveform, result) of a completed task that built a waveform, else (None, None)."""
+    result = completed_result(task_id)
+    waveform = (result or {}).get("waveform")
+    if not waveform or not os.path.exists(waveform["path"]):
+        return None, None
+    return waveform, result
+
+@app.route('/task/<task_id>/waveform')
+def get_waveform(task_id):
+    """
+    Waveform index and the proposed silence/filler/retake cuts, for a review client.
+    With start and end (seconds) only the cuts in that window are returned, and with
+    pixels also the pyramid level and byte range of /waveform/peaks to read for it.
+    """
+    waveform, result = completed_waveform(task_id)
+    if waveform is None:
+        return jsonify({"error": "No waveform for task_id; the task must complete with \"waveform\": true in its recipe"}), 404
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    pixels = request.args.get('pixels', type=int)
+    index = {key: value for key, value in waveform.items() if key != "path"}
+    return jsonify({
+        "task_id": task_id,
+        "waveform": index,
+        "peaks_url": f"/task/{task_id}/waveform/peaks",
+        "window": peak_window(index, start, end, pixels),
+        "intervals": review_intervals(result.get("silence_intervals"), result.get("filler_words"), result.get("retakes"), start, end),
+    })
+
+@app.route('/task/<task_id>/waveform/peaks')
+def get_waveform_peaks(task_id):
+    # Supports Range requests, so a client reads just the window's byte_range.
+    return get_artifact(task_id, "waveform_peaks")
+
+@app.route('/metrics')
+def metrics():
+    if job_queue:
+        update_queue_gauges(job_queue)
+    body, content_type = render_metrics()
+    return Response(body, mimetype=content_type)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import logging
+import re
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, task_status, task_is_known
+from utils.task_events import astream_task_events
+
+# Async serving mode: `uvicorn asgi:application --host 0.0.0.0 --port 8080`.
+# /task_status streams run as coroutines on the event loop, so open SSE connections no
+# longer hold an OS thread each. Every other route is the unchanged Flask app, run by
+# asgiref in its worker thread pool; pipeline work still runs in its own threads, so no
+# ffmpeg or Gemini call ever blocks the loop.
+
+_TASK_STATUS_PATH = re.compile(r'^/task_status/(?P<task_id>[^/]+)$')
+
+flask_application = WsgiToAsgi(app)
+
+async def _send_json(send, status, body):
+    payload = json.dumps(body).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+async def task_status_stream(scope, receive, send, task_id):
+    if not task_is_known(task_id):
+        await _send_json(send, 404, {"error": "Unknown or expired task_id"})
+        return
+
+    headers = dict(scope.get("headers") or [])
+    last_event_id = headers.get(b"last-event-id")
+    if last_event_id is not None:
+        last_event_id = last_event_id.decode('latin-1')
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(_watch_disconnect(receive, disconnected))
+    try:
+        async for chunk in astream_task_events(task_status, task_id, last_event_id):
+            if disconnected.is_set():
+                break
+            await send({"type": "http.response.body", "body": chunk.encode('utf-8'), "more_body": True})
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+    except OSError as e:
+        logging.info(f"[{task_id}] Status stream closed: {e}")
+    finally:
+        watcher.cancel()
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http" and scope["method"] == "GET":
+        match = _TASK_STATUS_PATH.match(scope["path"])
+        if match:
+            await task_status_stream(scope, receive, send, match.group("task_id"))
+            return
+
+    await flask_application(scope, receive, send)
@@ -0,0 +1,186 @@
+import json
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import google.generativeai as genai
+
+from benchmarks.synthetic_media import speech_pattern, DEFAULT_SPEECH_SECONDS, DEFAULT_SILENCE_SECONDS
+
+_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_SRT_TIME = re.compile(r"--> (\d+):(\d+):(\d+),(\d+)")
+_WORDS = ("so", "today", "we", "are", "going", "to", "look", "at", "how", "the", "pipeline", "handles", "long", "recordings")
+
+def _probe_duration(path):
+    process = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = _DURATION.search(process.stderr)
+    if not match:
+        raise ValueError(f"Could not read the duration of {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def _srt_duration(srt_content):
+    times = _SRT_TIME.findall(srt_content or "")
+    if not times:
+        return 0.0
+    hours, minutes, seconds, millis = map(int, times[-1])
+    return hours * 3600 + minutes * 60 + seconds + millis / 1000
+
+def _clock(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+class _State:
+    def __init__(self, name):
+        self.name = name
+
+class FakeFile:
+    def __init__(self, name, path, duration):
+        self.name = name
+        self.path = path
+        self.duration = duration
+        self.state = _State("ACTIVE")
+
+class _Usage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+class _Content:
+    def __init__(self, text):
+        self.parts = [text]
+
+class _Candidate:
+    def __init__(self, text):
+        self.content = _Content(text)
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.candidates = [_Candidate(text)]
+        self.usage_metadata = _Usage(prompt_tokens, len(text) // 4)
+
+class FakeGemini:
+    """
+    Local stand-in for the google.generativeai calls the pipeline makes. Answers are
+    canned from the synthetic speech/silence pattern of the uploaded media (or of the
+    transcript, for text prompts), so every stage downstream of Gemini gets realistic
+    input: words in the speech, silences to cut, a filler word and a retake now and then.
+    Each upload and generate call sleeps for the configured latency first.
+    """
+
+    def __init__(self, speech_seconds=DEFAULT_SPEECH_SECONDS, silence_seconds=DEFAULT_SILENCE_SECONDS,
+                 generate_latency=0.0, upload_latency=0.0, words_per_second=2.5, filler_every=20, retake_every=60.0):
+        self.speech_seconds = speech_seconds
+        self.silence_seconds = silence_seconds
+        self.generate_latency = generate_latency
+        self.upload_latency = upload_latency
+        self.words_per_second = words_per_second
+        self.filler_every = filler_every
+        self.retake_every = retake_every
+        self.calls = {}
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _count(self, kind):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    @contextmanager
+    def installed(self):
+        """Swaps the fake into google.generativeai for the duration of the block."""
+        originals = {name: getattr(genai, name) for name in ("upload_file", "get_file", "delete_file", "GenerativeModel")}
+        genai.upload_file = self.upload_file
+        genai.get_file = self.get_file
+        genai.delete_file = self.delete_file
+        genai.GenerativeModel = lambda model_name, *args, **kwargs: _FakeModel(self)
+        try:
+            yield self
+        finally:
+            for name, original in originals.items():
+                setattr(genai, name, original)
+
+    def upload_file(self, path, **kwargs):
+        self._count("upload")
+        time.sleep(self.upload_latency)
+        with self._lock:
+            name = f"files/fake-{len(self._files)}"
+            self._files[name] = FakeFile(name, path, _probe_duration(path))
+            return self._files[name]
+
+    def get_file(self, name):
+        return self._files[name]
+
+    def delete_file(self, name):
+        self._count("delete")
+        with self._lock:
+            self._files.pop(name, None)
+
+    def _words(self, duration):
+        speech, _ = speech_pattern(duration, self.speech_seconds, self.silence_seconds)
+        step = 1.0 / self.words_per_second
+        words = []
+        for interval in speech:
+            start = interval["start"]
+            while start + step <= interval["end"]:
+                filler = self.filler_every and len(words) % self.filler_every == self.filler_every - 1
+                words.append({
+                    "word": "um" if filler else _WORDS[len(words) % len(_WORDS)],
+                    "start": round(start, 3),
+                    "end": round(start + step * 0.8, 3),
+                    "speaker": "SPEAKER_00",
+                })
+                start += step
+        return words
+
+    def generate(self, contents):
+        self._count("generate")
+        time.sleep(self.generate_latency)
+        if isinstance(contents, str):
+            contents = [contents]
+        prompt = contents[0]
+        media = next((item for item in contents[1:] if isinstance(item, FakeFile)), None)
+        duration = media.duration if media else _srt_duration(prompt)
+
+        if "word-level transcription" in prompt:
+            result = {"words": self._words(duration)}
+        elif "filler words" in prompt:
+            result = {"filler_words": [
+                {"word": word["word"], "start": _clock(word["start"]), "end": _clock(word["end"]), "can_be_removed": True, "reasoning": "Hesitation."}
+                for word in self._words(duration) if word["word"] == "um"
+            ]}
+        elif "silent intervals" in prompt:
+            _, silence = speech_pattern(duration, self.speech_seconds, self.silence_seconds)
+            result = {"silent_intervals": silence}
+        elif "silent pause in a larger video" in prompt:
+            return FakeResponse("REMOVE", len(prompt) // 4)
+        elif "Podcast or a Short-form" in prompt:
+            if duration > 600:
+                result = {"type": "Podcast", "topics": [{"timestamp": _clock(start)[:8], "topic": f"Topic {i + 1}"} for i, start in enumerate(range(0, int(duration), 300))]}
+            else:
+                result = {"type": "Short-form", "topic": "Synthetic test recording"}
+        elif "B-roll" in prompt:
+            result = {"b_roll_suggestions": [{"timestamp": _clock(start)[:8], "suggestion": "Wide shot of the subject."} for start in range(0, int(duration), 60)]}
+        elif "re-takes or repeated phrases" in prompt:
+            # The first second of every retake_every-th second of speech is a stumble.
+            speech, _ = speech_pattern(duration, self.speech_seconds, self.silence_seconds)
+            starts = [interval["start"] for interval in speech]
+            result = {"retakes_to_remove": [
+                {"start": start, "end": start + 1.0, "reasoning": "Speaker restarted the sentence."}
+                for start in starts if self.retake_every and start > 0 and start % self.retake_every < self.speech_seconds + self.silence_seconds
+            ]}
+        elif "JSON is invalid" in prompt:
+            return FakeResponse(prompt.split("\n\n", 1)[-1], len(prompt) // 4)
+        else:
+            raise ValueError(f"FakeGemini has no canned answer for prompt: {prompt[:80]!r}")
+        return FakeResponse(json.dumps(result), len(prompt) // 4)
+
+class _FakeModel:
+    def __init__(self, fake):
+        self._fake = fake
+
+    def generate_content(self, contents, **kwargs):
+        return self._fake.generate(contents)
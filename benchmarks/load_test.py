@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+from benchmarks.pipeline_benchmark import RESULTS_DIR, WORK_DIR, _git_revision
+from benchmarks.stub_server import raise_open_file_limit, DEFAULT_STAGES, DEFAULT_STAGE_SECONDS
+
+SAMPLE_INTERVAL = 0.5
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": round(rank(50), 2),
+        "p90": round(rank(90), 2),
+        "p95": round(rank(95), 2),
+        "p99": round(rank(99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+class HttpError(Exception):
+    pass
+
+async def _open(host, port, method, path, body=None, timeout=30):
+    """Sends one HTTP/1.1 request on a new connection; returns (status, headers, reader, writer)."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\nAccept: */*\r\n"
+    if body is not None:
+        head += "Content-Type: application/json\r\n"
+    head += f"Content-Length: {len(payload)}\r\n\r\n"
+    writer.write(head.encode("latin-1") + payload)
+    await writer.drain()
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    if not status_line:
+        raise HttpError("connection closed before response")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, headers, reader, writer
+
+async def _body_chunks(headers, reader):
+    """Yields the response body as it arrives, decoding chunked transfer encoding."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                return
+            chunk = await reader.readexactly(size)
+            await reader.readline()
+            yield chunk
+    elif "content-length" in headers:
+        yield await reader.readexactly(int(headers["content-length"]))
+    else:
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return
+            yield chunk
+
+def _close(writer):
+    try:
+        writer.close()
+    except OSError:
+        pass
+
+class LoadTest:
+    def __init__(self, base_url, clients, ramp_seconds, stream_timeout, server_pid=None):
+        url = urlparse(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.clients = clients
+        self.ramp_seconds = ramp_seconds
+        self.stream_timeout = stream_timeout
+        self.server_pid = server_pid
+        self.started_at = None
+        self.submit_ms = []
+        self.connect_ms = []
+        self.lag_ms = []
+        self.errors = {}
+        self.open_streams = 0
+        self.max_open_streams = 0
+        self.completed_streams = 0
+        self.first_error_open_streams = None
+        self.samples = []
+
+    def _error(self, kind, e):
+        key = f"{kind}: {type(e).__name__}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+        if self.first_error_open_streams is None:
+            self.first_error_open_streams = self.open_streams
+
+    async def _submit(self, index):
+        start = time.perf_counter()
+        status, headers, reader, writer = await _open(self.host, self.port, "POST", "/process_video",
+                                                      {"video_url": f"http://example.invalid/load-{index}.mp4", "recipe": {}})
+        try:
+            body = b"".join([chunk async for chunk in _body_chunks(headers, reader)])
+        finally:
+            _close(writer)
+        if status != 202:
+            raise HttpError(f"POST /process_video returned {status}")
+        self.submit_ms.append((time.perf_counter() - start) * 1000)
+        return json.loads(body)["task_id"]
+
+    async def _follow(self, task_id):
+        start = time.perf_counter()
+        status, headers, reader, writer = await _open(self.host, self.port, "GET", f"/task_status/{task_id}")
+        if status != 200:
+            _close(writer)
+            raise HttpError(f"GET /task_status returned {status}")
+        self.connect_ms.append((time.perf_counter() - start) * 1000)
+        self.open_streams += 1
+        self.max_open_streams = max(self.max_open_streams, self.open_streams)
+        try:
+            buffer = b""
+            event_type = None
+            async for chunk in _body_chunks(headers, reader):
+                received_at = time.time()
+                buffer += chunk
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    line = line.decode("utf-8").rstrip("\r")
+                    if line.startswith("event:"):
+                        event_type = line[6:].strip()
+                    elif line.startswith("data:") and event_type != "snapshot":
+                        data = json.loads(line[5:])
+                        if "sent_at" in data:
+                            self.lag_ms.append((received_at - data["sent_at"]) * 1000)
+                        if event_type in ("completed", "failed", "cancelled"):
+                            self.completed_streams += 1
+                            return
+                    elif not line:
+                        event_type = None
+        finally:
+            self.open_streams -= 1
+            _close(writer)
+
+    async def _client(self, index):
+        await asyncio.sleep(index * self.ramp_seconds / max(self.clients, 1))
+        try:
+            task_id = await self._submit(index)
+        except (OSError, asyncio.TimeoutError, HttpError, ValueError, KeyError) as e:
+            self._error("submit", e)
+            return
+        try:
+            await asyncio.wait_for(self._follow(task_id), self.stream_timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpError, ValueError) as e:
+            self._error("stream", e)
+
+    def _sample_server(self):
+        sample = {"t": round(time.monotonic() - self.started_at, 2), "open_streams": self.open_streams}
+        if self.server_pid:
+            try:
+                with open(f"/proc/{self.server_pid}/status", "r") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            sample["rss_bytes"] = int(line.split()[1]) * 1024
+                        elif line.startswith("Threads:"):
+                            sample["threads"] = int(line.split()[1])
+                sample["open_fds"] = len(os.listdir(f"/proc/{self.server_pid}/fd"))
+            except OSError:
+                pass
+        self.samples.append(sample)
+
+    async def _sampler(self, done):
+        while not done.is_set():
+            self._sample_server()
+            try:
+                await asyncio.wait_for(done.wait(), SAMPLE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        self._sample_server()
+
+    async def run(self):
+        self.started_at = time.monotonic()
+        done = asyncio.Event()
+        sampler = asyncio.create_task(self._sampler(done))
+        await asyncio.gather(*(self._client(index) for index in range(self.clients)))
+        done.set()
+        await sampler
+        return self.summary(time.monotonic() - self.started_at)
+
+    def summary(self, duration):
+        server = [sample for sample in self.samples if "rss_bytes" in sample]
+        return {
+            "duration_seconds": round(duration, 2),
+            "submissions": {"ok": len(self.submit_ms), "latency_ms": percentiles(self.submit_ms)},
+            "streams": {
+                "opened": len(self.connect_ms),
+                "completed": self.completed_streams,
+                "max_open": self.max_open_streams,
+                "connect_ms": percentiles(self.connect_ms),
+            },
+            "sse_lag_ms": percentiles(self.lag_ms),
+            "errors": self.errors,
+            "first_error_at_open_streams": self.first_error_open_streams,
+            "server": {
+                "rss_bytes_start": server[0]["rss_bytes"] if server else None,
+                "rss_bytes_peak": max(sample["rss_bytes"] for sample in server) if server else None,
+                "rss_bytes_end": server[-1]["rss_bytes"] if server else None,
+                "threads_peak": max(sample["threads"] for sample in server) if server else None,
+                "threads_end": server[-1]["threads"] if server else None,
+                "open_fds_peak": max(sample["open_fds"] for sample in server) if server else None,
+            },
+            "samples": self.samples,
+        }
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_stub_server(mode, stages, stage_seconds, work_dir):
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_server", "--mode", mode, "--port", str(port),
+         "--stages", str(stages), "--stage-seconds", str(stage_seconds), "--work-dir", work_dir],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Stub server exited with code {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Stub server did not start listening within 30 seconds")
+
+def _print_summary(summary):
+    submit = summary["submissions"]["latency_ms"] or {}
+    lag = summary["sse_lag_ms"] or {}
+    server = summary["server"]
+    print(f"submissions: {summary['submissions']['ok']} ok, latency p50 {submit.get('p50')} ms, p99 {submit.get('p99')} ms, max {submit.get('max')} ms")
+    print(f"streams: {summary['streams']['opened']} opened, {summary['streams']['completed']} completed, {summary['streams']['max_open']} open at peak")
+    print(f"SSE lag: p50 {lag.get('p50')} ms, p99 {lag.get('p99')} ms, max {lag.get('max')} ms over {lag.get('count')} events")
+    if server["rss_bytes_peak"] is not None:
+        print(f"server: RSS {server['rss_bytes_start'] / 2**20:.0f} -> {server['rss_bytes_peak'] / 2**20:.0f} MiB peak -> {server['rss_bytes_end'] / 2**20:.0f} MiB, "
+              f"threads peak {server['threads_peak']} (end {server['threads_end']}), fds peak {server['open_fds_peak']}")
+    if summary["errors"]:
+        print(f"errors (first at {summary['first_error_at_open_streams']} open streams): {summary['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /process_video and /task_status against a server with stubbed pipeline stages.")
+    parser.add_argument("--clients", type=int, default=500, help="Clients; each submits one job and follows its status stream to the end.")
+    parser.add_argument("--ramp-seconds", type=float, default=10.0, help="Clients start evenly spread over this many seconds.")
+    parser.add_argument("--mode", choices=("flask", "asgi"), default="asgi", help="Server to start (ignored with --url).")
+    parser.add_argument("--stages", type=int, default=DEFAULT_STAGES, help="Status updates per stub job.")
+    parser.add_argument("--stage-seconds", type=float, default=DEFAULT_STAGE_SECONDS, help="Seconds between a stub job's updates.")
+    parser.add_argument("--url", default=None, help="Test an already running server (started with benchmarks.stub_server) instead.")
+    parser.add_argument("--server-pid", type=int, default=None, help="With --url: PID to sample memory, threads and fds of.")
+    parser.add_argument("--stream-timeout", type=float, default=300.0, help="Give up on a status stream after this many seconds.")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--output", default=None, help=f"Results file (default: {RESULTS_DIR}/load_<time>_<commit>.json).")
+    args = parser.parse_args()
+
+    raise_open_file_limit()
+    server = None
+    if args.url:
+        base_url, server_pid = args.url, args.server_pid
+    else:
+        server, base_url = start_stub_server(args.mode, args.stages, args.stage_seconds, os.path.abspath(args.work_dir))
+        server_pid = server.pid
+    print(f"{args.clients} clients over {args.ramp_seconds:g}s against {base_url}...", flush=True)
+    try:
+        summary = asyncio.run(LoadTest(base_url, args.clients, args.ramp_seconds, args.stream_timeout, server_pid).run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    commit, dirty = _git_revision()
+    created_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    results = {
+        "created_at": created_at,
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "config": {
+            "clients": args.clients, "ramp_seconds": args.ramp_seconds, "mode": None if args.url else args.mode,
+            "url": args.url, "stages": args.stages, "stage_seconds": args.stage_seconds,
+        },
+        **summary,
+    }
+    _print_summary(summary)
+    output = args.output or os.path.join(RESULTS_DIR, f"load_{created_at.replace(':', '')}_{(commit or 'nogit')[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
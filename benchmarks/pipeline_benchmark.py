@@ -0,0 +1,369 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from benchmarks.synthetic_media import generate_media, DEFAULT_SPEECH_SECONDS, DEFAULT_SILENCE_SECONDS
+from benchmarks.fake_gemini import FakeGemini
+from utils.checkpoint import TaskCheckpoint
+from utils.task_events import TaskStatusStore
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+WORK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".work")
+RSS_SAMPLE_INTERVAL = 0.05
+
+RECIPES = {
+    # Gemini analysis only: download, noise reduction, transcription and detection.
+    "analysis": {
+        "apply_noise_reduction": True,
+        "transcribe": True,
+        "detect_silence": True,
+        "classify_content": True,
+        "detect_filler_words": True,
+        "suggest_b_roll": True,
+        "detect_retakes": True,
+    },
+    # The default /process_video recipe: analysis, cut and burned-in captions.
+    "full": {
+        "apply_noise_reduction": True,
+        "transcribe": True,
+        "detect_silence": True,
+        "classify_content": True,
+        "detect_filler_words": True,
+        "detect_retakes": True,
+        "cut_video": True,
+        "remove_silence": True,
+        "remove_filler_words": True,
+        "remove_retakes": True,
+        "burn_captions": True,
+    },
+    "premiere": {
+        "transcribe": True,
+        "detect_silence": True,
+        "detect_filler_words": True,
+        "remove_silence": True,
+        "remove_filler_words": True,
+        "export_to_premiere": True,
+    },
+}
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    # ffmpeg and render pool processes count once they have been waited for, which
+    # every pipeline step does before it returns.
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def _bytes_written():
+    """write() bytes of this process and its reaped children (ffmpeg), or None off Linux."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def _process_tree_rss(root_pid, exclude=()):
+    """Resident memory of root_pid and all its descendants, from /proc."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree = {root_pid}
+    grew = True
+    while grew:
+        children = {pid for pid, parent in parents.items() if parent in tree and pid not in tree and pid not in exclude}
+        tree |= children
+        grew = bool(children)
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for pid in tree:
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+class RssSampler:
+    """Samples the RSS of this process tree in the background and tracks the peak since the last reset."""
+
+    def __init__(self, exclude=()):
+        self._exclude = set(exclude)
+        self._enabled = os.path.exists("/proc/self/statm")
+        self._peak = 0
+        self._overall_peak = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def start(self):
+        if self._enabled:
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _sample(self):
+        rss = _process_tree_rss(os.getpid(), self._exclude)
+        with self._lock:
+            self._peak = max(self._peak, rss)
+            self._overall_peak = max(self._overall_peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self._sample()
+
+    def reset(self):
+        """Returns the peak since the previous reset and starts a new window."""
+        if not self._enabled:
+            return None
+        self._sample()
+        with self._lock:
+            peak, self._peak = self._peak, 0
+        return peak
+
+    @property
+    def overall_peak(self):
+        if not self._enabled:
+            # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+            scale = 1 if sys.platform == "darwin" else 1024
+            return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+        return self._overall_peak
+
+@contextmanager
+def profile_stages(sampler):
+    """
+    Wraps TaskCheckpoint.run_stage to record wall time, CPU time, peak RSS and bytes
+    written around every stage. Yields the dict the stage profiles are collected in.
+    """
+    stages = {}
+    original_run_stage = TaskCheckpoint.run_stage
+
+    def run_stage(checkpoint, name, fn, task_status, inputs):
+        sampler.reset()
+        wall_start, cpu_start, written_start = time.perf_counter(), _cpu_seconds(), _bytes_written()
+        try:
+            return original_run_stage(checkpoint, name, fn, task_status, inputs)
+        finally:
+            written_end = _bytes_written()
+            timing = checkpoint.timings.get(name, {})
+            stages[name] = {
+                "wall_seconds": round(time.perf_counter() - wall_start, 3),
+                "cpu_seconds": round(_cpu_seconds() - cpu_start, 3),
+                "peak_rss_bytes": sampler.reset(),
+                "bytes_written": written_end - written_start if written_start is not None else None,
+                "artifact_bytes": timing.get("bytes_out"),
+                "reused": timing.get("reused", False),
+            }
+
+    TaskCheckpoint.run_stage = run_stage
+    try:
+        yield stages
+    finally:
+        TaskCheckpoint.run_stage = original_run_stage
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def serve_directory(directory):
+    """Serves directory over HTTP from a separate process, so the download stage has a real URL."""
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1", "--directory", directory],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        yield f"http://127.0.0.1:{port}", server.pid
+    finally:
+        server.terminate()
+        server.wait()
+
+def run_once(base_url, media_path, recipe, fake, sampler):
+    from video_processing import process_video_with_recipe
+
+    task_id = f"bench-{uuid.uuid4().hex[:8]}"
+    task_status = TaskStatusStore()
+    video_url = f"{base_url}/{os.path.basename(media_path)}"
+    sampler.reset()
+    wall_start, cpu_start, written_start = time.perf_counter(), _cpu_seconds(), _bytes_written()
+    with profile_stages(sampler) as stages, fake.installed():
+        process_video_with_recipe(task_id, video_url, recipe, task_status)
+    written_end = _bytes_written()
+    status = task_status[task_id]
+    return task_id, {
+        "status": status.get("status"),
+        "error": status.get("error"),
+        "wall_seconds": round(time.perf_counter() - wall_start, 3),
+        "cpu_seconds": round(_cpu_seconds() - cpu_start, 3),
+        "peak_rss_bytes": max((stage["peak_rss_bytes"] or 0 for stage in stages.values()), default=None),
+        "bytes_written": written_end - written_start if written_start is not None else None,
+        "stages": stages,
+    }
+
+def _git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def _ffmpeg_version():
+    try:
+        return subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+def _load_recipe(name):
+    if name in RECIPES:
+        return RECIPES[name]
+    with open(name, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def run_benchmarks(args):
+    work_dir = os.path.abspath(args.work_dir)
+    media_dir = os.path.join(work_dir, "media")
+    tasks_dir = os.path.join(work_dir, "tasks")
+    os.makedirs(tasks_dir, exist_ok=True)
+    os.environ["TASKS_DIR"] = tasks_dir
+    logging.basicConfig(level=logging.INFO, filename=os.path.join(work_dir, "benchmark.log"),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    width, height = (int(value) for value in args.resolution.split("x"))
+    fake = FakeGemini(speech_seconds=args.speech_seconds, silence_seconds=args.silence_seconds,
+                      generate_latency=args.gemini_latency, upload_latency=args.upload_latency)
+
+    commit, dirty = _git_revision()
+    results = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpu_count": os.cpu_count(), "ffmpeg": _ffmpeg_version()},
+        "config": {
+            "minutes": args.minutes, "recipes": args.recipe, "repeat": args.repeat, "resolution": args.resolution, "fps": args.fps,
+            "speech_seconds": args.speech_seconds, "silence_seconds": args.silence_seconds,
+            "gemini_latency": args.gemini_latency, "upload_latency": args.upload_latency,
+        },
+        "runs": [],
+    }
+
+    # Sessions run in the cwd so services' temp files land in the work dir, not the checkout.
+    previous_cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for minutes in args.minutes:
+            print(f"Preparing {minutes:g} min of synthetic media...", flush=True)
+            media_path = generate_media(media_dir, minutes, args.speech_seconds, args.silence_seconds, width, height, args.fps)
+            with serve_directory(media_dir) as (base_url, server_pid):
+                sampler = RssSampler(exclude={server_pid}).start()
+                try:
+                    for recipe_name in args.recipe:
+                        recipe = _load_recipe(recipe_name)
+                        for repeat in range(args.repeat):
+                            task_id, run = run_once(base_url, media_path, recipe, fake, sampler)
+                            run.update({"minutes": minutes, "media_bytes": os.path.getsize(media_path), "recipe": recipe_name, "repeat": repeat})
+                            results["runs"].append(run)
+                            print(f"  {recipe_name} #{repeat + 1}: {run['status']} in {run['wall_seconds']:.1f}s wall, {run['cpu_seconds']:.1f}s CPU", flush=True)
+                            if not args.keep_artifacts:
+                                shutil.rmtree(os.path.join(tasks_dir, task_id), ignore_errors=True)
+                finally:
+                    sampler.stop()
+    finally:
+        os.chdir(previous_cwd)
+    results["gemini_calls"] = dict(fake.calls)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['created_at'].replace(':', '')}_{(commit or 'nogit')[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    return output
+
+def _stage_means(results):
+    """{(minutes, recipe, stage): mean wall seconds} over repeats, with the whole run as stage "total"."""
+    sums = {}
+    for run in results["runs"]:
+        entries = {"total": run["wall_seconds"], **{name: stage["wall_seconds"] for name, stage in run["stages"].items()}}
+        for stage, seconds in entries.items():
+            key = (run["minutes"], run["recipe"], stage)
+            total, count = sums.get(key, (0.0, 0))
+            sums[key] = (total + seconds, count + 1)
+    return {key: total / count for key, (total, count) in sums.items()}
+
+def compare_results(baseline_path, candidate_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(candidate_path, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+    print(f"baseline  {baseline.get('git_commit')} ({baseline['created_at']})")
+    print(f"candidate {candidate.get('git_commit')} ({candidate['created_at']})")
+    before, after = _stage_means(baseline), _stage_means(candidate)
+    print(f"{'minutes':>7}  {'recipe':<10} {'stage':<22} {'baseline s':>10} {'candidate s':>11} {'change':>8}")
+    for key in sorted(set(before) & set(after), key=lambda key: (key[0], key[1], key[2] != "total", key[2])):
+        minutes, recipe, stage = key
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(f"{minutes:>7g}  {recipe:<10} {stage:<22} {before[key]:>10.2f} {after[key]:>11.2f} {change:>+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Storyboard AI pipeline on synthetic media with a local Gemini stand-in.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmark and write a JSON results file.")
+    run_parser.add_argument("--minutes", type=float, nargs="+", default=[1.0], help="Lengths of synthetic recording to benchmark (1 to 120).")
+    run_parser.add_argument("--recipe", nargs="+", default=["full"], help=f"Recipe presets ({', '.join(RECIPES)}) or paths of recipe JSON files.")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Runs per length and recipe.")
+    run_parser.add_argument("--resolution", default="1280x720")
+    run_parser.add_argument("--fps", type=float, default=30)
+    run_parser.add_argument("--speech-seconds", type=float, default=DEFAULT_SPEECH_SECONDS, help="Length of each tone (speech) block.")
+    run_parser.add_argument("--silence-seconds", type=float, default=DEFAULT_SILENCE_SECONDS, help="Length of the silence after each tone block.")
+    run_parser.add_argument("--gemini-latency", type=float, default=0.5, help="Seconds each fake Gemini generate call takes.")
+    run_parser.add_argument("--upload-latency", type=float, default=0.2, help="Seconds each fake Gemini upload takes.")
+    run_parser.add_argument("--work-dir", default=WORK_DIR, help="Cached media, task directories and the benchmark log.")
+    run_parser.add_argument("--output", default=None, help=f"Results file (default: {RESULTS_DIR}/<time>_<commit>.json).")
+    run_parser.add_argument("--keep-artifacts", action="store_true", help="Keep each run's task directory.")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare per-stage wall time of two results files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        if not all(1 <= minutes <= 120 for minutes in args.minutes):
+            parser.error("--minutes must be between 1 and 120")
+        run_benchmarks(args)
+    else:
+        compare_results(args.baseline, args.candidate)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import resource
+import time
+
+DEFAULT_STAGES = 20
+DEFAULT_STAGE_SECONDS = 1.0
+
+def raise_open_file_limit():
+    """Lifts the soft RLIMIT_NOFILE to the hard limit; every open stream is a socket."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else 65536
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+def stub_pipeline(stages=DEFAULT_STAGES, stage_seconds=DEFAULT_STAGE_SECONDS):
+    """
+    Stand-in for process_video_with_recipe that does no media work: it publishes one
+    status update per stage, stage_seconds apart. Every update carries "sent_at" (epoch
+    seconds), so a client on the same host can measure SSE delivery lag.
+    """
+    def process_video_with_recipe(task_id, video_url, recipe, task_status):
+        task_status[task_id].update({"status": "RUNNING", "progress": 0, "message": "Stub pipeline started.", "sent_at": time.time()})
+        for stage in range(stages):
+            time.sleep(stage_seconds)
+            task_status[task_id].update({
+                "progress": round((stage + 1) * 100 / (stages + 1)),
+                "message": f"Stub stage {stage + 1} of {stages}.",
+                "sent_at": time.time(),
+            })
+        task_status[task_id].update({"status": "COMPLETED", "progress": 100, "message": "Stub pipeline complete.", "result": {}, "sent_at": time.time()})
+    return process_video_with_recipe
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Storyboard AI API with stubbed pipeline stages, for load tests.")
+    parser.add_argument("--mode", choices=("flask", "asgi"), default="asgi", help="Threaded Flask server or uvicorn with asgi:application.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--stages", type=int, default=DEFAULT_STAGES, help="Status updates each stub job publishes.")
+    parser.add_argument("--stage-seconds", type=float, default=DEFAULT_STAGE_SECONDS, help="Seconds between a stub job's updates.")
+    parser.add_argument("--work-dir", default=None, help="Directory for app.log (default: current directory).")
+    args = parser.parse_args()
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        os.chdir(args.work_dir)
+    # Stub jobs run as threads in this process; the job queue would hand them to real workers.
+    os.environ.pop("JOB_QUEUE_PATH", None)
+    raise_open_file_limit()
+
+    import app as app_module
+    app_module.process_video_with_recipe = stub_pipeline(args.stages, args.stage_seconds)
+    # Stub jobs write nothing, so they reserve no disk (and don't probe their made-up URLs).
+    app_module.estimate_job_bytes = lambda video_url: 0
+
+    if args.mode == "flask":
+        app_module.app.run(host=args.host, port=args.port, threaded=True)
+    else:
+        import uvicorn
+        from asgi import application
+        uvicorn.run(application, host=args.host, port=args.port, log_level="warning", backlog=4096)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import os
+
+from utils.ffmpeg_runner import run_ffmpeg
+
+DEFAULT_SPEECH_SECONDS = 8.0
+DEFAULT_SILENCE_SECONDS = 2.0
+
+def speech_pattern(duration, speech_seconds=DEFAULT_SPEECH_SECONDS, silence_seconds=DEFAULT_SILENCE_SECONDS):
+    """
+    The layout of a synthetic recording: a tone ("speech") for speech_seconds, then
+    silence_seconds of silence, repeated. Returns (speech_intervals, silent_intervals).
+    """
+    speech, silence = [], []
+    cycle = speech_seconds + silence_seconds
+    start = 0.0
+    while start < duration:
+        speech_end = min(start + speech_seconds, duration)
+        speech.append({"start": round(start, 3), "end": round(speech_end, 3)})
+        if speech_end < duration and silence_seconds > 0:
+            silence.append({"start": round(speech_end, 3), "end": round(min(start + cycle, duration), 3)})
+        start += cycle
+    return speech, silence
+
+def media_filename(minutes, speech_seconds, silence_seconds, width, height, fps):
+    return f"synthetic_{minutes:g}m_{speech_seconds:g}s-{silence_seconds:g}s_{width}x{height}_{fps:g}fps.mp4"
+
+def generate_media(media_dir, minutes, speech_seconds=DEFAULT_SPEECH_SECONDS, silence_seconds=DEFAULT_SILENCE_SECONDS, width=1280, height=720, fps=30):
+    """
+    Renders a deterministic test recording with ffmpeg's lavfi sources: testsrc2 video
+    and a 220 Hz tone gated into the speech/silence pattern of speech_pattern().
+    Files are cached in media_dir by their parameters, since long ones take a while.
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    duration = minutes * 60
+    path = os.path.join(media_dir, media_filename(minutes, speech_seconds, silence_seconds, width, height, fps))
+    if not os.path.exists(path):
+        cycle = speech_seconds + silence_seconds
+        temp_path = path + ".part.mp4"
+        command = [
+            "ffmpeg",
+            "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=48000:duration={duration}",
+            "-af", f"volume='lt(mod(t,{cycle}),{speech_seconds})':eval=frame",
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-ac", "2",
+            # No encoder or creation-time tags, so the same parameters give the same bytes.
+            "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+            "-shortest",
+            "-y", temp_path
+        ]
+        run_ffmpeg("benchmark_media", command, duration=duration)
+        os.replace(temp_path, path)
+    return path
@@ -3,9 +3,11 @@ import json
 import re
 from datetime import timedelta
 import os
-import subprocess
 import logging
-import time
+from utils.metrics import gemini_call, record_gemini_usage
+from utils.cancellation import run_cancellable
+from services.gemini_files import upload_file
+from utils.checkpoint import is_transient_error
 
 def parse_srt(srt_content):
     blocks = srt_content.strip().split('\n\n')
@@ -66,7 +68,9 @@ If it is a Short-form video, just return the topic. The output should be a JSON
 SRT Content:
 {srt_content}
 """
-    response = model.generate_content(prompt)
+    with gemini_call("classify_content", "generate"):
+        response = run_cancellable(lambda: model.generate_content(prompt))
+    record_gemini_usage("classify_content", response)
     classification_text = response.text.strip()
     if "```json" in classification_text:
         json_start = classification_text.find('{')
@@ -78,22 +82,11 @@ SRT Content:
     classification = json.loads(classification_json_str)
     return classification
 
-def detect_filler_words(video_path):
-    temp_audio_path = "temp_audio.mp3"
+def detect_filler_words(audio_path):
+    """Finds removable filler words in the speech audio proxy of a video (see create_audio_proxy)."""
     try:
-        command = [
-            "ffmpeg",
-            "-i", video_path,
-            "-q:a", "0",
-            "-map", "a",
-            temp_audio_path
-        ]
-        subprocess.run(command, check=True, capture_output=True, text=True)
-
-        audio_file = genai.upload_file(path=temp_audio_path)
-        while audio_file.state.name == "PROCESSING":
-            time.sleep(2)
-            audio_file = genai.get_file(audio_file.name)
+        with gemini_call("detect_filler_words", "upload"):
+            audio_file = upload_file(audio_path, poll_interval=2)
 
         if audio_file.state.name == "FAILED":
             raise ValueError("Audio file processing failed.")
@@ -113,7 +106,9 @@ def detect_filler_words(video_path):
 **EXAMPLE OF THE ONLY VALID OUTPUT FORMAT:**
 {{ "filler_words": [ {{ "word": \"um\", "start": \"00:00:01.234\", "end": \"00:00:01.567\", "can_be_removed": true, "reasoning": \"Hesitation before making a point.\" }} ] }}
 """
-        response = model.generate_content([prompt, audio_file])
+        with gemini_call("detect_filler_words", "generate"):
+            response = run_cancellable(lambda: model.generate_content([prompt, audio_file]))
+        record_gemini_usage("detect_filler_words", response)
         response_text = response.text.strip()
         json_match = re.search(r'```json\n(.*?)\n```', response_text, re.DOTALL)
         if json_match:
@@ -143,7 +138,9 @@ def detect_filler_words(video_path):
                 logging.error("Failed to repair JSON by adding commas. Trying to repair with LLM.")
                 # Attempt to repair the JSON
                 repair_prompt = f"The following JSON is invalid. Please fix it and return only the corrected JSON.\n\n{json_str}"
-                repair_response = model.generate_content(repair_prompt)
+                with gemini_call("detect_filler_words", "repair"):
+                    repair_response = run_cancellable(lambda: model.generate_content(repair_prompt))
+                record_gemini_usage("detect_filler_words", repair_response)
                 repaired_json_str = repair_response.text.strip()
                 try:
                     result = json.loads(repaired_json_str)
@@ -153,19 +150,15 @@ def detect_filler_words(video_path):
                     logging.error(f"Repaired JSON string: {repaired_json_str}")
                     return []
 
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+    except FileNotFoundError as e:
         logging.error(f"Error during filler word detection: {e}")
         return []
-    finally:
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
 
 def detect_silence_with_gemini(video_path):
+    """Finds silent intervals to remove, from the video analysis proxy (see create_video_proxy)."""
     try:
-        video_file = genai.upload_file(path=video_path)
-        while video_file.state.name == "PROCESSING":
-            time.sleep(10)
-            video_file = genai.get_file(video_file.name)
+        with gemini_call("detect_silence", "upload"):
+            video_file = upload_file(video_path, poll_interval=10)
 
         if video_file.state.name == "FAILED":
             raise ValueError("Video file processing failed.")
@@ -198,7 +191,9 @@ def detect_silence_with_gemini(video_path):
   ]
 }}
 """
-        response = model.generate_content([prompt, video_file], request_options={"timeout": 1200})
+        with gemini_call("detect_silence", "generate"):
+            response = run_cancellable(lambda: model.generate_content([prompt, video_file], request_options={"timeout": 1200}))
+        record_gemini_usage("detect_silence", response)
         response_text = response.text.strip()
         logging.info(f"SMART SILENCE RESPONSE: {response_text}")
         json_match = re.search(r'```json\n(.*?)\n```', response_text, re.DOTALL)
@@ -222,6 +217,9 @@ def detect_silence_with_gemini(video_path):
             return []
 
     except Exception as e:
+        # Re-raised so run_stage retries the stage instead of checkpointing "no silence".
+        if is_transient_error(e):
+            raise
         logging.error(f"Error during silence detection: {e}")
         return []
 
@@ -244,17 +242,15 @@ def classify_silence(video_path, srt_content, silence_start_str, silence_end_str
             context_after = parsed_srt[i]["text"]
             break
 
-    temp_clip_path = f"temp_clip_{{silence_start}}_{{silence_end}}.mp4"
+    temp_clip_path = f"{os.path.splitext(video_path)[0]}_clip_{silence_start}_{silence_end}.mp4"
     from utils.ffmpeg_utils import extract_clip
     if not extract_clip(video_path, silence_start, silence_end, temp_clip_path):
         logging.error("Failed to extract clip for silence classification.")
         return "unknown"
 
     try:
-        video_file = genai.upload_file(path=temp_clip_path)
-        while video_file.state.name == "PROCESSING":
-            time.sleep(2)
-            video_file = genai.get_file(video_file.name)
+        with gemini_call("classify_silence", "upload"):
+            video_file = upload_file(temp_clip_path, poll_interval=2)
 
         if video_file.state.name == "FAILED":
             raise ValueError("Video clip processing failed.")
@@ -271,7 +267,9 @@ Based on the visual and semantic context, decide if this pause is awkward 'dead
 4.  **Action without Words:** Pay close attention to removing segments that contain action without words.
 
 Respond with 'REMOVE' if it should be cut, and 'KEEP' if it should be preserved.'''
-        response = model.generate_content([prompt, video_file])
+        with gemini_call("classify_silence", "generate"):
+            response = run_cancellable(lambda: model.generate_content([prompt, video_file]))
+        record_gemini_usage("classify_silence", response)
         classification = response.text.strip().lower()
         logging.info(f"SMART SILENCE RESPONSE: {classification}")
         if "remove" in classification:
@@ -301,7 +299,9 @@ The output should be a JSON object with a single key "b_roll_suggestions" contai
 SRT Content:
 {srt_content}
 """
-    response = model.generate_content(prompt)
+    with gemini_call("suggest_b_roll", "generate"):
+        response = run_cancellable(lambda: model.generate_content(prompt))
+    record_gemini_usage("suggest_b_roll", response)
     response_text = response.text.strip()
     if "```json" in response_text:
         json_start = response_text.find('{')
@@ -348,7 +348,9 @@ def detect_retakes(srt_content):
 SRT Content:
 {srt_content}
 """
-    response = model.generate_content(prompt)
+    with gemini_call("detect_retakes", "generate"):
+        response = run_cancellable(lambda: model.generate_content(prompt))
+    record_gemini_usage("detect_retakes", response)
     response_text = response.text.strip()
     
     json_match = re.search(r'```json\n(.*?)\n```', response_text, re.DOTALL)
@@ -0,0 +1,39 @@
+import logging
+import threading
+import google.generativeai as genai
+from utils.cancellation import TaskCancelled, current_cancellation, cancellable_sleep, run_cancellable
+
+def delete_file(name):
+    try:
+        genai.delete_file(name)
+        logging.info(f"Deleted Gemini upload {name}.")
+    except Exception as e:
+        logging.warning(f"Could not delete Gemini upload {name}: {e}")
+
+def upload_file(path, poll_interval=2):
+    """
+    Uploads a file for a prompt and waits until Gemini has processed it. Under a task's
+    cancellation the upload is deleted when the task ends; if the task is cancelled
+    mid-upload, the upload is abandoned and deleted as soon as it completes.
+    """
+    abandoned = threading.Event()
+
+    def upload():
+        uploaded = genai.upload_file(path=path)
+        if abandoned.is_set():
+            delete_file(uploaded.name)
+        return uploaded
+
+    try:
+        uploaded = run_cancellable(upload)
+    except TaskCancelled:
+        abandoned.set()
+        raise
+
+    cancellation = current_cancellation()
+    if cancellation is not None:
+        cancellation.add_cleanup(lambda name=uploaded.name: delete_file(name))
+    while uploaded.state.name == "PROCESSING":
+        cancellable_sleep(poll_interval)
+        uploaded = genai.get_file(uploaded.name)
+    return uploaded
@@ -1,29 +1,22 @@
 import google.generativeai as genai
 import srt
 from datetime import timedelta
-import os
-import subprocess
 import logging
 import json
 import re
+from utils.metrics import gemini_call, record_gemini_usage
+from utils.cancellation import run_cancellable
+from services.gemini_files import upload_file
+from utils.checkpoint import is_transient_error
 
-def transcribe_video(video_path):
-    temp_audio_path = "temp_audio.mp3"
+def transcribe_video(audio_path):
+    """Transcribes the speech audio proxy of a video (see create_audio_proxy) into word-level SRT."""
     try:
-        # 1. Extract audio from video
-        command = [
-            "ffmpeg",
-            "-i", video_path,
-            "-q:a", "0",
-            "-map", "a",
-            temp_audio_path
-        ]
-        subprocess.run(command, check=True, capture_output=True, text=True)
+        # 1. Upload audio to Gemini
+        with gemini_call("transcribe", "upload"):
+            audio_file = upload_file(audio_path)
 
-        # 2. Upload audio to Gemini
-        audio_file = genai.upload_file(path=temp_audio_path)
-
-        # 3. Transcribe with Gemini 2.5 Pro
+        # 2. Transcribe with Gemini 2.5 Pro
         model = genai.GenerativeModel('gemini-2.5-pro')
         prompt = """Analyze this audio file and provide a word-level transcription.
 
@@ -54,7 +47,9 @@ def transcribe_video(video_path):
   ]
 }
 """
-        response = model.generate_content([prompt, audio_file], request_options={"timeout": 1200})
+        with gemini_call("transcribe", "generate"):
+            response = run_cancellable(lambda: model.generate_content([prompt, audio_file], request_options={"timeout": 1200}))
+        record_gemini_usage("transcribe", response)
         
         if not response.candidates or not response.candidates[0].content.parts:
             logging.warning("The Gemini API did not return any content for transcription. This might indicate a silent audio or an issue with the input.")
@@ -94,7 +89,9 @@ def transcribe_video(video_path):
                 logging.error("Failed to repair JSON by adding commas. Trying to repair with LLM.")
                 # Attempt to repair the JSON
                 repair_prompt = f"The following JSON is invalid. Please fix it and return only the corrected JSON.\n\n{json_str}"
-                repair_response = model.generate_content(repair_prompt)
+                with gemini_call("transcribe", "repair"):
+                    repair_response = run_cancellable(lambda: model.generate_content(repair_prompt))
+                record_gemini_usage("transcribe", repair_response)
                 repaired_json_str = repair_response.text.strip()
                 try:
                     transcription_data = json.loads(repaired_json_str)
@@ -103,7 +100,7 @@ def transcribe_video(video_path):
                     logging.error(f"Repaired JSON string: {repaired_json_str}")
                     return None
 
-        # 4. Format the response into SRT
+        # 3. Format the response into SRT
         subs = []
         unique_speakers = set(word_data['speaker'] for word_data in transcription_data.get("words", []))
         include_speakers = len(unique_speakers) > 1
@@ -120,13 +117,12 @@ def transcribe_video(video_path):
         srt_content = srt.compose(subs)
         return srt_content
 
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        logging.error(f"Error during audio extraction: {e}")
+    except FileNotFoundError as e:
+        logging.error(f"Audio proxy not found: {e}")
         return None
     except Exception as e:
+        # Timeouts, 429s and 5xx go up to run_stage, which retries the stage.
+        if is_transient_error(e):
+            raise
         logging.error(f"An error occurred during transcription: {e}")
         return None
-    finally:
-        # 5. Clean up temporary audio file
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
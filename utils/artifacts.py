@@ -0,0 +1,49 @@
+import os
+import hashlib
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def result_artifact_paths(result):
+    """Downloadable outputs of a task result, by artifact name."""
+    paths = {
+        "final_video": result.get("final_video_path"),
+        "transcript": result.get("srt_path"),
+        "premiere_xml": result.get("premiere_xml_path"),
+        "waveform_peaks": (result.get("waveform") or {}).get("path"),
+    }
+    for aspect_ratio, path in (result.get("renditions") or {}).items():
+        paths[f"rendition_{aspect_ratio.replace(':', 'x')}"] = path
+    return {name: path for name, path in paths.items() if path and os.path.exists(path)}
+
+def _matches(artifact, path, stat):
+    return artifact is not None and artifact.get("path") == path and artifact.get("size") == stat.st_size and artifact.get("mtime_ns") == stat.st_mtime_ns
+
+def describe_artifacts(task_id, result, previous=None):
+    """
+    Artifact entries for a task result: path, size, mtime and a SHA-256 of the content,
+    which GET /task/<id>/artifact/<name> serves as a strong ETag. Hashes of files that are
+    unchanged since the previous result (same size and mtime) are reused, so a re-render
+    only hashes the outputs it replaced.
+    """
+    previous = (previous or {}).get("artifacts") or {}
+    artifacts = {}
+    for name, path in result_artifact_paths(result).items():
+        stat = os.stat(path)
+        known = previous.get(name)
+        artifacts[name] = {
+            "url": f"/task/{task_id}/artifact/{name}",
+            "path": path,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": known["sha256"] if _matches(known, path, stat) else file_sha256(path),
+        }
+    return artifacts
+
+def current_sha256(artifact):
+    """The artifact's recorded hash, or a fresh one if the file changed since it was recorded."""
+    stat = os.stat(artifact["path"])
+    if _matches(artifact, artifact["path"], stat):
+        return artifact["sha256"]
+    return file_sha256(artifact["path"])
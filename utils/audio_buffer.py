@@ -0,0 +1,86 @@
+import os
+import subprocess
+import logging
+
+import numpy as np
+
+from utils.ffmpeg_runner import run_ffmpeg
+
+DEFAULT_SAMPLE_RATE = 16000
+
+class AudioBuffer:
+    """
+    A task's audio decoded once to raw float32 mono PCM in the task directory and
+    memory-mapped, so every local analysis reads the same pages from the page cache
+    instead of running its own ffmpeg decode. Sample i is at i / sample_rate seconds
+    on the source timeline. Views are zero-copy; nothing is loaded until it is read.
+    """
+
+    def __init__(self, path, sample_rate=DEFAULT_SAMPLE_RATE):
+        self.path = path
+        self.sample_rate = int(sample_rate)
+        if os.path.getsize(path):
+            self._samples = np.memmap(path, dtype=np.float32, mode="r")
+        else:
+            # np.memmap refuses empty files; a silent or zero-length input decodes to one.
+            self._samples = np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def decode(cls, input_path, output_path, sample_rate=DEFAULT_SAMPLE_RATE, duration=None):
+        """
+        Decodes the first audio stream of input_path into output_path and maps it.
+        Returns None if the input has no decodable audio.
+        """
+        temp_path = output_path + ".part"
+        command = [
+            "ffmpeg",
+            "-i", input_path,
+            "-map", "0:a:0",
+            "-vn",
+            # Pad (or trim) the start so sample 0 is at time 0 even if the audio starts late.
+            "-af", "aresample=async=1:first_pts=0",
+            "-ac", "1",
+            "-ar", str(sample_rate),
+            "-c:a", "pcm_f32le",
+            "-f", "f32le",
+            "-y", temp_path
+        ]
+        try:
+            run_ffmpeg("audio_buffer", command, duration=duration)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error decoding audio buffer: {e.stderr}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        os.replace(temp_path, output_path)
+        return cls(output_path, sample_rate)
+
+    def __len__(self):
+        return len(self._samples)
+
+    @property
+    def duration(self):
+        return len(self._samples) / self.sample_rate
+
+    def index(self, seconds):
+        """Sample index of a time in seconds, clamped to the buffer."""
+        return min(max(int(round(seconds * self.sample_rate)), 0), len(self._samples))
+
+    def samples(self, start=None, end=None):
+        """Read-only view of the samples between start and end seconds (default: all of them)."""
+        start_index = 0 if start is None else self.index(start)
+        end_index = len(self._samples) if end is None else self.index(end)
+        return self._samples[start_index:max(start_index, end_index)]
+
+    def frames(self, frame_samples, start=None, end=None):
+        """
+        View of [start, end) as a (frames, frame_samples) array for per-frame statistics
+        such as peaks or RMS. A trailing partial frame is left out.
+        """
+        view = self.samples(start, end)
+        count = len(view) // frame_samples
+        return view[:count * frame_samples].reshape(count, frame_samples)
+
+    def ffmpeg_input_args(self):
+        """ffmpeg arguments that read this buffer back as an input, instead of decoding the source again."""
+        return ["-f", "f32le", "-ar", str(self.sample_rate), "-ac", "1", "-i", self.path]
@@ -0,0 +1,114 @@
+import json
+import threading
+
+from utils.ffmpeg_utils import analysis_proxy_settings
+from utils.task_events import TERMINAL_STATUSES
+
+# Stages that only depend on the source video (and these recipe keys), so every recipe
+# sharing a source can reuse one run of them.
+TRANSCRIPT_ANALYSIS_KEYS = ("classify_content", "suggest_b_roll", "detect_retakes")
+MEDIA_ANALYSIS_KEYS = ("detect_silence", "detect_filler_words", "waveform")
+
+def effective_analysis(recipe):
+    """The analysis stages a recipe actually gets: transcript-based ones also need "transcribe"."""
+    transcribe = bool(recipe.get("transcribe", False))
+    analysis = {"transcribe": transcribe}
+    for key in TRANSCRIPT_ANALYSIS_KEYS:
+        analysis[key] = transcribe and bool(recipe.get(key, False))
+    for key in MEDIA_ANALYSIS_KEYS:
+        analysis[key] = bool(recipe.get(key, False))
+    return analysis
+
+def analysis_recipe(recipes):
+    """Recipe for the shared analysis of one source: every analysis stage any of the recipes needs."""
+    recipe = {"apply_noise_reduction": bool(recipes[0].get("apply_noise_reduction", False))}
+    for key in ("transcribe",) + TRANSCRIPT_ANALYSIS_KEYS + MEDIA_ANALYSIS_KEYS:
+        recipe[key] = any(effective_analysis(r)[key] for r in recipes)
+    for key in ("analysis_proxy", "stage_retries", "retry_backoff"):
+        if key in recipes[0]:
+            recipe[key] = recipes[0][key]
+    if recipe["waveform"]:
+        recipe["waveform_bits"] = max(int(r.get("waveform_bits", 8)) for r in recipes if r.get("waveform", False))
+    return recipe
+
+def plan_batch(jobs):
+    """
+    Groups (video_url, recipe) jobs by source. Recipes only share a source when they
+    agree on noise reduction and analysis proxy settings, since those change the media
+    every later stage reads.
+    Returns [{"video_url", "job_indexes"}] in first-seen order.
+    """
+    groups = {}
+    for index, job in enumerate(jobs):
+        key = (job["video_url"], bool(job["recipe"].get("apply_noise_reduction", False)),
+               json.dumps(analysis_proxy_settings(job["recipe"]), sort_keys=True))
+        groups.setdefault(key, {"video_url": job["video_url"], "job_indexes": []})["job_indexes"].append(index)
+    return list(groups.values())
+
+class BatchProgress:
+    """
+    Folds the status of a batch's tasks into one aggregate status record in the
+    TaskStatusStore, so a batch id can be streamed from /task_status like any task.
+    Progress is the mean over the shared analysis tasks and the per-recipe tasks.
+    """
+
+    def __init__(self, store, batch_id, source_task_ids, task_ids):
+        self._store = store
+        self._batch_id = batch_id
+        self._task_ids = list(task_ids)
+        self._tracked = list(source_task_ids) + self._task_ids
+        self._progress = {task_id: 0 for task_id in self._tracked}
+        self._finished = {}
+        self._lock = threading.Lock()
+        self._listeners = {}
+
+    def start(self):
+        self._store[self._batch_id] = {
+            "status": "PENDING",
+            "progress": 0,
+            "message": f"Batch of {len(self._task_ids)} tasks queued.",
+            "total": len(self._task_ids),
+            "completed": 0,
+            "failed": 0,
+            "source_task_ids": self._tracked[:len(self._tracked) - len(self._task_ids)],
+            "task_ids": self._task_ids,
+        }
+        for task_id in self._tracked:
+            listener = lambda task_id=task_id: self._on_event(task_id)
+            if self._store.add_listener(task_id, listener):
+                self._listeners[task_id] = listener
+        return self
+
+    def _on_event(self, task_id):
+        status = self._store.get(task_id)
+        if status is None:
+            return
+        with self._lock:
+            if self._batch_id not in self._store or self._store[self._batch_id].get("status") in TERMINAL_STATUSES:
+                return
+            self._progress[task_id] = status.get("progress", self._progress[task_id]) or 0
+            if task_id in self._task_ids and status.get("status") in TERMINAL_STATUSES:
+                self._finished[task_id] = status["status"]
+            completed = sum(1 for state in self._finished.values() if state == "COMPLETED")
+            failed = len(self._finished) - completed
+            update = {
+                "progress": round(sum(self._progress.values()) / len(self._progress)),
+                "completed": completed,
+                "failed": failed,
+                "updated_task": {"task_id": task_id, "status": status.get("status"), "progress": status.get("progress")},
+            }
+            if len(self._finished) == len(self._task_ids):
+                update.update({
+                    "status": "COMPLETED" if completed else ("CANCELLED" if all(state == "CANCELLED" for state in self._finished.values()) else "FAILED"),
+                    "progress": 100,
+                    "message": f"Batch finished: {completed} of {len(self._task_ids)} tasks completed, {failed} failed.",
+                })
+            else:
+                update.update({"status": "RUNNING", "message": f"{completed} of {len(self._task_ids)} tasks completed, {failed} failed."})
+            self._store[self._batch_id].update(update)
+        if update["status"] in TERMINAL_STATUSES:
+            self.stop()
+
+    def stop(self):
+        for task_id, listener in self._listeners.items():
+            self._store.remove_listener(task_id, listener)
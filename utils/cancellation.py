@@ -0,0 +1,188 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# How often a thread blocked on a call it cannot interrupt (e.g. a Gemini request) checks for cancellation.
+CANCEL_POLL_INTERVAL = 0.25
+# Reason a worker stops a task whose lease another worker has taken over. That worker now
+# owns the task directory, so the stopped run must leave its manifest and files alone.
+LEASE_LOST = "lease_lost"
+
+class TaskCancelled(BaseException):
+    """
+    Raised inside a task's pipeline once it has been cancelled or has run past its
+    deadline. Like asyncio.CancelledError it is a BaseException, so the broad
+    `except Exception` handlers in stages and services let it through.
+    """
+
+    def __init__(self, reason="cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+_active = {}
+# Cancellations requested for tasks that have not started running in this process yet.
+_pending = set()
+_registry_lock = threading.Lock()
+_current = contextvars.ContextVar("task_cancellation", default=None)
+
+class TaskCancellation:
+    """
+    Cancellation state of one running task. While entered it is registered under
+    task_id, so request_cancel() from another thread (DELETE /task/<id>, or a worker
+    seeing a cancel request in the job queue) reaches it; deadline_seconds cancels it
+    with reason "deadline". Code running under active() checks it cooperatively:
+    stages between steps, ffmpeg by killing its process, Gemini calls by abandoning
+    the request. Cleanups (e.g. deleting Gemini uploads) run when it is exited.
+    """
+
+    def __init__(self, task_id, deadline_seconds=None, event=None):
+        self.task_id = task_id
+        self.deadline_seconds = float(deadline_seconds) if deadline_seconds else None
+        self.event = event or threading.Event()
+        self.reason = None
+        self._callbacks = []
+        self._cleanups = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __enter__(self):
+        with _registry_lock:
+            _active[self.task_id] = self
+            pending = self.task_id in _pending
+            _pending.discard(self.task_id)
+        if pending:
+            self.cancel()
+        if self.deadline_seconds:
+            self._timer = threading.Timer(self.deadline_seconds, self.cancel, args=("deadline",))
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._timer is not None:
+            self._timer.cancel()
+        with _registry_lock:
+            if _active.get(self.task_id) is self:
+                del _active[self.task_id]
+        for cleanup in reversed(self._cleanups):
+            try:
+                cleanup()
+            except Exception as e:
+                logging.warning(f"[{self.task_id}] Cleanup after task failed: {e}")
+        return False
+
+    @contextmanager
+    def active(self):
+        """Makes this the cancellation checked by code running on this thread."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self.event.is_set():
+                return False
+            self.reason = reason
+            self.event.set()
+            callbacks = list(self._callbacks)
+        logging.info(f"[{self.task_id}] Task cancelled ({reason}).")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning(f"[{self.task_id}] Cancellation callback failed: {e}")
+        return True
+
+    def check(self):
+        if self.event.is_set():
+            raise TaskCancelled(self.reason or "cancelled")
+
+    def sleep(self, seconds):
+        if self.event.wait(seconds):
+            raise TaskCancelled(self.reason or "cancelled")
+
+    def add_callback(self, callback):
+        """Calls callback() when the task is cancelled, or right away if it already is."""
+        with self._lock:
+            if not self.event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def add_cleanup(self, cleanup):
+        self._cleanups.append(cleanup)
+
+def current_cancellation():
+    return _current.get()
+
+def request_cancel(task_id, reason="cancelled"):
+    """Cancels task_id if it runs in this process, or as soon as it starts. Returns True if it was running."""
+    with _registry_lock:
+        cancellation = _active.get(task_id)
+        if cancellation is None:
+            _pending.add(task_id)
+            return False
+    cancellation.cancel(reason)
+    return True
+
+def discard_cancel_request(task_id):
+    """Drops a cancellation requested for a task that finished before it took effect, e.g. before a retry."""
+    with _registry_lock:
+        _pending.discard(task_id)
+
+def check_cancelled():
+    cancellation = _current.get()
+    if cancellation is not None:
+        cancellation.check()
+
+def cancellable_sleep(seconds):
+    cancellation = _current.get()
+    if cancellation is None:
+        time.sleep(seconds)
+    else:
+        cancellation.sleep(seconds)
+
+def run_cancellable(fn):
+    """
+    Runs a blocking call that has no way to be interrupted (a Gemini request with a
+    20-minute timeout) on a helper thread, and stops waiting for it once the current
+    task is cancelled. The abandoned call finishes in the background and is ignored.
+    """
+    cancellation = _current.get()
+    if cancellation is None:
+        return fn()
+    cancellation.check()
+    outcome = {}
+    done = threading.Event()
+
+    def target():
+        try:
+            outcome["result"] = fn()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, daemon=True).start()
+    while not done.wait(CANCEL_POLL_INTERVAL):
+        cancellation.check()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def bind_cancel_event(event):
+    """Pool initializer: ffmpeg runs in this process are killed when `event` is set by the parent."""
+    _current.set(TaskCancellation(None, event=event))
@@ -0,0 +1,163 @@
+import re
+import srt
+
+DEFAULT_WORDS_PER_LINE = 10
+DEFAULT_LINES_PER_PAGE = 1
+# A gap between words longer than this starts a new line and lets the previous
+# caption disappear; shorter gaps are bridged so captions don't flicker.
+DEFAULT_MAX_PAUSE = 0.6
+
+_SPEAKER_PREFIX = re.compile(r'^\[(?P<speaker>[^\]]+)\]\s*(?P<word>.*)$', re.DOTALL)
+
+ASS_STYLE_FORMAT = "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding"
+ASS_EVENT_FORMAT = "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"
+
+def parse_timed_words(srt_content):
+    """Turns the word-level SRT written by transcribe_video back into timed words."""
+    words = []
+    for sub in srt.parse(srt_content):
+        content = sub.content.strip()
+        speaker = None
+        match = _SPEAKER_PREFIX.match(content)
+        if match:
+            speaker = match.group("speaker")
+            content = match.group("word").strip()
+        if not content:
+            continue
+        words.append({
+            "word": content,
+            "start": sub.start.total_seconds(),
+            "end": sub.end.total_seconds(),
+            "speaker": speaker,
+        })
+    return words
+
+def layout_captions(words, words_per_line=DEFAULT_WORDS_PER_LINE, lines_per_page=DEFAULT_LINES_PER_PAGE, max_pause=DEFAULT_MAX_PAUSE):
+    """
+    Groups timed words into lines and lines into pages. A line ends after
+    words_per_line words, on a speaker change, or at a pause longer than max_pause;
+    a page ends when it is full or at a speaker change or pause.
+    Returns a list of pages: {"start", "end", "speaker", "lines": [[word, ...], ...]}.
+    """
+    pages = []
+    page = None
+    line = None
+    previous = None
+    for word in words:
+        hard_break = previous is not None and (
+            word["speaker"] != previous["speaker"] or word["start"] - previous["end"] > max_pause
+        )
+        if page is None or hard_break:
+            line = [word]
+            page = {"start": word["start"], "end": word["end"], "speaker": word["speaker"], "lines": [line]}
+            pages.append(page)
+        elif len(line) >= words_per_line:
+            line = [word]
+            if len(page["lines"]) >= lines_per_page:
+                page = {"start": word["start"], "end": word["end"], "speaker": word["speaker"], "lines": [line]}
+                pages.append(page)
+            else:
+                page["lines"].append(line)
+        else:
+            line.append(word)
+        page["end"] = word["end"]
+        previous = word
+
+    # Hold each page until the next one starts when the gap is short, so the
+    # caption area never blinks empty between pages.
+    for current, following in zip(pages, pages[1:]):
+        if 0 < following["start"] - current["end"] <= max_pause:
+            current["end"] = following["start"]
+    return pages
+
+def format_ass_time(seconds):
+    centiseconds_total = int(round(max(seconds, 0) * 100))
+    hours, remainder = divmod(centiseconds_total, 360000)
+    minutes, remainder = divmod(remainder, 6000)
+    secs, centiseconds = divmod(remainder, 100)
+    return f"{hours}:{minutes:02}:{secs:02}.{centiseconds:02}"
+
+def _escape_ass_text(text):
+    # Braces open override blocks and backslashes start tags in ASS.
+    return text.replace("\\", "/").replace("{", "(").replace("}", ")")
+
+def _page_text(page, karaoke_tag=None):
+    rendered_lines = []
+    for line_index, line in enumerate(page["lines"]):
+        parts = []
+        for word_index, word in enumerate(line):
+            text = _escape_ass_text(word["word"])
+            if karaoke_tag:
+                # Each word is highlighted until the next one starts, so the sweep
+                # also covers the short gaps between words.
+                if word_index + 1 < len(line):
+                    next_start = line[word_index + 1]["start"]
+                elif line_index + 1 < len(page["lines"]):
+                    next_start = page["lines"][line_index + 1][0]["start"]
+                else:
+                    next_start = word["end"]
+                duration_cs = max(int(round((next_start - word["start"]) * 100)), 1)
+                text = f"{{\\{karaoke_tag}{duration_cs}}}{text}"
+            parts.append(text)
+        rendered_lines.append(" ".join(parts))
+    return "\\N".join(rendered_lines)
+
+def _style_line(ass_style):
+    if not ass_style:
+        return "Default", "Style: Default,Arial,72,&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,3,2,2,30,30,30,1"
+
+    fontname = ass_style.get("Fontname", "Arial")
+    fontsize = ass_style.get("Fontsize", "72")
+    primary_colour = ass_style.get("PrimaryColour", "&H00FFFFFF")
+    secondary_colour = ass_style.get("SecondaryColour", "&H000000FF")
+    outline = ass_style.get("Outline", "3")
+    shadow = ass_style.get("Shadow", "2")
+
+    alignment = "2" # Bottom Center
+    if ass_style.get("position") == "Top":
+        alignment = "8"
+    elif ass_style.get("position") == "Middle":
+        alignment = "5"
+
+    return "Styled", f"Style: Styled,{fontname},{fontsize},{primary_colour},{secondary_colour},&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,{outline},{shadow},{alignment},30,30,30,1"
+
+def build_ass_document(words, ass_style=None, play_res=(1920, 1080)):
+    """
+    Lays out timed words and renders the complete ASS script as one string.
+    ass_style keys used here besides the style fields: words_per_line,
+    lines_per_page, max_pause and karaoke (true for \\k, or "kf" for a smooth sweep).
+    """
+    ass_style = ass_style or {}
+    pages = layout_captions(
+        words,
+        words_per_line=max(int(ass_style.get("words_per_line", DEFAULT_WORDS_PER_LINE)), 1),
+        lines_per_page=max(int(ass_style.get("lines_per_page", DEFAULT_LINES_PER_PAGE)), 1),
+        max_pause=float(ass_style.get("max_pause", DEFAULT_MAX_PAUSE)),
+    )
+    karaoke = ass_style.get("karaoke", False)
+    karaoke_tag = None
+    if karaoke:
+        karaoke_tag = karaoke if karaoke in ("k", "kf", "ko") else "k"
+
+    style_name, style_line = _style_line(ass_style)
+    play_res_x, play_res_y = play_res
+    lines = [
+        "[Script Info]",
+        "Title: Generated by Storyboard AI",
+        "ScriptType: v4.00+",
+        "WrapStyle: 0",
+        f"PlayResX: {play_res_x}",
+        f"PlayResY: {play_res_y}",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        ASS_STYLE_FORMAT,
+        style_line,
+        "",
+        "[Events]",
+        ASS_EVENT_FORMAT,
+    ]
+    for page in pages:
+        lines.append(f"Dialogue: 0,{format_ass_time(page['start'])},{format_ass_time(page['end'])},{style_name},,0,0,0,,{_page_text(page, karaoke_tag)}")
+    lines.append("")
+    return "\n".join(lines)
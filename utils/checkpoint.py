@@ -0,0 +1,351 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import requests
+
+from utils.metrics import STAGE_SECONDS, STAGE_RUNS, STAGE_RETRIES, STAGE_BYTES, CACHE_LOOKUPS, TASKS_FINISHED, ARTIFACT_GC_BYTES, track_gemini_usage
+from utils.cancellation import TaskCancelled, check_cancelled, cancellable_sleep, LEASE_LOST
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_STAGE_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 5.0
+
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+if google_exceptions is not None:
+    TRANSIENT_ERRORS += (
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.TooManyRequests,
+    )
+
+class StageFailed(Exception):
+    """Raised by a stage that finished without a usable result, so it is not checkpointed."""
+    pass
+
+def get_tasks_dir():
+    return os.path.abspath(os.getenv("TASKS_DIR", "tasks"))
+
+def get_task_dir(task_id):
+    return os.path.join(get_tasks_dir(), task_id)
+
+def load_manifest(task_id):
+    manifest_path = os.path.join(get_task_dir(task_id), MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def completed_stages(manifest):
+    return [name for name, stage in manifest["stages"].items() if stage["status"] == "COMPLETED"]
+
+def is_transient_error(e):
+    if isinstance(e, TRANSIENT_ERRORS):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+def recipe_subset(recipe, *keys):
+    return {key: recipe.get(key) for key in keys}
+
+def merge_recipe(recipe, changes):
+    """Applies a recipe diff: nested dicts (e.g. ass_style) are merged key by key, other values replaced."""
+    merged = dict(recipe)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_recipe(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def _artifact_paths(value, task_dir):
+    """Every file path inside the task directory mentioned anywhere in a stage output."""
+    if isinstance(value, str):
+        return [value] if value.startswith(task_dir + os.sep) else []
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [path for item in value for path in _artifact_paths(item, task_dir)]
+    return []
+
+def _artifact_bytes(value, task_dir, exclude=()):
+    paths = set(_artifact_paths(value, task_dir)) - set(exclude)
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def _fingerprint(inputs, task_dir, producers):
+    """
+    Hash of everything a stage reads: its recipe keys and upstream outputs, plus the
+    identity of every upstream artifact. An artifact made by an earlier stage of the
+    task is identified by that stage's fingerprint, so a file regenerated from the same
+    inputs (e.g. after it was released to save disk) keeps its downstream stages
+    reusable, while one rebuilt from changed inputs invalidates them. Other files (a
+    batch's linked source video) fall back to their size and mtime.
+    """
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8"))
+    for path in _artifact_paths(inputs, task_dir):
+        if path in producers:
+            digest.update(f"{path}:{producers[path]}".encode("utf-8"))
+        elif os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+def _remove_file(path):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+def discard_task_artifacts(task_dir, keep=()):
+    """Deletes everything in a task directory but the manifest and `keep`. Returns the bytes freed."""
+    freed = 0
+    keep = {os.path.abspath(path) for path in keep}
+    for entry in os.scandir(task_dir):
+        if entry.name == MANIFEST_NAME or entry.path in keep:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            freed += _remove_file(entry.path)
+    return freed
+
+class TaskCheckpoint:
+    """
+    Per-task directory plus a manifest.json recording each completed stage's output
+    and a fingerprint of its inputs. Running a task again with the same task_id reuses
+    every stage whose inputs are unchanged and whose artifacts are still on disk, so a
+    retry resumes at the first incomplete stage and a recipe change only recomputes
+    the stages that depend on the changed keys.
+    """
+
+    def __init__(self, task_id, video_url, recipe, source_task_id=None):
+        self.task_id = task_id
+        self.task_dir = get_task_dir(task_id)
+        self.manifest_path = os.path.join(self.task_dir, MANIFEST_NAME)
+        os.makedirs(self.task_dir, exist_ok=True)
+        self.manifest = load_manifest(task_id) or {
+            "task_id": task_id,
+            "video_url": video_url,
+            "status": "PENDING",
+            "created_at": time.time(),
+            "stages": {},
+        }
+        self.manifest["recipe"] = recipe
+        if source_task_id is not None:
+            self.manifest["source_task_id"] = source_task_id
+            self.save()
+        self.stage_retries = int(recipe.get("stage_retries", DEFAULT_STAGE_RETRIES))
+        self.retry_backoff = float(recipe.get("retry_backoff", DEFAULT_RETRY_BACKOFF))
+        self.started_at = time.time()
+        # Per-stage timings of this run, attached to the task result.
+        self.timings = {}
+        # (fn, task_status, inputs) of every stage seen in this run, to regenerate released outputs.
+        self._calls = {}
+
+    def path(self, filename):
+        return os.path.join(self.task_dir, filename)
+
+    def link_artifact(self, path):
+        """
+        Makes another task's artifact (e.g. a batch's shared source video) available in
+        this task directory, so outputs derived from it are written here. Hard-links
+        where possible; the copy fallback keeps the mtime so fingerprints stay stable.
+        """
+        link_path = self.path(os.path.basename(path))
+        if os.path.abspath(path) == link_path:
+            return path
+        if os.path.exists(link_path):
+            if os.path.samefile(path, link_path):
+                return link_path
+            os.remove(link_path)
+        try:
+            os.link(path, link_path)
+        except OSError:
+            shutil.copy2(path, link_path)
+        return link_path
+
+    def save(self):
+        self.manifest["updated_at"] = time.time()
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2, default=str)
+        os.replace(temp_path, self.manifest_path)
+
+    def _producers(self):
+        """Artifact path -> fingerprint of the completed stage that first produced it."""
+        producers = {}
+        for stage in self.manifest["stages"].values():
+            if stage["status"] == "COMPLETED":
+                for path in _artifact_paths(stage["output"], self.task_dir):
+                    producers.setdefault(path, stage["fingerprint"])
+        return producers
+
+    def _producer_stage(self, path):
+        for name, stage in self.manifest["stages"].items():
+            if stage["status"] == "COMPLETED" and path in _artifact_paths(stage["output"], self.task_dir):
+                return name
+        return None
+
+    def _reusable(self, name, fingerprint):
+        stage = self.manifest["stages"].get(name)
+        return stage is not None and stage["status"] == "COMPLETED" and stage.get("fingerprint") == fingerprint
+
+    def run_stage(self, name, fn, task_status, inputs):
+        """
+        Returns the checkpointed output of stage `name` if it completed with the same
+        inputs, or runs fn() and checkpoints its (JSON-serialisable) return value.
+        `inputs` must hold every recipe key and upstream output fn() depends on.
+        Transient errors are retried with exponential backoff up to the recipe's
+        stage_retries; other errors are recorded and re-raised. A cancelled task stops
+        before the next stage starts.
+        """
+        check_cancelled()
+        self._calls[name] = (fn, task_status, inputs)
+        fingerprint = _fingerprint(inputs, self.task_dir, self._producers())
+        if self._reusable(name, fingerprint):
+            # Released artifacts are not regenerated here, only once a stage that reads them runs.
+            logging.info(f"[{self.task_id}] Stage '{name}' inputs unchanged, reusing checkpoint.")
+            task_status[self.task_id].update({"message": f"Reusing output of stage '{name}'."})
+            CACHE_LOOKUPS.labels("stage_checkpoint", "hit").inc()
+            STAGE_RUNS.labels(name, "reused").inc()
+            self.timings[name] = {"seconds": 0.0, "reused": True}
+            return self.manifest["stages"][name]["output"]
+        CACHE_LOOKUPS.labels("stage_checkpoint", "miss").inc()
+        self.materialize(inputs)
+        return self._execute(name, fn, task_status, inputs, fingerprint)
+
+    def materialize(self, value):
+        """
+        Makes sure every task artifact mentioned in `value` is on disk, re-running the
+        stages (of this run) that produced any that were released or discarded.
+        """
+        for path in _artifact_paths(value, self.task_dir):
+            if os.path.exists(path):
+                continue
+            name = self._producer_stage(path)
+            if name is None or name not in self._calls:
+                raise FileNotFoundError(f"Artifact {path} is missing and no stage of this run produces it")
+            fn, task_status, inputs = self._calls[name]
+            logging.info(f"[{self.task_id}] Regenerating released output of stage '{name}'.")
+            self.materialize(inputs)
+            self._execute(name, fn, task_status, inputs, self.manifest["stages"][name]["fingerprint"])
+
+    def _execute(self, name, fn, task_status, inputs, fingerprint):
+        stage = {"status": "RUNNING", "attempts": 0, "fingerprint": fingerprint, "started_at": time.time()}
+        start = time.perf_counter()
+        usage = {"prompt": 0, "output": 0}
+        self.manifest["stages"][name] = stage
+        self.save()
+        while True:
+            stage["attempts"] += 1
+            try:
+                # Failed attempts count too: their tokens were spent all the same.
+                with track_gemini_usage(usage):
+                    output = fn()
+                check_cancelled()
+                break
+            except TaskCancelled as e:
+                stage.update({"status": "CANCELLED", "error": e.reason, "failed_at": time.time()})
+                if e.reason != LEASE_LOST:
+                    self.save()
+                STAGE_RUNS.labels(name, "cancelled").inc()
+                self.timings[name] = {"seconds": round(time.perf_counter() - start, 3), "reused": False, "attempts": stage["attempts"], "cancelled": True}
+                raise
+            except Exception as e:
+                if is_transient_error(e) and stage["attempts"] <= self.stage_retries:
+                    STAGE_RETRIES.labels(name).inc()
+                    delay = self.retry_backoff * 2 ** (stage["attempts"] - 1)
+                    logging.warning(f"[{self.task_id}] Transient error in stage '{name}' (attempt {stage['attempts']}), retrying in {delay:.0f}s: {e}")
+                    task_status[self.task_id].update({"message": f"Transient error in stage '{name}', retrying ({stage['attempts']}/{self.stage_retries})..."})
+                    cancellable_sleep(delay)
+                    continue
+                stage.update({"status": "FAILED", "error": str(e), "failed_at": time.time()})
+                self.save()
+                STAGE_RUNS.labels(name, "failed").inc()
+                self.timings[name] = {"seconds": round(time.perf_counter() - start, 3), "reused": False, "attempts": stage["attempts"], "failed": True}
+                raise
+
+        # Round-trip through JSON so a fresh run returns exactly what a resumed one would.
+        output = json.loads(json.dumps(output, default=str))
+        elapsed = time.perf_counter() - start
+        bytes_in = _artifact_bytes(inputs, self.task_dir)
+        # A stage that passes an upstream file through (e.g. noise reduction turned off) produced nothing new.
+        bytes_out = _artifact_bytes(output, self.task_dir, exclude=_artifact_paths(inputs, self.task_dir))
+        stage.update({"status": "COMPLETED", "output": output, "completed_at": time.time(), "seconds": round(elapsed, 3)})
+        if any(usage.values()):
+            stage["tokens"] = usage
+        self.save()
+        STAGE_RUNS.labels(name, "completed").inc()
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        STAGE_BYTES.labels(name, "in").inc(bytes_in)
+        STAGE_BYTES.labels(name, "out").inc(bytes_out)
+        self.timings[name] = {"seconds": round(elapsed, 3), "reused": False, "attempts": stage["attempts"], "bytes_in": bytes_in, "bytes_out": bytes_out}
+        if any(usage.values()):
+            self.timings[name]["tokens"] = usage
+        return output
+
+    def discard_artifacts(self):
+        """
+        Deletes everything in the task directory but the manifest, e.g. after the task
+        was cancelled. Every completed stage stays reusable; a retry regenerates only
+        the files that a stage it has to run reads.
+        """
+        freed = discard_task_artifacts(self.task_dir)
+        ARTIFACT_GC_BYTES.labels("discarded").inc(freed)
+        logging.info(f"[{self.task_id}] Removed task artifacts ({freed} bytes).")
+        return freed
+
+    def release(self, stages=None, keep=()):
+        """
+        Deletes the artifacts of completed `stages` (default: every file in the task
+        directory but `keep`) once nothing in this run reads them any more. The stages
+        stay reusable and their files are regenerated if a later run needs them.
+        A file another stage also returns (e.g. a proxy stage that passed the source
+        through) is not released with `stages`.
+        """
+        keep = {os.path.abspath(path) for path in keep}
+        if stages is None:
+            freed = discard_task_artifacts(self.task_dir, keep=keep)
+        else:
+            for name, stage in self.manifest["stages"].items():
+                if name not in stages and stage["status"] == "COMPLETED":
+                    keep.update(_artifact_paths(stage["output"], self.task_dir))
+            freed = 0
+            for name in stages:
+                stage = self.manifest["stages"].get(name)
+                if stage is None or stage["status"] != "COMPLETED":
+                    continue
+                for path in _artifact_paths(stage["output"], self.task_dir):
+                    if path not in keep:
+                        freed += _remove_file(path)
+        if freed:
+            ARTIFACT_GC_BYTES.labels("released").inc(freed)
+            logging.info(f"[{self.task_id}] Released {freed} bytes of intermediate artifacts.")
+        return freed
+
+    def timing_breakdown(self):
+        return {"total_seconds": round(time.time() - self.started_at, 3), "stages": dict(self.timings)}
+
+    def finish(self, status, result=None, error=None):
+        TASKS_FINISHED.labels(status).inc()
+        self.manifest["status"] = status
+        self.manifest["result"] = result
+        self.manifest["error"] = error
+        self.save()
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.batch import effective_analysis
+from utils.checkpoint import get_tasks_dir, MANIFEST_NAME
+
+# Starting point per model key until past tasks have run it: seconds = base + rate * work,
+# where work is minutes of source media (times megapixels for stages that touch every
+# frame), and Gemini tokens per minute of media. Gemini bills audio at about 32 tokens
+# a second and video at about 290 (one frame a second plus its audio).
+STAGE_PRIORS = {
+    "download": {"base": 2.0, "rate": 1.0},
+    "metadata": {"base": 0.5, "rate": 0.05},
+    "noise_reduction": {"base": 1.0, "rate": 0.7},
+    "audio_buffer": {"base": 0.2, "rate": 0.1},
+    "waveform": {"base": 0.1, "rate": 0.02},
+    "audio_proxy": {"base": 0.3, "rate": 0.2},
+    "video_proxy": {"base": 1.0, "rate": 3.0},
+    "transcribe": {"base": 10.0, "rate": 6.0, "tokens": {"prompt": 1920, "output": 600}},
+    "detect_silence": {"base": 10.0, "rate": 4.0, "tokens": {"prompt": 17400, "output": 100}},
+    "classify_content": {"base": 5.0, "rate": 0.5, "tokens": {"prompt": 300, "output": 50}},
+    "detect_filler_words": {"base": 10.0, "rate": 4.0, "tokens": {"prompt": 1920, "output": 200}},
+    "suggest_b_roll": {"base": 5.0, "rate": 0.5, "tokens": {"prompt": 300, "output": 150}},
+    "detect_retakes": {"base": 5.0, "rate": 0.5, "tokens": {"prompt": 300, "output": 50}},
+    "mux_audio": {"base": 0.5, "rate": 0.3},
+    "export_to_premiere": {"base": 0.2, "rate": 0.01},
+    "cut_video": {"base": 2.0, "rate": 20.0},
+    "retranscribe": {"base": 10.0, "rate": 6.0, "tokens": {"prompt": 1920, "output": 600}},
+    "captions": {"base": 2.0, "rate": 20.0},
+}
+# Model keys whose work grows with the frame size as well as the duration.
+VIDEO_STAGES = {"download", "video_proxy", "mux_audio", "cut_video", "captions"}
+# Fewer distinct samples than this and a stage's line is not fitted; its rate is scaled instead.
+MIN_FIT_SAMPLES = 3
+HISTORY_SIZE = 500
+REFRESH_SECONDS = 300
+
+def planned_stages(recipe, phases=("analysis", "render")):
+    """
+    (stage name, model key) of every stage the pipeline will do real work in for recipe,
+    in run order. Stages a recipe turns off still run as no-ops and are left out; so is
+    the cut stage's fallback of muxing the cleaned audio, which is timed as mux_audio.
+    """
+    wanted = effective_analysis(recipe)
+    noise_reduction = bool(recipe.get("apply_noise_reduction", False))
+    stages = []
+    if "analysis" in phases:
+        stages += [("download", "download"), ("metadata", "metadata")]
+        if noise_reduction:
+            stages.append(("noise_reduction", "noise_reduction"))
+        needs_audio_proxy = wanted["transcribe"] or wanted["detect_filler_words"]
+        if needs_audio_proxy or wanted["waveform"]:
+            stages.append(("audio_buffer", "audio_buffer"))
+        if wanted["waveform"]:
+            stages.append(("waveform", "waveform"))
+        if needs_audio_proxy:
+            stages.append(("audio_proxy", "audio_proxy"))
+        if wanted["detect_silence"]:
+            stages.append(("video_proxy", "video_proxy"))
+        stages += [(name, name) for name in ("transcribe", "detect_silence", "classify_content", "detect_filler_words", "suggest_b_roll", "detect_retakes")
+                   if wanted[name]]
+    if "render" in phases:
+        if recipe.get("export_to_premiere", False):
+            if noise_reduction:
+                stages.append(("mux_audio", "mux_audio"))
+            stages.append(("export_to_premiere", "export_to_premiere"))
+        else:
+            if recipe.get("cut_video", False):
+                stages.append(("cut_video", "cut_video"))
+            elif noise_reduction:
+                stages.append(("cut_video", "mux_audio"))
+            if recipe.get("burn_captions", False) and (recipe.get("cut_video", False) or not wanted["transcribe"]):
+                stages.append(("retranscribe", "retranscribe"))
+            if recipe.get("burn_captions", False) or recipe.get("renditions", False):
+                stages.append(("captions", "captions"))
+    return stages
+
+def media_work(key, media):
+    """Units of work a stage has for media: minutes, times megapixels for VIDEO_STAGES."""
+    minutes = (media.get("duration") or 0) / 60
+    if key not in VIDEO_STAGES:
+        return minutes
+    megapixels = (media.get("width") or 1920) * (media.get("height") or 1080) / 1e6
+    return minutes * max(megapixels, 0.1)
+
+def _fit(samples, prior):
+    """(base, rate) for a list of (work, seconds): least squares with enough spread, else the prior's base with a rate from the samples."""
+    if len({round(work, 3) for work, _ in samples}) >= MIN_FIT_SAMPLES:
+        work, seconds = np.array(samples).T
+        rate, base = np.polyfit(work, seconds, 1)
+        if rate >= 0 and base >= 0:
+            return float(base), float(rate)
+    base = min(prior["base"], min(seconds for _, seconds in samples))
+    total_work = sum(work for work, _ in samples)
+    if total_work <= 0:
+        return float(np.mean([seconds for _, seconds in samples])), prior["rate"]
+    return base, max(0.0, sum(seconds - base for _, seconds in samples) / total_work)
+
+class Estimator:
+    """
+    Predicts a job's wall time per stage and its Gemini tokens from the manifests of
+    recent tasks: each completed stage records its seconds and tokens, and the task's
+    metadata stage the duration and frame size they were spent on. The fitted model is
+    rebuilt at most every refresh_seconds.
+    """
+
+    def __init__(self, tasks_dir=None, history=HISTORY_SIZE, refresh_seconds=REFRESH_SECONDS):
+        self._tasks_dir = tasks_dir
+        self._history = history
+        self._refresh_seconds = refresh_seconds
+        self._model = None
+        self._fitted_at = 0
+        self._lock = threading.Lock()
+
+    def _manifests(self):
+        tasks_dir = self._tasks_dir or get_tasks_dir()
+        if not os.path.isdir(tasks_dir):
+            return {}
+        paths = []
+        for entry in os.scandir(tasks_dir):
+            manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+            try:
+                paths.append((os.path.getmtime(manifest_path), entry.name, manifest_path))
+            except OSError:
+                continue
+        manifests = {}
+        for _, task_id, manifest_path in sorted(paths, reverse=True)[:self._history]:
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    manifests[task_id] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return manifests
+
+    def _samples(self):
+        """{model key: [(work, media minutes, seconds, tokens or None)]} from recent manifests."""
+        manifests = self._manifests()
+        samples = {}
+        for manifest in manifests.values():
+            recipe = manifest.get("recipe") or {}
+            # A batch member's source was downloaded and probed by its shared source task.
+            source = manifests.get(manifest.get("source_task_id"), manifest)
+            metadata_stage = source.get("stages", {}).get("metadata", {})
+            if metadata_stage.get("status") != "COMPLETED":
+                continue
+            media = metadata_stage["output"][0]
+            for name, key in planned_stages(recipe):
+                stage = manifest.get("stages", {}).get(name)
+                if not stage or stage.get("status") != "COMPLETED" or "seconds" not in stage:
+                    continue
+                samples.setdefault(key, []).append((media_work(key, media), (media.get("duration") or 0) / 60, stage["seconds"], stage.get("tokens")))
+        return samples
+
+    def model(self):
+        """{model key: {"base", "rate", "tokens", "samples"}}, refit when older than refresh_seconds."""
+        with self._lock:
+            if self._model is None or time.time() - self._fitted_at > self._refresh_seconds:
+                self._model = self._fit_model()
+                self._fitted_at = time.time()
+            return self._model
+
+    def _fit_model(self):
+        samples = self._samples()
+        model = {}
+        for key, prior in STAGE_PRIORS.items():
+            stage_samples = samples.get(key, [])
+            entry = {"base": prior["base"], "rate": prior["rate"], "tokens": dict(prior.get("tokens", {})), "samples": len(stage_samples)}
+            if stage_samples:
+                entry["base"], entry["rate"] = _fit([(work, seconds) for work, _, seconds, _ in stage_samples], prior)
+            token_samples = [(minutes, tokens) for _, minutes, _, tokens in stage_samples if tokens]
+            minutes = sum(minutes for minutes, _ in token_samples)
+            if minutes > 0:
+                entry["tokens"] = {kind: sum(tokens.get(kind, 0) for _, tokens in token_samples) / minutes for kind in ("prompt", "output")}
+            model[key] = entry
+        logging.info(f"Fitted job estimates from {sum(len(s) for s in samples.values())} stage runs.")
+        return model
+
+    def estimate(self, recipe, media, phases=("analysis", "render")):
+        """
+        Predicted seconds and Gemini tokens of each stage of recipe on media
+        ({"duration", "width", "height"}), with totals and, when the recipe has a
+        deadline_seconds, whether the run is expected to finish within it.
+        """
+        model = self.model()
+        minutes = (media.get("duration") or 0) / 60
+        stages = {}
+        for name, key in planned_stages(recipe, phases):
+            entry = model[key]
+            stages[name] = {
+                "seconds": round(entry["base"] + entry["rate"] * media_work(key, media), 3),
+                "tokens": {kind: int(round(rate * minutes)) for kind, rate in entry["tokens"].items()},
+                "samples": entry["samples"],
+            }
+        total_tokens = {kind: sum(stage["tokens"].get(kind, 0) for stage in stages.values()) for kind in ("prompt", "output")}
+        result = {
+            "media": {key: media.get(key) for key in ("duration", "width", "height")},
+            "stages": stages,
+            "total_seconds": round(sum(stage["seconds"] for stage in stages.values()), 3),
+            "total_tokens": total_tokens,
+        }
+        deadline = recipe.get("deadline_seconds")
+        if deadline:
+            result["deadline_seconds"] = float(deadline)
+            result["meets_deadline"] = result["total_seconds"] <= float(deadline)
+        return result
@@ -0,0 +1,138 @@
+import contextvars
+import logging
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from utils.metrics import observe_ffmpeg, FFMPEG_FAILURES
+from utils.cancellation import TaskCancelled, current_cancellation
+
+# Lines of ffmpeg stderr kept for error reporting; everything older is dropped as it is read.
+STDERR_TAIL_LINES = 200
+# Minimum seconds between progress updates written to task_status.
+PROGRESS_INTERVAL = 1.0
+
+_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+class FFmpegMonitor:
+    """
+    Per-task progress reporting for every ffmpeg run made while it is active (see
+    monitor_ffmpeg): progress goes to task_status as stage_progress/eta_seconds.
+    """
+
+    def __init__(self, task_id, task_status):
+        self.task_id = task_id
+        self.task_status = task_status
+        self._last_report = 0.0
+
+    def start(self, operation):
+        self._last_report = 0.0
+        self.task_status[self.task_id].update({"stage_progress": 0, "eta_seconds": None})
+
+    def report(self, operation, percent, eta_seconds, final=False):
+        now = time.monotonic()
+        if not final and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        self.task_status[self.task_id].update({
+            "stage_progress": percent,
+            "eta_seconds": eta_seconds,
+        })
+
+_current_monitor = contextvars.ContextVar("ffmpeg_monitor", default=None)
+
+@contextmanager
+def monitor_ffmpeg(task_id, task_status):
+    """Routes progress of ffmpeg runs on this thread to task_id."""
+    token = _current_monitor.set(FFmpegMonitor(task_id, task_status))
+    try:
+        yield
+    finally:
+        _current_monitor.reset(token)
+
+def _parse_seconds(value):
+    try:
+        return int(value) / 1_000_000
+    except (TypeError, ValueError):
+        return None
+
+def _parse_speed(value):
+    try:
+        return float(value.rstrip("x"))
+    except (AttributeError, ValueError):
+        return None
+
+def _drain_stderr(stream, tail, input_duration):
+    for line in stream:
+        tail.append(line)
+        if input_duration[0] is None:
+            match = _DURATION.search(line)
+            if match:
+                hours, minutes, seconds = match.groups()
+                input_duration[0] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def _watch_cancel(process, cancel_event, cancelled):
+    while process.poll() is None:
+        if cancel_event.wait(0.25):
+            cancelled.set()
+            process.kill()
+            return
+
+def run_ffmpeg(operation, command, duration=None):
+    """
+    Runs an ffmpeg command list with -progress on a pipe. Progress (against `duration`,
+    or the first input's duration) is reported to the thread's FFmpegMonitor, only the
+    last STDERR_TAIL_LINES of stderr are kept, and the process is killed (raising
+    TaskCancelled) if the current task is cancelled. Returns a CompletedProcess whose stderr is that tail;
+    raises subprocess.CalledProcessError like subprocess.run(check=True).
+    """
+    monitor = _current_monitor.get()
+    cancellation = current_cancellation()
+    if cancellation is not None:
+        cancellation.check()
+    command = [command[0], "-nostdin", "-nostats", "-progress", "pipe:1", *command[1:]]
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    input_duration = [duration]
+    cancelled = threading.Event()
+    speed = None
+
+    start = time.perf_counter()
+    if monitor:
+        monitor.start(operation)
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    stderr_thread = threading.Thread(target=_drain_stderr, args=(process.stderr, tail, input_duration), daemon=True)
+    stderr_thread.start()
+    if cancellation is not None:
+        threading.Thread(target=_watch_cancel, args=(process, cancellation.event, cancelled), daemon=True).start()
+
+    block = {}
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        block[key] = value
+        if key != "progress":
+            continue
+        out_time = _parse_seconds(block.get("out_time_us"))
+        speed = _parse_speed(block.get("speed")) or speed
+        total = input_duration[0]
+        if monitor and out_time is not None and total:
+            percent = min(100, round(out_time / total * 100))
+            eta = round(max(total - out_time, 0) / speed) if speed else None
+            monitor.report(operation, percent, eta, final=value == "end")
+        block = {}
+
+    returncode = process.wait()
+    stderr_thread.join()
+    stderr = "".join(tail)
+    elapsed = time.perf_counter() - start
+    if cancelled.is_set():
+        logging.info(f"ffmpeg {operation} killed after {elapsed:.1f}s: task cancelled.")
+        raise TaskCancelled(cancellation.reason or "cancelled")
+    if returncode != 0:
+        FFMPEG_FAILURES.labels(operation).inc()
+        observe_ffmpeg(operation, elapsed, speed)
+        raise subprocess.CalledProcessError(returncode, command, output=None, stderr=stderr)
+    observe_ffmpeg(operation, elapsed, speed)
+    return subprocess.CompletedProcess(command, returncode, stdout=None, stderr=stderr)
@@ -1,79 +1,16 @@
 import subprocess
-import srt
 import re
-import json
 from datetime import timedelta
 import os
 import logging
 import time
+from utils.caption_layout import parse_timed_words, build_ass_document
+from utils.ffmpeg_runner import run_ffmpeg
+from utils.media_probe import probe_media
 
 def get_video_metadata(video_path):
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-show_streams",
-        "-of", "json",
-        video_path
-    ]
-    process = subprocess.run(command, capture_output=True, text=True)
-    if process.returncode != 0:
-        raise Exception(f"ffprobe error: {process.stderr}")
-    
-    metadata = json.loads(process.stdout)
-    
-    video_stream = None
-    audio_stream = None
-    for stream in metadata["streams"]:
-        if stream['codec_type'] == 'video':
-            video_stream = stream
-        elif stream['codec_type'] == 'audio':
-            audio_stream = stream
-
-    if not video_stream:
-        raise Exception("No video stream found")
-
-    width = video_stream.get("width")
-    height = video_stream.get("height")
-    display_aspect_ratio = video_stream.get("display_aspect_ratio")
-    duration = float(video_stream.get("duration", 0))
-    
-    if 'r_frame_rate' in video_stream and video_stream['r_frame_rate'] != '0/0':
-        num, den = map(int, video_stream['r_frame_rate'].split('/'))
-        frame_rate = num / den
-    else:
-        frame_rate = 30 # default
-
-    aspect_ratio_str = "unknown"
-    if display_aspect_ratio:
-        parts = display_aspect_ratio.split(':')
-        if len(parts) == 2:
-            try:
-                ar_width = int(parts[0])
-                ar_height = int(parts[1])
-                aspect_ratio_str = f"{ar_width}:{ar_height}"
-            except ValueError:
-                pass
-
-    if aspect_ratio_str == "unknown" and width and height:
-        from fractions import Fraction
-        aspect_ratio_fraction = Fraction(width, height).limit_denominator()
-        aspect_ratio_str = f"{aspect_ratio_fraction.numerator}:{aspect_ratio_fraction.denominator}"
-
-    result = {
-        "width": width, 
-        "height": height, 
-        "aspect_ratio": aspect_ratio_str, 
-        "duration": duration,
-        "frame_rate": frame_rate
-    }
-
-    if audio_stream:
-        result["audio"] = {
-            "sample_rate": int(audio_stream.get("sample_rate", 44100)),
-            "channels": int(audio_stream.get("channels", 1))
-        }
-    
-    return result
+    """Stream info of video_path from its (cached) probe index; see utils.media_probe."""
+    return probe_media(video_path).metadata()
 
 def timedelta_string_to_seconds(td_str):
     """Converts a time string in formats like HH:MM:SS.ms or seconds to seconds."""
@@ -91,39 +28,172 @@ def timedelta_string_to_seconds(td_str):
 
 
 
-def apply_noise_reduction(input_path, output_path, task_id, task_status):
-    task_status[task_id].update({"status": "NOISE_REDUCTION", "progress": 30, "message": f"Applying noise reduction to {input_path}"})
-    logging.info(f"[{task_id}] Applying noise reduction to {input_path}, output to {output_path}")
+# Clean audio is stored as FLAC (lossless, a third to half the size of PCM); chunks
+# that are only crossfaded and deleted stay float PCM.
+DENOISE_CODEC_ARGS = {
+    ".flac": ["-c:a", "flac", "-sample_fmt", "s16"],
+    ".wav": ["-c:a", "pcm_f32le", "-rf64", "auto"],
+}
+
+def extract_audio(input_path, output_path, duration=None):
+    """Decodes the first audio stream to 16-bit WAV, padded so it starts at time 0 like the video."""
     command = [
         "ffmpeg",
         "-i", input_path,
-        "-af", "afftdn",
-        "-c:v", "copy",
-        output_path
+        "-map", "0:a:0",
+        "-vn",
+        "-af", "aresample=async=1:first_pts=0",
+        "-c:a", "pcm_s16le",
+        "-rf64", "auto",
+        "-y", output_path
+    ]
+    try:
+        run_ffmpeg("extract_audio", command, duration=duration)
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error extracting audio: {e.stderr}")
+        return False
+
+def denoise_audio(input_path, output_path, input_window=None, duration=None):
+    """
+    Runs afftdn over the first audio stream of input_path, or only over input_window
+    (start, duration) of it. The video is not touched; see mux_audio.
+    """
+    command = [
+        "ffmpeg",
+        *_input_window_args(input_window),
+        "-i", input_path,
+        "-map", "0:a:0",
+        "-vn",
+        "-af", "aresample=async=1:first_pts=0,afftdn",
+        *DENOISE_CODEC_ARGS[os.path.splitext(output_path)[1]],
+        "-y", output_path
     ]
     try:
         logging.info(f"Executing FFmpeg noise reduction command: {' '.join(command)}")
-        process = subprocess.run(command, check=True, capture_output=True, text=True)
-        logging.info(f"FFmpeg noise reduction stdout: {process.stdout}")
-        logging.info(f"FFmpeg noise reduction stderr: {process.stderr}")
-        task_status[task_id].update({"status": "NOISE_REDUCTION_COMPLETE", "progress": 40, "message": "Noise reduction applied successfully."})
-        logging.info(f"[{task_id}] Noise reduction applied successfully.")
+        run_ffmpeg("noise_reduction", command, duration=input_window[1] if input_window else duration)
         return True
     except subprocess.CalledProcessError as e:
         logging.error(f"Error applying noise reduction: {e.stderr}")
-        task_status[task_id].update({"status": "NOISE_REDUCTION_FAILED", "progress": 40, "message": f"Noise reduction failed: {e.stderr}"})
         return False
 
-def cut_video_segments(input_path, segments_to_keep, output_path):
-    if not segments_to_keep:
-        logging.info("No segments to keep, copying original video.")
-        try:
-            subprocess.run(["ffmpeg", "-i", input_path, "-c", "copy", "-y", output_path], check=True, capture_output=True, text=True)
-            return True
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error copying video: {e.stderr}")
-            return False
+def mux_audio(video_path, audio_path, output_path, duration=None):
+    """Swaps video_path's audio for audio_path: the video stream is copied, the audio encoded to AAC."""
+    command = [
+        "ffmpeg",
+        "-i", video_path,
+        "-i", audio_path,
+        "-map", "0:v:0",
+        "-map", "1:a:0",
+        "-c:v", "copy",
+        "-c:a", "aac",
+        "-y", output_path
+    ]
+    try:
+        run_ffmpeg("mux_audio", command, duration=duration)
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error muxing audio: {e.stderr}")
+        return False
 
+# Gemini only needs to hear the speech and see roughly what is on screen, so it gets
+# small proxies instead of the source. A recipe's "analysis_proxy" overrides these;
+# "enabled": false uploads the source video and full-quality audio instead.
+DEFAULT_ANALYSIS_PROXY = {
+    "enabled": True,
+    "video_height": 360,
+    "video_fps": 2,
+    "video_crf": 32,
+    "audio_sample_rate": 16000,
+    "audio_bitrate": "24k",
+}
+AUDIO_PROXY_KEYS = ("enabled", "audio_sample_rate", "audio_bitrate")
+
+def analysis_proxy_settings(recipe):
+    return {**DEFAULT_ANALYSIS_PROXY, **(recipe.get("analysis_proxy") or {})}
+
+def create_audio_proxy(input_path, output_stem, settings, duration=None, audio_buffer=None):
+    """
+    Extracts the speech audio Gemini transcribes: mono Opus at a speech sample rate.
+    Silence is padded in front if the audio track starts late, so its timestamps match
+    the source timeline exactly. With an AudioBuffer of the same audio, it is encoded
+    from that PCM instead of decoding input_path again.
+    Returns the proxy path, or None if extraction failed.
+    """
+    input_args = ["-i", input_path, "-map", "0:a:0", "-vn"]
+    if settings["enabled"]:
+        output_path = output_stem + ".ogg"
+        if audio_buffer is not None:
+            input_args = audio_buffer.ffmpeg_input_args()
+        codec_args = [
+            "-af", "aresample=async=1:first_pts=0",
+            "-ac", "1",
+            "-ar", str(settings["audio_sample_rate"]),
+            "-c:a", "libopus",
+            "-b:a", str(settings["audio_bitrate"]),
+            "-application", "voip",
+        ]
+    else:
+        output_path = output_stem + ".mp3"
+        codec_args = ["-q:a", "0"]
+    command = [
+        "ffmpeg",
+        *input_args,
+        *codec_args,
+        "-y", output_path
+    ]
+    try:
+        run_ffmpeg("audio_proxy", command, duration=duration)
+        return output_path
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error extracting audio proxy: {e.stderr}")
+        return None
+
+def create_video_proxy(input_path, output_path, settings, duration=None, audio_path=None):
+    """
+    Renders the low-resolution, low-frame-rate copy Gemini watches, with mono speech
+    audio (from audio_path, e.g. the cleaned track, if given). Frames are dropped,
+    never retimed, so timestamps match the source.
+    """
+    audio_input_args = ["-i", audio_path] if audio_path else []
+    command = [
+        "ffmpeg",
+        "-i", input_path,
+        *audio_input_args,
+        "-map", "0:v:0",
+        "-map", "1:a:0" if audio_path else "0:a:0?",
+        "-vf", f"fps={settings['video_fps']},scale=-2:'min({settings['video_height']},ih)'",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", str(settings["video_crf"]),
+        "-pix_fmt", "yuv420p",
+        "-ac", "1",
+        "-ar", str(settings["audio_sample_rate"]),
+        "-c:a", "aac",
+        "-b:a", str(settings["audio_bitrate"]),
+        "-movflags", "+faststart",
+        "-y", output_path
+    ]
+    try:
+        run_ffmpeg("video_proxy", command, duration=duration)
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error rendering video proxy: {e.stderr}")
+        return False
+
+# Above this many kept segments the per-segment trim/atrim graph is swapped for a
+# single select/aselect pass, so ffmpeg memory stays flat as filler-word removal
+# produces hundreds of cuts.
+SELECT_ENGINE_MIN_SEGMENTS = 32
+
+def choose_cut_engine(segments_to_keep, engine="auto"):
+    if engine in ("trim", "select"):
+        return engine
+    if engine != "auto":
+        raise ValueError(f"Unknown cut engine: {engine}")
+    return "select" if len(segments_to_keep) >= SELECT_ENGINE_MIN_SEGMENTS else "trim"
+
+def _build_trim_filter(segments_to_keep, video=True, audio=True, audio_input="0:a"):
     filter_complex_parts = []
     video_outputs = []
     audio_outputs = []
@@ -131,94 +201,131 @@ def cut_video_segments(input_path, segments_to_keep, output_path):
     for i, segment in enumerate(segments_to_keep):
         start = segment['start']
         end = segment['end']
-        video_outputs.append(f"[v{i}]")
-        audio_outputs.append(f"[a{i}]")
-        filter_complex_parts.append(f"[0:v]trim=start={start}:end={end},setpts=PTS-STARTPTS[v{i}];")
-        filter_complex_parts.append(f"[0:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[a{i}];")
+        if video:
+            video_outputs.append(f"[v{i}]")
+            filter_complex_parts.append(f"[0:v]trim=start={start}:end={end},setpts=PTS-STARTPTS[v{i}];")
+        if audio:
+            audio_outputs.append(f"[a{i}]")
+            filter_complex_parts.append(f"[{audio_input}]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[a{i}];")
+
+    if video:
+        filter_complex_parts.append("".join(video_outputs) + f"concat=n={len(segments_to_keep)}:v=1:a=0[outv];")
+    if audio:
+        filter_complex_parts.append("".join(audio_outputs) + f"concat=n={len(segments_to_keep)}:v=0:a=1[outa]")
+
+    return "".join(filter_complex_parts).rstrip(";")
+
+def _build_select_filter(segments_to_keep, video=True, audio=True, audio_input="0:a"):
+    # One expression over the whole timeline: each frame is tested once and either
+    # passed or dropped, then timestamps are rebuilt from the running frame/sample count.
+    # Audio is re-chunked into small frames first so cuts land within a few ms.
+    expression = "+".join(f"gte(t,{segment['start']})*lt(t,{segment['end']})" for segment in segments_to_keep)
+    chains = []
+    if video:
+        chains.append(f"[0:v]select='{expression}',setpts=N/FRAME_RATE/TB[outv]")
+    if audio:
+        chains.append(f"[{audio_input}]asetnsamples=n=128,aselect='{expression}',asetpts=N/SR/TB[outa]")
+    return ";".join(chains)
 
-    filter_complex_parts.append("".join(video_outputs) + f"concat=n={len(segments_to_keep)}:v=1:a=0[outv];")
-    filter_complex_parts.append("".join(audio_outputs) + f"concat=n={len(segments_to_keep)}:v=0:a=1[outa]")
+def _input_window_args(input_window):
+    # Input-side seek: ffmpeg jumps to the nearest keyframe and decodes accurately from
+    # there, so only the requested window of the source is read.
+    if not input_window:
+        return []
+    start, duration = input_window
+    return ["-ss", str(start), "-t", str(duration)]
 
-    filter_complex = "".join(filter_complex_parts)
+def cut_video_segments(input_path, segments_to_keep, output_path, engine="auto", input_window=None, video=True, audio=True, audio_path=None):
+    """
+    Keeps segments_to_keep of input_path. With audio_path (e.g. the cleaned track) the
+    audio is cut from there instead of from input_path, which muxes it in for free.
+    """
+    if not segments_to_keep:
+        if audio_path:
+            return mux_audio(input_path, audio_path, output_path)
+        logging.info("No segments to keep, copying original video.")
+        try:
+            run_ffmpeg("copy", ["ffmpeg", "-i", input_path, "-c", "copy", "-y", output_path])
+            return True
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error copying video: {e.stderr}")
+            return False
+
+    engine = choose_cut_engine(segments_to_keep, engine)
+    logging.info(f"Cutting {len(segments_to_keep)} segments with the '{engine}' engine.")
+    audio_input_args = []
+    audio_input = "0:a"
+    if audio and audio_path:
+        audio_input_args = ["-i", audio_path]
+        audio_input = "1:a"
+
+    if engine == "select":
+        # The expression grows with the segment count, so pass it through a script
+        # file rather than the command line.
+        filter_script_path = os.path.splitext(output_path)[0] + "_select.txt"
+        with open(filter_script_path, 'w', encoding='utf-8') as f:
+            f.write(_build_select_filter(segments_to_keep, video=video, audio=audio, audio_input=audio_input))
+        # select leaves the output frame rate unset; keep the rebuilt timestamps as-is
+        # instead of letting the muxer resample to a guessed rate.
+        filter_args = ["-filter_complex_script", filter_script_path, "-fps_mode", "vfr"]
+    else:
+        filter_script_path = None
+        filter_args = ["-filter_complex", _build_trim_filter(segments_to_keep, video=video, audio=audio, audio_input=audio_input)]
+
+    map_args = []
+    if video:
+        map_args.extend(["-map", "[outv]"])
+    if audio:
+        map_args.extend(["-map", "[outa]"])
 
     command = [
         "ffmpeg",
+        *_input_window_args(input_window),
         "-i", input_path,
-        "-filter_complex", filter_complex,
-        "-map", "[outv]",
-        "-map", "[outa]",
+        *audio_input_args,
+        *filter_args,
+        *map_args,
         "-y",
         output_path
     ]
 
     try:
         logging.info(f"Executing FFmpeg command: {' '.join(command)}")
-        process = subprocess.run(command, check=True, capture_output=True, text=True)
-        logging.info(f"FFmpeg stdout: {process.stdout}")
-        logging.info(f"FFmpeg stderr: {process.stderr}")
+        # Progress is measured against the output, which is only the kept segments.
+        kept_duration = sum(segment['end'] - segment['start'] for segment in segments_to_keep)
+        run_ffmpeg("cut", command, duration=kept_duration)
         return True
     except subprocess.CalledProcessError as e:
         logging.error(f"Error cutting video segments: {e.stderr}")
         return False
+    finally:
+        if filter_script_path and os.path.exists(filter_script_path):
+            os.remove(filter_script_path)
 
-def _format_timedelta_for_ass(td):
-    total_seconds = td.total_seconds()
-    hours = int(total_seconds // 3600)
-    minutes = int((total_seconds % 3600) // 60)
-    seconds = int(total_seconds % 60)
-    centiseconds = int((total_seconds * 100) % 100)
-    return f"{hours}:{minutes:02}:{seconds:02}.{centiseconds:02}"
-
-def burn_srt_to_video(video_path, srt_path, output_path, ass_style=None):
-    # Convert SRT to ASS for advanced styling
-    ass_path = os.path.splitext(srt_path)[0] + ".ass"
+def write_ass_file(srt_path, ass_path, ass_style=None, play_res=(1920, 1080)):
+    # Convert SRT to ASS for advanced styling; words are grouped into lines and pages
+    # so libass renders one event per caption instead of one per word.
     with open(srt_path, 'r', encoding='utf-8') as f_srt:
-        subs = list(srt.parse(f_srt.read()))
+        words = parse_timed_words(f_srt.read())
 
+    ass_document = build_ass_document(words, ass_style=ass_style, play_res=play_res)
     with open(ass_path, 'w', encoding='utf-8') as f_ass:
-        f_ass.write("[Script Info]\n")
-        f_ass.write("Title: Generated by Storyboard AI\n")
-        f_ass.write("ScriptType: v4.00+\n")
-        f_ass.write("WrapStyle: 0\n")
-        f_ass.write("PlayResX: 1920\n")
-        f_ass.write("PlayResY: 1080\n")
-        f_ass.write("ScaledBorderAndShadow: yes\n\n")
-        f_ass.write("[V4+ Styles]\n")
-        f_ass.write("Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n")
-        
-        if ass_style:
-            style_name = "Styled"
-            fontname = ass_style.get("Fontname", "Arial")
-            fontsize = ass_style.get("Fontsize", "72")
-            primary_colour = ass_style.get("PrimaryColour", "&H00FFFFFF")
-            outline = ass_style.get("Outline", "3")
-            shadow = ass_style.get("Shadow", "2")
-            
-            alignment = "2" # Bottom Center
-            if ass_style.get("position") == "Top":
-                alignment = "8"
-            elif ass_style.get("position") == "Middle":
-                alignment = "5"
-
-            f_ass.write(f"Style: {style_name},{fontname},{fontsize},{primary_colour},&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,{outline},{shadow},{alignment},30,30,30,1\n")
-        else:
-            style_name = "Default"
-            f_ass.write("Style: Default,Arial,72,&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,3,2,2,30,30,30,1\n")
-
-        f_ass.write("\n[Events]\n")
-        f_ass.write("Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
-        for sub in subs:
-            start_time = _format_timedelta_for_ass(sub.start)
-            end_time = _format_timedelta_for_ass(sub.end)
-            f_ass.write(f"Dialogue: 0,{start_time},{end_time},{style_name},,0,0,0,,{sub.content}\n")
-
-    escaped_ass_path = ass_path.replace('\\', '/').replace(':', '\\:')
+        f_ass.write(ass_document)
+    return ass_path
+
+def _escape_filter_path(path):
+    return path.replace('\\', '/').replace(':', '\\:')
+
+def burn_srt_to_video(video_path, srt_path, output_path, ass_style=None, input_window=None, audio=True, play_res=(1920, 1080)):
+    ass_path = write_ass_file(srt_path, os.path.splitext(srt_path)[0] + ".ass", ass_style=ass_style, play_res=play_res)
+    escaped_ass_path = _escape_filter_path(ass_path)
 
     command = [
         "ffmpeg",
+        *_input_window_args(input_window),
         "-i", video_path,
         "-vf", f"ass={escaped_ass_path}",
-        "-c:a", "copy",
+        *(["-c:a", "copy"] if audio else ["-an"]),
         "-c:v", "libx264",
         "-preset", "ultrafast",
         "-crf", "23",
@@ -229,15 +336,79 @@ def burn_srt_to_video(video_path, srt_path, output_path, ass_style=None):
 
     try:
         logging.info(f"Executing FFmpeg command: {' '.join(command)}")
-        process = subprocess.run(command, check=True, capture_output=True, text=True)
-        logging.info(f"FFmpeg stdout: {process.stdout}")
-        logging.info(f"FFmpeg stderr: {process.stderr}")
+        run_ffmpeg("burn_captions", command, duration=input_window[1] if input_window else None)
         return True
     except subprocess.CalledProcessError as e:
         logging.error(f"Error burning subtitles to video: {e.stderr}")
         return False
 
 
+def _parse_aspect_ratio(aspect_ratio):
+    ratio_width, ratio_height = aspect_ratio.split(':')
+    return int(ratio_width), int(ratio_height)
+
+def plan_rendition(source_width, source_height, aspect_ratio):
+    """
+    Works out the centred crop that turns the source frame into aspect_ratio.
+    Dimensions are rounded down to even numbers for yuv420p encoders.
+    """
+    ratio_width, ratio_height = _parse_aspect_ratio(aspect_ratio)
+    if source_width * ratio_height > source_height * ratio_width:
+        height = source_height
+        width = source_height * ratio_width // ratio_height
+    else:
+        width = source_width
+        height = source_width * ratio_height // ratio_width
+    width -= width % 2
+    height -= height % 2
+    return {
+        "aspect_ratio": aspect_ratio,
+        "width": width,
+        "height": height,
+        "filter": f"crop={width}:{height}:(iw-{width})/2:(ih-{height})/2,scale={width}:{height}",
+    }
+
+def render_renditions(video_path, renditions, srt_path=None, ass_style=None):
+    """
+    Renders every rendition from a single decode of video_path: the video is split once
+    and each branch gets its own crop, caption layout and encoder.
+    Each rendition is a plan_rendition() dict plus an "output_path".
+    """
+    filter_complex_parts = [f"[0:v]split={len(renditions)}" + "".join(f"[s{i}]" for i in range(len(renditions)))]
+    output_args = []
+    for i, rendition in enumerate(renditions):
+        chain = rendition["filter"]
+        if srt_path:
+            ratio_tag = rendition["aspect_ratio"].replace(':', 'x')
+            ass_path = write_ass_file(srt_path, f"{os.path.splitext(srt_path)[0]}_{ratio_tag}.ass", ass_style=ass_style, play_res=(rendition["width"], rendition["height"]))
+            chain += f",ass={_escape_filter_path(ass_path)}"
+        filter_complex_parts.append(f"[s{i}]{chain}[v{i}]")
+        output_args.extend([
+            "-map", f"[v{i}]",
+            "-map", "0:a?",
+            "-c:a", "copy",
+            "-c:v", "libx264",
+            "-preset", "ultrafast",
+            "-crf", "23",
+            rendition["output_path"]
+        ])
+
+    command = [
+        "ffmpeg",
+        "-i", video_path,
+        "-filter_complex", ";".join(filter_complex_parts),
+        "-y",
+        *output_args
+    ]
+
+    try:
+        logging.info(f"Executing FFmpeg command: {' '.join(command)}")
+        run_ffmpeg("renditions", command)
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error rendering renditions: {e.stderr}")
+        return False
+
 def extract_clip(input_path, start_time, end_time, output_path):
     """
     Extracts a clip from a video file.
@@ -251,7 +422,7 @@ def extract_clip(input_path, start_time, end_time, output_path):
         output_path
     ]
     try:
-        subprocess.run(command, check=True, capture_output=True, text=True)
+        run_ffmpeg("extract_clip", command)
         return True
     except subprocess.CalledProcessError as e:
         logging.error(f"Error extracting clip: {e.stderr}")
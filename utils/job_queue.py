@@ -0,0 +1,385 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_LEASE_SECONDS = 60
+# A job whose worker lost its lease this many times is failed instead of re-queued.
+DEFAULT_MAX_ATTEMPTS = 3
+# Shortest job first, aged: each second a job waits counts as this many seconds off its
+# estimated run time, so long jobs still get their turn behind a stream of short ones.
+DEFAULT_SJF_AGING = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    video_url TEXT NOT NULL,
+    recipe TEXT NOT NULL,
+    state TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker_id TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    status_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, created_at);
+CREATE INDEX IF NOT EXISTS jobs_status_seq ON jobs (status_seq);
+"""
+
+class LeaseLost(Exception):
+    pass
+
+class JobQueue:
+    """
+    Durable job queue and status store in a single SQLite file. Any number of API
+    processes and worker processes (on this box, or on machines sharing the volume)
+    can open the same file; SQLite's write lock serialises claims.
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, sjf_aging=DEFAULT_SJF_AGING):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.sjf_aging = sjf_aging
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "members" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN members TEXT")
+            if "cancel_requested" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+            if "estimated_seconds" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN estimated_seconds REAL")
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can never
+        # read the same queued row and both claim it.
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _next_status_seq(self, conn):
+        return conn.execute("SELECT COALESCE(MAX(status_seq), 0) + 1 FROM jobs").fetchone()[0]
+
+    def enqueue(self, task_id, video_url, recipe, status, estimated_seconds=None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, video_url, recipe, state, status, created_at, updated_at, status_seq, estimated_seconds) VALUES (?, ?, ?, 'QUEUED', ?, ?, ?, ?, ?)",
+                (task_id, video_url, json.dumps(recipe), json.dumps(status), now, now, self._next_status_seq(conn), estimated_seconds),
+            )
+
+    def enqueue_group(self, source_task_id, video_url, recipe, members, status, estimated_seconds=None):
+        """
+        Enqueues a batch source group as one job: a worker claims source_task_id, analyzes
+        the source once and renders every member ({"task_id", "recipe"}). Member rows
+        are stored in the GROUPED state so their status is shared, but never claimed.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, video_url, recipe, state, status, created_at, updated_at, status_seq, members, estimated_seconds) VALUES (?, ?, ?, 'QUEUED', ?, ?, ?, ?, ?, ?)",
+                (source_task_id, video_url, json.dumps(recipe), json.dumps(status), now, now, self._next_status_seq(conn), json.dumps(members), estimated_seconds),
+            )
+            for member in members:
+                conn.execute(
+                    "INSERT INTO jobs (id, video_url, recipe, state, status, created_at, updated_at, status_seq) VALUES (?, ?, ?, 'GROUPED', ?, ?, ?, ?)",
+                    (member["task_id"], video_url, json.dumps(member["recipe"]), json.dumps(status), now, now, self._next_status_seq(conn)),
+                )
+
+    def set_estimate(self, task_id, estimated_seconds):
+        """Records a job's estimated run time, used by claim() while the job is still queued."""
+        with self._connection() as conn:
+            conn.execute("UPDATE jobs SET estimated_seconds = ? WHERE id = ? AND state = 'QUEUED'", (estimated_seconds, task_id))
+
+    def finish_members(self, member_states):
+        """Marks GROUPED member rows {task_id: state} as finished once their group job is done."""
+        now = time.time()
+        with self._transaction() as conn:
+            for task_id, state in member_states.items():
+                conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state = 'GROUPED'", (state, now, task_id))
+
+    def requeue(self, task_id, video_url, recipe, status, estimated_seconds=None):
+        """
+        Puts a finished job back in the queue, e.g. to resume it from its checkpoints
+        or re-render it with a changed recipe. Returns False if the job is still queued
+        or running.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state FROM jobs WHERE id = ?", (task_id,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO jobs (id, video_url, recipe, state, status, created_at, updated_at, status_seq, estimated_seconds) VALUES (?, ?, ?, 'QUEUED', ?, ?, ?, ?, ?)",
+                    (task_id, video_url, json.dumps(recipe), json.dumps(status), now, now, self._next_status_seq(conn), estimated_seconds),
+                )
+                return True
+            if row["state"] not in ("COMPLETED", "FAILED", "CANCELLED"):
+                return False
+            conn.execute(
+                "UPDATE jobs SET state = 'QUEUED', video_url = ?, recipe = ?, status = ?, worker_id = NULL, lease_expires = NULL, attempts = 0, cancel_requested = 0, created_at = ?, updated_at = ?, status_seq = ?, estimated_seconds = ? WHERE id = ?",
+                (video_url, json.dumps(recipe), json.dumps(status), now, now, self._next_status_seq(conn), estimated_seconds, task_id),
+            )
+        return True
+
+    def claim(self, worker_id):
+        """
+        Leases the next runnable job to worker_id: first a running job whose worker
+        stopped heartbeating, then the queued job with the shortest estimated run time,
+        less sjf_aging times how long it has waited (oldest first among jobs without an
+        estimate). Returns the job dict or None.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._cancel_abandoned(conn, now)
+            self._fail_exhausted(conn, now)
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE state = 'QUEUED' OR (state = 'RUNNING' AND lease_expires < ?) "
+                "ORDER BY state = 'QUEUED', COALESCE(estimated_seconds, 0) - (? - created_at) * ?, created_at LIMIT 1",
+                (now, now, self.sjf_aging),
+            ).fetchone()
+            if row is None:
+                return None
+            if row["state"] == "RUNNING":
+                logging.warning(f"[{row['id']}] Lease held by {row['worker_id']} expired, reclaiming for {worker_id}.")
+            conn.execute(
+                "UPDATE jobs SET state = 'RUNNING', worker_id = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row["id"]),
+            )
+        return {
+            "task_id": row["id"],
+            "video_url": row["video_url"],
+            "recipe": json.loads(row["recipe"]),
+            "members": json.loads(row["members"]) if row["members"] else None,
+            "attempts": row["attempts"] + 1,
+        }
+
+    def _cancel_abandoned(self, conn, now):
+        # A cancelled job whose worker died is not worth reclaiming.
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE state = 'RUNNING' AND lease_expires < ? AND cancel_requested = 1",
+            (now,),
+        ).fetchall()
+        for row in rows:
+            self._set_cancelled(conn, row["id"], now)
+
+    def _set_cancelled(self, conn, task_id, now):
+        status = {"status": "CANCELLED", "message": "Task cancelled.", "error": "cancelled"}
+        conn.execute(
+            "UPDATE jobs SET state = 'CANCELLED', status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ?, status_seq = ? WHERE id = ?",
+            (json.dumps(status), now, self._next_status_seq(conn), task_id),
+        )
+
+    def request_cancel(self, task_id):
+        """
+        Cancels a job. A queued job is cancelled on the spot; a running job (or a member
+        of a batch group) is flagged for its worker, which stops it within a second or
+        so. Returns None for an unknown job and False if it has already finished.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state, members FROM jobs WHERE id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            if row["state"] in ("COMPLETED", "FAILED", "CANCELLED"):
+                return False
+            conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ?", (now, task_id))
+            if row["state"] == "QUEUED":
+                self._set_cancelled(conn, task_id, now)
+                # A batch group that never started takes its members with it.
+                for member in json.loads(row["members"]) if row["members"] else []:
+                    self._set_cancelled(conn, member["task_id"], now)
+        return True
+
+    def cancel_requests(self, task_ids):
+        """The subset of task_ids that have been asked to cancel."""
+        placeholders = ", ".join("?" for _ in task_ids)
+        with self._connection() as conn:
+            rows = conn.execute(f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})", list(task_ids)).fetchall()
+        return {row["id"] for row in rows}
+
+    def _fail_exhausted(self, conn, now):
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE state = 'RUNNING' AND lease_expires < ? AND attempts >= ?",
+            (now, self.max_attempts),
+        ).fetchall()
+        for row in rows:
+            status = {"status": "FAILED", "message": "Worker lease expired too many times.", "error": "lease_expired"}
+            conn.execute(
+                "UPDATE jobs SET state = 'FAILED', status = ?, worker_id = NULL, updated_at = ?, status_seq = ? WHERE id = ?",
+                (json.dumps(status), now, self._next_status_seq(conn), row["id"]),
+            )
+
+    def heartbeat(self, task_id, worker_id):
+        """Extends the lease. Raises LeaseLost if another worker has taken the job over."""
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND state = 'RUNNING'",
+                (now + self.lease_seconds, now, task_id, worker_id),
+            )
+        if cursor.rowcount == 0:
+            raise LeaseLost(task_id)
+
+    def set_status(self, task_id, status, worker_id, job_id=None):
+        """
+        Writes the status of task_id, as long as worker_id still holds the lease on job_id
+        (default task_id; a batch member's status is written under its group's job).
+        Returns False if the lease was lost, so the write was dropped.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, status_seq = ? WHERE id = ? "
+                "AND EXISTS (SELECT 1 FROM jobs WHERE id = ? AND worker_id = ?)",
+                (json.dumps(status, default=str), now, self._next_status_seq(conn), task_id, job_id or task_id, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def finish(self, task_id, worker_id, state):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? WHERE id = ? AND worker_id = ?",
+                (state, now, task_id, worker_id),
+            )
+
+    def get_status(self, task_id):
+        with self._connection() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        return json.loads(row["status"]) if row else None
+
+    def status_changes(self, after_seq):
+        """Returns [(task_id, status, seq)] for every status written after after_seq."""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, status, status_seq FROM jobs WHERE status_seq > ? ORDER BY status_seq",
+                (after_seq,),
+            ).fetchall()
+        return [(row["id"], json.loads(row["status"]), row["status_seq"]) for row in rows]
+
+    def latest_status_seq(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(status_seq), 0) FROM jobs").fetchone()[0]
+
+    def counts(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+class QueueTaskRecord(dict):
+    """Status dict handed to the pipeline on a worker; every update is written through."""
+
+    def __init__(self, queue, task_id, worker_id, job_id, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue = queue
+        self._task_id = task_id
+        self._worker_id = worker_id
+        self._job_id = job_id
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        if not self._queue.set_status(self._task_id, dict(self), self._worker_id, self._job_id):
+            logging.warning(f"[{self._task_id}] Status update dropped: worker {self._worker_id} no longer holds the lease on job {self._job_id}.")
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+class QueueTaskStatus(dict):
+    """
+    Worker-side stand-in for the API's task_status mapping, so
+    process_video_with_recipe runs unchanged and its status lands in the shared store,
+    fenced by worker_id's lease on job_id.
+    """
+
+    def __init__(self, queue, worker_id, job_id):
+        super().__init__()
+        self._queue = queue
+        self._worker_id = worker_id
+        self._job_id = job_id
+
+    def __setitem__(self, task_id, status):
+        record = QueueTaskRecord(self._queue, task_id, self._worker_id, self._job_id)
+        super().__setitem__(task_id, record)
+        record.update(status)
+
+class QueueStatusRelay:
+    """
+    Runs in the API process: one background thread follows status writes in the shared
+    store and replays them into the in-process TaskStatusStore, so SSE subscribers
+    still block on events instead of each polling the database.
+    """
+
+    def __init__(self, queue, task_status, interval=0.5):
+        self._queue = queue
+        self._task_status = task_status
+        self._interval = interval
+        self._last_seq = queue.latest_status_seq()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="queue-status-relay", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def ensure_loaded(self, task_id):
+        """Makes a task known to the in-process store, e.g. one submitted before a restart."""
+        if task_id in self._task_status:
+            return True
+        status = self._queue.get_status(task_id)
+        if status is None:
+            return False
+        with self._lock:
+            if task_id not in self._task_status:
+                self._task_status[task_id] = status
+        return True
+
+    def _apply(self, task_id, status):
+        with self._lock:
+            if task_id in self._task_status:
+                self._task_status[task_id].update(status)
+            else:
+                self._task_status[task_id] = status
+
+    def _run(self):
+        while True:
+            try:
+                for task_id, status, seq in self._queue.status_changes(self._last_seq):
+                    self._apply(task_id, status)
+                    self._last_seq = seq
+            except sqlite3.Error as e:
+                logging.error(f"Error reading status changes from job queue: {e}")
+            time.sleep(self._interval)
+
+def get_job_queue_from_env():
+    """Returns a JobQueue when JOB_QUEUE_PATH is set, otherwise None (in-process threads)."""
+    path = os.getenv("JOB_QUEUE_PATH")
+    if not path:
+        return None
+    return JobQueue(
+        path,
+        lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)),
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+        sjf_aging=float(os.getenv("JOB_SJF_AGING", DEFAULT_SJF_AGING)),
+    )
@@ -0,0 +1,273 @@
+import os
+import json
+import bisect
+import logging
+import subprocess
+from fractions import Fraction
+
+from utils.artifacts import file_sha256
+from utils.checkpoint import get_tasks_dir
+
+# Bumped when the index layout changes, so older sidecars are probed again.
+INDEX_VERSION = 1
+# A remote probe runs while a submission waits for its response.
+URL_PROBE_TIMEOUT = 15
+
+def probe_cache_dir():
+    """Sidecar indexes live here, one JSON file per source content hash."""
+    return os.path.abspath(os.getenv("PROBE_CACHE_DIR") or os.path.join(get_tasks_dir(), "_probe"))
+
+def _ffprobe(args, timeout=None):
+    process = subprocess.run(["ffprobe", "-v", "error", *args], capture_output=True, text=True, timeout=timeout)
+    if process.returncode != 0:
+        raise Exception(f"ffprobe error: {process.stderr}")
+    return process.stdout
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _rate(value):
+    if not value or value == "0/0":
+        return None
+    try:
+        rate = Fraction(value)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return float(rate) if rate > 0 else None
+
+def _aspect_ratio(video_stream):
+    display_aspect_ratio = video_stream.get("display_aspect_ratio")
+    if display_aspect_ratio:
+        parts = display_aspect_ratio.split(':')
+        if len(parts) == 2:
+            try:
+                return f"{int(parts[0])}:{int(parts[1])}"
+            except ValueError:
+                pass
+    width, height = video_stream.get("width"), video_stream.get("height")
+    if width and height:
+        aspect_ratio_fraction = Fraction(width, height).limit_denominator()
+        return f"{aspect_ratio_fraction.numerator}:{aspect_ratio_fraction.denominator}"
+    return "unknown"
+
+def _scan_video_packets(path):
+    """
+    Keyframe timestamps, packet count and first/last presentation time of the first
+    video stream. Reads packets only (no decoding), so it runs at demux speed.
+    """
+    output = _ffprobe(["-select_streams", "v:0", "-show_entries", "packet=pts_time,duration_time,flags", "-of", "csv=p=0", path])
+    keyframes = []
+    frame_count = 0
+    first_pts = None
+    end_time = None
+    for line in output.splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 3:
+            continue
+        pts = _float(fields[0])
+        if pts is None:
+            continue
+        frame_count += 1
+        first_pts = pts if first_pts is None else min(first_pts, pts)
+        end = pts + (_float(fields[1]) or 0.0)
+        end_time = end if end_time is None else max(end_time, end)
+        if "K" in fields[2]:
+            keyframes.append(pts)
+    # Packets come in decode order; with B-frames that isn't presentation order.
+    keyframes.sort()
+    return {"keyframes": keyframes, "frame_count": frame_count, "first_pts": first_pts, "end_time": end_time}
+
+def _probe_streams(location, timeout=None):
+    probe = json.loads(_ffprobe(["-show_format", "-show_streams", "-of", "json", location], timeout=timeout))
+    streams = probe.get("streams", [])
+    video_stream = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    audio_stream = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+    if not video_stream:
+        raise Exception("No video stream found")
+    return video_stream, audio_stream, probe.get("format", {})
+
+def _resolve_duration(location, candidates):
+    """The first positive (source, seconds) of candidates, in order of trust."""
+    for source, value in candidates:
+        if value and value > 0:
+            return source, value
+    logging.warning(f"No duration found for {location}; every stream and the container report none.")
+    return "unknown", 0.0
+
+def probe_url_metadata(url):
+    """
+    Size and duration of a remote (or local) video without downloading it: ffprobe
+    reads only the headers it needs. For estimates; the pipeline uses probe_media.
+    """
+    video_stream, audio_stream, container = _probe_streams(url, timeout=URL_PROBE_TIMEOUT)
+    duration_source, duration = _resolve_duration(url, [
+        ("video_stream", _float(video_stream.get("duration"))),
+        ("container", _float(container.get("duration"))),
+        ("audio_stream", _float((audio_stream or {}).get("duration"))),
+    ])
+    return {
+        "width": video_stream.get("width"),
+        "height": video_stream.get("height"),
+        "duration": duration,
+        "duration_source": duration_source,
+        "frame_rate": _rate(video_stream.get("r_frame_rate")) or _rate(video_stream.get("avg_frame_rate")) or 30,
+        "has_audio": audio_stream is not None,
+    }
+
+def build_media_index(path, sha256=None):
+    """
+    Probes path once for streams, container format and every video keyframe. Duration
+    is the video stream's, else the span of its packets, else the container's, else
+    the audio stream's, so containers that omit a per-stream duration still get one.
+    """
+    video_stream, audio_stream, container = _probe_streams(path)
+    packets = _scan_video_packets(path)
+    start_time = _float(video_stream.get("start_time")) or packets["first_pts"] or 0.0
+    frame_rate = _rate(video_stream.get("r_frame_rate")) or _rate(video_stream.get("avg_frame_rate")) or 30
+    duration_source, duration = _resolve_duration(path, [
+        ("video_stream", _float(video_stream.get("duration"))),
+        ("packets", packets["end_time"] - start_time if packets["end_time"] is not None else None),
+        ("container", _float(container.get("duration"))),
+        ("audio_stream", _float((audio_stream or {}).get("duration"))),
+    ])
+
+    index = {
+        "version": INDEX_VERSION,
+        "sha256": sha256,
+        "size": os.path.getsize(path),
+        "format_name": container.get("format_name"),
+        "duration": duration,
+        "duration_source": duration_source,
+        "container_duration": _float(container.get("duration")),
+        "video": {
+            "index": video_stream.get("index"),
+            "codec": video_stream.get("codec_name"),
+            "width": video_stream.get("width"),
+            "height": video_stream.get("height"),
+            "aspect_ratio": _aspect_ratio(video_stream),
+            "frame_rate": frame_rate,
+            "avg_frame_rate": _rate(video_stream.get("avg_frame_rate")),
+            "time_base": video_stream.get("time_base"),
+            "start_time": start_time,
+            "end_time": packets["end_time"],
+            "frame_count": packets["frame_count"],
+        },
+        "audio": None,
+        "keyframes": packets["keyframes"],
+    }
+    if audio_stream:
+        index["audio"] = {
+            "index": audio_stream.get("index"),
+            "codec": audio_stream.get("codec_name"),
+            "sample_rate": int(audio_stream.get("sample_rate", 44100)),
+            "channels": int(audio_stream.get("channels", 1)),
+            "start_time": _float(audio_stream.get("start_time")),
+            "duration": _float(audio_stream.get("duration")),
+        }
+    return index
+
+def probe_media(path):
+    """
+    The MediaIndex of path, from the sidecar cache when a file with the same content
+    was probed before (another task, a retry, a batch sharing the source).
+    """
+    sha256 = file_sha256(path)
+    sidecar_path = os.path.join(probe_cache_dir(), f"{sha256}.json")
+    media_index = MediaIndex.load(sidecar_path)
+    if media_index is not None and media_index.data.get("version") == INDEX_VERSION:
+        # Marks the entry as used, for retention's expiry.
+        os.utime(sidecar_path)
+        logging.info(f"Reusing probe index {sidecar_path} for {path}.")
+        return media_index
+
+    data = build_media_index(path, sha256)
+    os.makedirs(probe_cache_dir(), exist_ok=True)
+    temp_path = sidecar_path + f".{os.getpid()}.part"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temp_path, sidecar_path)
+    logging.info(f"Probed {path}: {data['duration']:.3f}s from {data['duration_source']}, {len(data['keyframes'])} keyframes.")
+    return MediaIndex(data, sidecar_path)
+
+def load_media_index(video_metadata):
+    """The MediaIndex behind a metadata dict from MediaIndex.metadata(), or None if it is gone."""
+    return MediaIndex.load(video_metadata.get("media_index")) if video_metadata else None
+
+class MediaIndex:
+    """
+    Probe results of one source: stream info, resolved duration, frame timing and the
+    sorted keyframe timestamps, which every lookup below searches by bisection.
+    """
+
+    def __init__(self, data, path=None):
+        self.data = data
+        self.path = path
+        self.keyframes = data["keyframes"]
+
+    @classmethod
+    def load(cls, path):
+        if not path:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f), path)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def duration(self):
+        return self.data["duration"]
+
+    @property
+    def frame_rate(self):
+        return self.data["video"]["frame_rate"]
+
+    def metadata(self):
+        """The video_metadata dict the pipeline passes around, pointing back at this index."""
+        video = self.data["video"]
+        result = {
+            "width": video["width"],
+            "height": video["height"],
+            "aspect_ratio": video["aspect_ratio"],
+            "duration": self.duration,
+            "frame_rate": video["frame_rate"],
+            "frame_count": video["frame_count"],
+            "start_time": video["start_time"],
+            "keyframe_count": len(self.keyframes),
+            "media_index": self.path,
+        }
+        if self.data["audio"]:
+            result["audio"] = {"sample_rate": self.data["audio"]["sample_rate"], "channels": self.data["audio"]["channels"]}
+        return result
+
+    def keyframe_before(self, seconds):
+        """Latest keyframe at or before seconds (the first keyframe if there is none)."""
+        position = bisect.bisect_right(self.keyframes, seconds)
+        if position:
+            return self.keyframes[position - 1]
+        return self.keyframes[0] if self.keyframes else 0.0
+
+    def keyframe_after(self, seconds):
+        """Earliest keyframe at or after seconds, or None past the last one."""
+        position = bisect.bisect_left(self.keyframes, seconds)
+        return self.keyframes[position] if position < len(self.keyframes) else None
+
+    def nearest_keyframe(self, seconds, low=None, high=None):
+        """The keyframe closest to seconds within [low, high], or None if that range has none."""
+        low = float("-inf") if low is None else low
+        high = float("inf") if high is None else high
+        position = bisect.bisect_left(self.keyframes, seconds)
+        candidates = [kf for kf in self.keyframes[max(0, position - 1):position + 1] if low <= kf <= high]
+        return min(candidates, key=lambda kf: abs(kf - seconds)) if candidates else None
+
+    def keyframes_between(self, start, end):
+        return self.keyframes[bisect.bisect_left(self.keyframes, start):bisect.bisect_left(self.keyframes, end)]
+
+    def snap_to_frame(self, seconds):
+        """Start time of the frame shown at seconds, on the stream's own frame grid."""
+        start_time = self.data["video"]["start_time"] or 0.0
+        frame = max(0, int((seconds - start_time) * self.frame_rate + 1e-6))
+        return start_time + frame / self.frame_rate
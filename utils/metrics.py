@@ -0,0 +1,79 @@
+import time
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+_DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+STAGE_SECONDS = Histogram("storyboard_stage_duration_seconds", "Wall time of pipeline stages that ran (not reused).", ["stage"], buckets=_DURATION_BUCKETS)
+STAGE_RUNS = Counter("storyboard_stage_runs_total", "Pipeline stage executions by outcome: completed, failed, cancelled or reused.", ["stage", "outcome"])
+STAGE_RETRIES = Counter("storyboard_stage_retries_total", "Automatic retries of pipeline stages after transient errors.", ["stage"])
+STAGE_BYTES = Counter("storyboard_stage_bytes_total", "Bytes of task artifacts read (in) and produced (out) by pipeline stages.", ["stage", "direction"])
+
+FFMPEG_SECONDS = Histogram("storyboard_ffmpeg_duration_seconds", "Wall time of ffmpeg invocations.", ["operation"], buckets=_DURATION_BUCKETS)
+FFMPEG_SPEED = Histogram("storyboard_ffmpeg_speed_ratio", "Media seconds processed per wall-clock second, as reported by ffmpeg.", ["operation"],
+                         buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256))
+FFMPEG_FAILURES = Counter("storyboard_ffmpeg_failures_total", "ffmpeg invocations that exited with an error.", ["operation"])
+
+GEMINI_SECONDS = Histogram("storyboard_gemini_request_duration_seconds", "Latency of Gemini calls; uploads include the wait for file processing.", ["operation", "call"], buckets=_DURATION_BUCKETS)
+GEMINI_ERRORS = Counter("storyboard_gemini_errors_total", "Gemini calls that raised.", ["operation", "call"])
+GEMINI_TOKENS = Counter("storyboard_gemini_tokens_total", "Gemini tokens used, by kind: prompt or output.", ["operation", "kind"])
+
+TASKS_FINISHED = Counter("storyboard_tasks_finished_total", "Finished tasks by final status.", ["status"])
+ACTIVE_JOBS = Gauge("storyboard_active_jobs", "Pipeline runs in progress in this process.")
+QUEUE_JOBS = Gauge("storyboard_queue_jobs", "Jobs in the durable job queue, by state.", ["state"])
+ARTIFACT_GC_BYTES = Counter("storyboard_artifact_gc_bytes_total", "Bytes of task artifacts deleted, by reason: released, discarded, expired or evicted.", ["reason"])
+DISK_ADMISSION_REJECTIONS = Counter("storyboard_disk_admission_rejections_total", "Jobs refused because their projected disk use did not fit.")
+CACHE_LOOKUPS = Counter("storyboard_cache_lookups_total", "Cache lookups by cache and result (hit or miss).", ["cache", "result"])
+
+# Token counts of the pipeline stage running in this context, see track_gemini_usage.
+_stage_usage = contextvars.ContextVar("stage_usage", default=None)
+
+def observe_ffmpeg(operation, seconds, speed=None):
+    FFMPEG_SECONDS.labels(operation).observe(seconds)
+    if speed:
+        FFMPEG_SPEED.labels(operation).observe(speed)
+
+@contextmanager
+def gemini_call(operation, call):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        GEMINI_ERRORS.labels(operation, call).inc()
+        raise
+    finally:
+        GEMINI_SECONDS.labels(operation, call).observe(time.perf_counter() - start)
+
+def record_gemini_usage(operation, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    GEMINI_TOKENS.labels(operation, "prompt").inc(prompt_tokens)
+    GEMINI_TOKENS.labels(operation, "output").inc(output_tokens)
+    stage_usage = _stage_usage.get()
+    if stage_usage is not None:
+        stage_usage["prompt"] += prompt_tokens
+        stage_usage["output"] += output_tokens
+
+@contextmanager
+def track_gemini_usage(usage=None):
+    """Yields a dict (usage, if given) that adds up the Gemini tokens used by the code run inside it."""
+    usage = {"prompt": 0, "output": 0} if usage is None else usage
+    token = _stage_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _stage_usage.reset(token)
+
+def update_queue_gauges(job_queue):
+    counts = job_queue.counts()
+    for state in ("QUEUED", "RUNNING", "GROUPED", "COMPLETED", "FAILED", "CANCELLED"):
+        QUEUE_JOBS.labels(state).set(counts.get(state, 0))
+
+def render_metrics():
+    """Returns (body, content type) for a Prometheus scrape."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,311 @@
+import os
+import subprocess
+import logging
+import multiprocessing
+import shutil
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+import srt
+from utils.ffmpeg_utils import cut_video_segments, burn_srt_to_video, choose_cut_engine, extract_audio, denoise_audio, DENOISE_CODEC_ARGS
+from utils.ffmpeg_runner import run_ffmpeg
+from utils.cancellation import TaskCancelled, current_cancellation, bind_cancel_event
+
+# Chunks shorter than this spend more time seeking and starting encoders than encoding.
+MIN_CHUNK_DURATION = 30.0
+# Noise-reduced audio chunks overlap by this much and are crossfaded there, which
+# hides afftdn settling on each chunk's noise profile at its start.
+DENOISE_OVERLAP = 1.0
+
+def get_parallel_render_settings(recipe):
+    """Reads the "parallel_render" recipe entry, which may be a bool or a settings dict."""
+    settings = recipe.get("parallel_render", False)
+    if not settings:
+        return None
+    if settings is True:
+        settings = {}
+    return {
+        "chunks": int(settings.get("chunks") or os.cpu_count() or 1),
+        "min_chunk_duration": float(settings.get("min_chunk_duration", MIN_CHUNK_DURATION)),
+    }
+
+def _split_point(media_index, start, end, target):
+    """Where to split a long segment: the keyframe nearest start + target when there is one close by."""
+    if media_index is not None:
+        keyframe = media_index.nearest_keyframe(start + target, start + target * 0.5, end - target * 0.5)
+        if keyframe is not None:
+            return keyframe, True
+    return start + target, False
+
+def plan_chunks(segments, chunk_count, min_chunk_duration=MIN_CHUNK_DURATION, media_index=None):
+    """
+    Groups consecutive segments into at most chunk_count chunks of similar duration.
+    Chunk boundaries fall on segment boundaries; a segment is only split when it alone
+    is longer than a chunk, which is what lets an uncut long recording parallelize.
+    With the source's media_index, such splits land on keyframes (marked "keyframe"),
+    so the chunk's input seek decodes nothing it then throws away.
+    """
+    total_duration = sum(segment["end"] - segment["start"] for segment in segments)
+    chunk_count = max(1, min(chunk_count, int(total_duration // min_chunk_duration) or 1))
+    target = total_duration / chunk_count
+
+    pieces = []
+    for segment in segments:
+        start = segment["start"]
+        keyframe = False
+        while segment["end"] - start > target * 1.5:
+            split, split_on_keyframe = _split_point(media_index, start, segment["end"], target)
+            pieces.append({"start": start, "end": split, "keyframe": keyframe})
+            start, keyframe = split, split_on_keyframe
+        pieces.append({"start": start, "end": segment["end"], "keyframe": keyframe})
+
+    chunks = [[]]
+    chunk_duration = 0.0
+    for piece in pieces:
+        if chunks[-1] and chunk_duration >= target and len(chunks) < chunk_count:
+            chunks.append([])
+            chunk_duration = 0.0
+        chunks[-1].append(piece)
+        chunk_duration += piece["end"] - piece["start"]
+    return chunks
+
+def _snap_to_frame_boundary(seconds, frame_rate):
+    # Just before the nearest frame: neighbouring chunks can never both claim a frame, and
+    # the chunk's first frame still lands on 0 when the encoder rounds to the frame grid.
+    if seconds <= 0:
+        return 0.0
+    return round(seconds * frame_rate) / frame_rate - min(0.001, 0.25 / frame_rate)
+
+def _write_concat_list(paths, list_path):
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in paths:
+            escaped_path = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+
+def _join_chunks(chunk_paths, audio_source_path, output_path, work_dir):
+    list_path = os.path.join(work_dir, "chunks.txt")
+    _write_concat_list(chunk_paths, list_path)
+    command = [
+        "ffmpeg",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", list_path,
+        "-i", audio_source_path,
+        "-map", "0:v",
+        "-map", "1:a?",
+        "-c", "copy",
+        "-y",
+        output_path
+    ]
+    try:
+        logging.info(f"Executing FFmpeg command: {' '.join(command)}")
+        run_ffmpeg("join_chunks", command)
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error joining rendered chunks: {e.stderr}")
+        return False
+
+def _shift_srt(srt_path, output_srt_path, window_start, window_end):
+    with open(srt_path, 'r', encoding='utf-8') as f:
+        subs = list(srt.parse(f.read()))
+    offset = timedelta(seconds=window_start)
+    window_length = timedelta(seconds=window_end - window_start)
+    shifted = []
+    for sub in subs:
+        if sub.end.total_seconds() <= window_start or sub.start.total_seconds() >= window_end:
+            continue
+        start = max(sub.start - offset, timedelta(0))
+        end = min(sub.end - offset, window_length)
+        shifted.append(srt.Subtitle(index=len(shifted) + 1, start=start, end=end, content=sub.content))
+    with open(output_srt_path, 'w', encoding='utf-8') as f:
+        f.write(srt.compose(shifted, reindex=False))
+
+def _render_chunk(job):
+    # Runs in a worker process; every chunk goes through the same helper with the same
+    # encoder arguments, which is what makes the stream-copy join valid.
+    if job["kind"] == "cut":
+        return cut_video_segments(job["input_path"], job["segments"], job["output_path"], engine=job["engine"], input_window=job.get("input_window"), video=job["video"], audio=job["audio"])
+    if job["kind"] == "denoise":
+        return denoise_audio(job["input_path"], job["output_path"], input_window=job["input_window"])
+    return burn_srt_to_video(job["input_path"], job["srt_path"], job["output_path"], ass_style=job["ass_style"], input_window=job["input_window"], audio=False, play_res=job["play_res"])
+
+def _run_jobs(jobs, workers):
+    cancellation = current_cancellation()
+    if cancellation is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return all(executor.map(_render_chunk, jobs))
+
+    # Chunks run in other processes; forward the task's cancellation so their ffmpeg runs are killed too.
+    cancel_event = multiprocessing.Event()
+    cancellation.add_callback(cancel_event.set)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=bind_cancel_event, initargs=(cancel_event,)) as executor:
+            return all(executor.map(_render_chunk, jobs))
+    except TaskCancelled:
+        # Re-raise with this task's reason (cancelled or deadline); the chunk only saw the event.
+        cancellation.check()
+        raise
+    finally:
+        cancellation.remove_callback(cancel_event.set)
+
+def parallel_cut_video_segments(input_path, segments_to_keep, output_path, frame_rate, chunks, engine="auto", min_chunk_duration=MIN_CHUNK_DURATION, media_index=None, audio_path=None):
+    chunk_plan = plan_chunks(segments_to_keep, chunks, min_chunk_duration, media_index=media_index)
+    if len(chunk_plan) < 2:
+        return cut_video_segments(input_path, segments_to_keep, output_path, engine=engine, audio_path=audio_path)
+
+    # Decide the engine once for the whole edit so every chunk is encoded the same way.
+    engine = choose_cut_engine(segments_to_keep, engine)
+    work_dir = os.path.splitext(output_path)[0] + "_chunks"
+    os.makedirs(work_dir, exist_ok=True)
+    logging.info(f"Cutting {len(segments_to_keep)} segments in {len(chunk_plan)} parallel chunks.")
+    try:
+        jobs = []
+        chunk_paths = []
+        for i, chunk in enumerate(chunk_plan):
+            # A keyframe is a frame start already, and the previous chunk ends exactly there.
+            window_start = chunk[0]["start"] if chunk[0]["keyframe"] else _snap_to_frame_boundary(chunk[0]["start"], frame_rate)
+            window_end = chunk[-1]["end"]
+            chunk_path = os.path.join(work_dir, f"chunk_{i:04d}.mp4")
+            chunk_paths.append(chunk_path)
+            jobs.append({
+                "kind": "cut",
+                "input_path": input_path,
+                "segments": [{"start": s["start"] - window_start, "end": s["end"] - window_start} for s in chunk],
+                "output_path": chunk_path,
+                "engine": engine,
+                "input_window": (window_start, window_end - window_start),
+                "video": True,
+                "audio": False,
+            })
+        # Audio is cheap to encode, so it is cut in one piece alongside the video chunks;
+        # that keeps AAC priming gaps out of the joins.
+        chunk_audio_path = os.path.join(work_dir, "audio.m4a")
+        jobs.append({
+            "kind": "cut",
+            "input_path": audio_path or input_path,
+            "segments": segments_to_keep,
+            "output_path": chunk_audio_path,
+            "engine": engine,
+            "video": False,
+            "audio": True,
+        })
+        if not _run_jobs(jobs, len(chunk_plan)):
+            logging.error("One or more parallel cut chunks failed.")
+            return False
+        return _join_chunks(chunk_paths, chunk_audio_path, output_path, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _crossfade_chunks(chunk_paths, output_path, overlap, duration=None):
+    inputs = [arg for path in chunk_paths for arg in ("-i", path)]
+    chains = []
+    label = "0:a"
+    for i in range(1, len(chunk_paths)):
+        # Linear (equal-gain) fades: both sides are the same audio, so their gains must sum to 1.
+        chains.append(f"[{label}][{i}:a]acrossfade=d={overlap}:c1=tri:c2=tri[x{i}]")
+        label = f"x{i}"
+    command = [
+        "ffmpeg",
+        *inputs,
+        "-filter_complex", ";".join(chains),
+        "-map", f"[{label}]",
+        *DENOISE_CODEC_ARGS[os.path.splitext(output_path)[1]],
+        "-y", output_path
+    ]
+    try:
+        run_ffmpeg("crossfade_chunks", command, duration=duration)
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error crossfading noise-reduced chunks: {e.stderr}")
+        return False
+
+def parallel_denoise_audio(input_path, output_path, duration, chunks, min_chunk_duration=MIN_CHUNK_DURATION):
+    """
+    Noise-reduces the audio of input_path into output_path, leaving the video alone.
+    The track is extracted once, then chunks of it, each overlapping the previous one
+    by DENOISE_OVERLAP, are denoised in parallel and crossfaded back into one track
+    exactly as long as the source.
+    """
+    chunk_count = max(1, min(chunks, int((duration or 0) // min_chunk_duration) or 1))
+    if chunk_count < 2:
+        return denoise_audio(input_path, output_path, duration=duration)
+
+    work_dir = os.path.splitext(output_path)[0] + "_chunks"
+    os.makedirs(work_dir, exist_ok=True)
+    logging.info(f"Denoising audio in {chunk_count} parallel chunks.")
+    try:
+        # WAV seeks are sample-exact, so the chunks line up where they are crossfaded.
+        extracted_path = os.path.join(work_dir, "source.wav")
+        if not extract_audio(input_path, extracted_path, duration=duration):
+            return False
+        chunk_length = duration / chunk_count
+        jobs = []
+        chunk_paths = []
+        for i in range(chunk_count):
+            start = max(0.0, i * chunk_length - DENOISE_OVERLAP)
+            # The last chunk runs on to the real end of the track, whatever the reported duration.
+            end = (i + 1) * chunk_length if i + 1 < chunk_count else duration + 60.0
+            chunk_path = os.path.join(work_dir, f"chunk_{i:04d}.wav")
+            chunk_paths.append(chunk_path)
+            jobs.append({
+                "kind": "denoise",
+                "input_path": extracted_path,
+                "output_path": chunk_path,
+                "input_window": (round(start, 6), round(end - start, 6)),
+            })
+        if not _run_jobs(jobs, chunk_count):
+            logging.error("One or more noise reduction chunks failed.")
+            return False
+        return _crossfade_chunks(chunk_paths, output_path, DENOISE_OVERLAP, duration=duration)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def parallel_burn_srt_to_video(video_path, srt_path, output_path, frame_rate, segments, chunks, ass_style=None, min_chunk_duration=MIN_CHUNK_DURATION, play_res=(1920, 1080)):
+    """
+    Burns captions in parallel chunks of video_path. segments describe the kept
+    segments on video_path's own timeline, so chunks split between cuts.
+    """
+    chunk_plan = plan_chunks(segments, chunks, min_chunk_duration)
+    if len(chunk_plan) < 2:
+        return burn_srt_to_video(video_path, srt_path, output_path, ass_style=ass_style, play_res=play_res)
+
+    work_dir = os.path.splitext(output_path)[0] + "_chunks"
+    os.makedirs(work_dir, exist_ok=True)
+    logging.info(f"Burning captions in {len(chunk_plan)} parallel chunks.")
+    try:
+        jobs = []
+        chunk_paths = []
+        for i, chunk in enumerate(chunk_plan):
+            window_start = _snap_to_frame_boundary(chunk[0]["start"], frame_rate)
+            if i + 1 < len(chunk_plan):
+                window_end = _snap_to_frame_boundary(chunk_plan[i + 1][0]["start"], frame_rate)
+            else:
+                window_end = chunk[-1]["end"] + 1.0 / frame_rate
+            chunk_srt_path = os.path.join(work_dir, f"chunk_{i:04d}.srt")
+            _shift_srt(srt_path, chunk_srt_path, window_start, window_end)
+            chunk_path = os.path.join(work_dir, f"chunk_{i:04d}.mp4")
+            chunk_paths.append(chunk_path)
+            jobs.append({
+                "kind": "burn",
+                "input_path": video_path,
+                "srt_path": chunk_srt_path,
+                "output_path": chunk_path,
+                "ass_style": ass_style,
+                "play_res": play_res,
+                "input_window": (window_start, window_end - window_start),
+            })
+        if not _run_jobs(jobs, len(chunk_plan)):
+            logging.error("One or more parallel caption chunks failed.")
+            return False
+        return _join_chunks(chunk_paths, video_path, output_path, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def output_timeline_segments(segments_to_keep):
+    """Maps kept source segments onto the timeline of the cut output."""
+    output_segments = []
+    cursor = 0.0
+    for segment in segments_to_keep:
+        duration = segment["end"] - segment["start"]
+        output_segments.append({"start": cursor, "end": cursor + duration})
+        cursor += duration
+    return output_segments
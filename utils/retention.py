@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import requests
+
+from utils.checkpoint import get_tasks_dir, discard_task_artifacts, MANIFEST_NAME
+from utils.metrics import ARTIFACT_GC_BYTES, DISK_ADMISSION_REJECTIONS
+from utils.media_probe import probe_cache_dir
+from utils.task_events import TERMINAL_STATUSES
+
+# Finished tasks keep their outputs this long after they were last written or downloaded.
+DEFAULT_ARTIFACT_TTL = 7 * 24 * 3600
+GC_INTERVAL = 300
+# Peak disk use of a job as a multiple of its source size: the download, a noise-reduced
+# copy, the cut, the captioned render and renditions can all exist at once.
+DISK_ESTIMATE_FACTOR = 4
+# Used when the source size can't be found out up front.
+DEFAULT_JOB_DISK_BYTES = 2 * 1024 ** 3
+# A submission waits this long for the source's Content-Length; a slower server gets the
+# default reservation, corrected once a background HEAD with BACKGROUND_PROBE_TIMEOUT answers.
+SIZE_PROBE_TIMEOUT = 1
+BACKGROUND_PROBE_TIMEOUT = 10
+# How stale the TASKS_DIR total used against DISK_QUOTA_BYTES may be, and how often a
+# running task's directory is re-measured on its status events.
+USAGE_REFRESH_SECONDS = 30
+TASK_MEASURE_INTERVAL = 5
+
+def _env_number(name, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+def artifact_ttl():
+    return _env_number("ARTIFACT_TTL_SECONDS", DEFAULT_ARTIFACT_TTL)
+
+def disk_quota():
+    """Byte limit for everything under TASKS_DIR, or None for no limit other than the disk."""
+    return _env_number("DISK_QUOTA_BYTES", None, int)
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+def touch_task(task_id):
+    """Marks a task as used now (e.g. an artifact download), for TTL expiry and LRU eviction."""
+    try:
+        os.utime(os.path.join(get_tasks_dir(), task_id, MANIFEST_NAME))
+    except FileNotFoundError:
+        pass
+
+def _scan_tasks(tasks_dir):
+    tasks = []
+    if not os.path.isdir(tasks_dir):
+        return tasks
+    for entry in os.scandir(tasks_dir):
+        manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+        if not entry.is_dir() or not os.path.exists(manifest_path):
+            continue
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                status = json.load(f).get("status")
+            last_used = os.path.getmtime(manifest_path)
+        except (OSError, ValueError):
+            continue
+        artifact_bytes = directory_bytes(entry.path) - os.path.getsize(manifest_path)
+        tasks.append({"task_id": entry.name, "task_dir": entry.path, "status": status, "last_used": last_used, "bytes": artifact_bytes})
+    return tasks
+
+def _expire_probe_cache(ttl, now):
+    """Deletes probe sidecars not used for longer than the TTL. Returns the bytes freed."""
+    cache_dir = probe_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+    freed = 0
+    for entry in os.scandir(cache_dir):
+        try:
+            stat = entry.stat()
+            if now - stat.st_mtime > ttl:
+                os.remove(entry.path)
+                freed += stat.st_size
+        except FileNotFoundError:
+            pass
+    return freed
+
+def collect_garbage(tasks_dir=None, ttl=None, quota=None, min_free_bytes=0, now=None):
+    """
+    Expires the artifacts of tasks unused for longer than the TTL, then evicts the least
+    recently used finished tasks while TASKS_DIR is over its quota or the disk has less
+    than min_free_bytes free. Only the manifest of a task is kept, so it can still be
+    retried or re-rendered (regenerating its files, but not the Gemini analysis).
+    A task still running is left alone unless it too is older than the TTL (a crashed run).
+    """
+    tasks_dir = tasks_dir or get_tasks_dir()
+    ttl = artifact_ttl() if ttl is None else ttl
+    quota = disk_quota() if quota is None else quota
+    now = time.time() if now is None else now
+    report = {"expired": [], "evicted": [], "freed_bytes": 0}
+
+    candidates = []
+    for task in _scan_tasks(tasks_dir):
+        if task["bytes"] == 0:
+            continue
+        if now - task["last_used"] > ttl:
+            freed = discard_task_artifacts(task["task_dir"])
+            ARTIFACT_GC_BYTES.labels("expired").inc(freed)
+            report["expired"].append(task["task_id"])
+            report["freed_bytes"] += freed
+        elif task["status"] in TERMINAL_STATUSES:
+            candidates.append(task)
+
+    freed = _expire_probe_cache(ttl, now)
+    ARTIFACT_GC_BYTES.labels("expired").inc(freed)
+    report["freed_bytes"] += freed
+
+    usage = directory_bytes(tasks_dir) if quota else 0
+    candidates.sort(key=lambda task: task["last_used"])
+    for task in candidates:
+        over_quota = quota and usage > quota
+        low_on_disk = min_free_bytes and shutil.disk_usage(tasks_dir).free < min_free_bytes
+        if not (over_quota or low_on_disk):
+            break
+        freed = discard_task_artifacts(task["task_dir"])
+        ARTIFACT_GC_BYTES.labels("evicted").inc(freed)
+        usage -= freed
+        report["evicted"].append(task["task_id"])
+        report["freed_bytes"] += freed
+
+    if report["expired"] or report["evicted"]:
+        logging.info(f"Artifact GC expired {len(report['expired'])} and evicted {len(report['evicted'])} tasks, freeing {report['freed_bytes']} bytes.")
+    return report
+
+def start_gc_thread(interval=GC_INTERVAL):
+    def loop():
+        while True:
+            try:
+                collect_garbage()
+            except Exception as e:
+                logging.error(f"Artifact GC failed: {e}")
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, name="artifact-gc", daemon=True)
+    thread.start()
+    return thread
+
+def default_job_bytes():
+    return _env_number("DEFAULT_JOB_DISK_BYTES", DEFAULT_JOB_DISK_BYTES, int)
+
+def estimate_job_bytes(video_url, timeout=SIZE_PROBE_TIMEOUT):
+    """
+    Projected peak disk use of a job, from the source's Content-Length, or None if the
+    server doesn't say within timeout (the caller reserves default_job_bytes() instead).
+    """
+    try:
+        response = requests.head(video_url, allow_redirects=True, timeout=timeout)
+        length = int(response.headers.get("Content-Length", 0))
+    except (requests.exceptions.RequestException, ValueError):
+        length = 0
+    return length * DISK_ESTIMATE_FACTOR if length > 0 else None
+
+class DiskBudget:
+    """
+    Admission control for new jobs. Each admitted job reserves its projected disk use
+    until it finishes; a job is refused (after trying GC) when the reservations still
+    outstanding plus its own would not fit in the free space or the quota.
+    Outstanding means projected minus what the task directory already holds. Those
+    sizes are measured on the tasks' own status events and TASKS_DIR's total at most
+    every USAGE_REFRESH_SECONDS, so admitting a job never walks the disk under the lock.
+    """
+
+    def __init__(self, store, tasks_dir=None):
+        self._store = store
+        self._tasks_dir = tasks_dir or get_tasks_dir()
+        self._reservations = {}
+        self._task_bytes = {}
+        self._measured_at = {}
+        self._listeners = {}
+        self._usage = 0
+        self._usage_at = None
+        self._lock = threading.Lock()
+        # Serialises GC runs started by admission, without holding up admissions that fit.
+        self._gc_lock = threading.Lock()
+
+    def _refresh_usage(self, force=False):
+        if not disk_quota():
+            return
+        if not force and self._usage_at is not None and time.monotonic() - self._usage_at < USAGE_REFRESH_SECONDS:
+            return
+        usage = directory_bytes(self._tasks_dir)
+        with self._lock:
+            self._usage = usage
+            self._usage_at = time.monotonic()
+
+    def _outstanding(self):
+        return sum(max(0, reserved - self._task_bytes.get(task_id, 0)) for task_id, reserved in self._reservations.items())
+
+    def _available(self):
+        available = shutil.disk_usage(self._tasks_dir).free
+        quota = disk_quota()
+        if quota:
+            available = min(available, quota - self._usage)
+        return available - self._outstanding()
+
+    def admit(self, reservations):
+        """
+        Reserves {task_id: bytes} for a job if the total fits. Returns (admitted,
+        available_bytes). Call watch() once the tasks have a status.
+        """
+        required_bytes = sum(reservations.values())
+        os.makedirs(self._tasks_dir, exist_ok=True)
+        self._refresh_usage()
+        with self._lock:
+            available = self._available()
+            if available >= required_bytes:
+                self._reservations.update(reservations)
+                return True, available
+            outstanding = self._outstanding()
+        with self._gc_lock:
+            collect_garbage(min_free_bytes=required_bytes + outstanding)
+            self._refresh_usage(force=True)
+        with self._lock:
+            available = self._available()
+            if available < required_bytes:
+                DISK_ADMISSION_REJECTIONS.inc()
+                return False, available
+            self._reservations.update(reservations)
+        return True, available
+
+    def adjust(self, task_id, reserved_bytes):
+        """Replaces a reservation made on a guess, e.g. once the source size is known."""
+        with self._lock:
+            if task_id in self._reservations:
+                self._reservations[task_id] = reserved_bytes
+
+    def correct_later(self, sources):
+        """Probes {task_id: video_url} sources admitted on the default size again, off the request thread, and adjusts their reservations."""
+        def run():
+            for task_id, video_url in sources.items():
+                reserved_bytes = estimate_job_bytes(video_url, timeout=BACKGROUND_PROBE_TIMEOUT)
+                if reserved_bytes is not None:
+                    self.adjust(task_id, reserved_bytes)
+        threading.Thread(target=run, name="disk-estimate", daemon=True).start()
+
+    def watch(self, task_ids):
+        """Tracks each task's disk use from its status events and releases its reservation when it finishes."""
+        for task_id in task_ids:
+            listener = lambda task_id=task_id: self._on_event(task_id)
+            if self._store.add_listener(task_id, listener):
+                with self._lock:
+                    self._listeners[task_id] = listener
+            self._on_event(task_id)
+
+    def _on_event(self, task_id):
+        status = self._store.get(task_id)
+        if status is None or status.get("status") in TERMINAL_STATUSES:
+            self.release(task_id)
+            return
+        now = time.monotonic()
+        if now - self._measured_at.get(task_id, float("-inf")) < TASK_MEASURE_INTERVAL:
+            return
+        self._measured_at[task_id] = now
+        task_bytes = directory_bytes(os.path.join(self._tasks_dir, task_id))
+        with self._lock:
+            if task_id in self._reservations:
+                self._task_bytes[task_id] = task_bytes
+
+    def release(self, task_id):
+        with self._lock:
+            self._reservations.pop(task_id, None)
+            self._task_bytes.pop(task_id, None)
+            self._measured_at.pop(task_id, None)
+            listener = self._listeners.pop(task_id, None)
+        if listener is not None:
+            self._store.remove_listener(task_id, listener)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED", "CANCELLED")
+
+# How long a finished task stays subscribable before /task_status answers 404.
+DEFAULT_TASK_TTL = 60 * 60
+# Events kept per task for Last-Event-ID resumption; older ids fall back to a snapshot.
+DEFAULT_HISTORY_SIZE = 256
+DEFAULT_HEARTBEAT_INTERVAL = 15
+
+def _event_type(delta):
+    status = delta.get("status")
+    if status == "COMPLETED":
+        return "completed"
+    if status == "FAILED":
+        return "failed"
+    if status == "CANCELLED":
+        return "cancelled"
+    if status is not None:
+        return "status"
+    return "progress"
+
+class _TaskChannel:
+    def __init__(self, history_size):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=history_size)
+        self.last_event_id = 0
+        self.finished_at = None
+        self.listeners = set()
+
+class TaskRecord(dict):
+    """A task's status dict. Every update() publishes only the keys that changed."""
+
+    def __init__(self, store, task_id, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._store = store
+        self._task_id = task_id
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        delta = {key: value for key, value in changes.items() if key not in self or self[key] != value}
+        super().update(changes)
+        if delta:
+            self._store.publish(self._task_id, delta)
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+class TaskStatusStore(dict):
+    """
+    Drop-in replacement for the plain task_status dict. Pipeline steps keep calling
+    task_status[task_id].update(...); each call becomes a typed event that wakes only
+    the subscribers of that task.
+    """
+
+    def __init__(self, ttl=DEFAULT_TASK_TTL, history_size=DEFAULT_HISTORY_SIZE):
+        super().__init__()
+        self._ttl = ttl
+        self._history_size = history_size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def __setitem__(self, task_id, status):
+        with self._lock:
+            self._purge_expired()
+            if task_id not in self._channels:
+                self._channels[task_id] = _TaskChannel(self._history_size)
+        super().__setitem__(task_id, TaskRecord(self, task_id))
+        self[task_id].update(status)
+
+    def __contains__(self, task_id):
+        with self._lock:
+            self._purge_expired()
+        return super().__contains__(task_id)
+
+    def publish(self, task_id, delta):
+        channel = self._channels.get(task_id)
+        if channel is None:
+            return None
+        payload = json.loads(json.dumps(delta, default=str))
+        with channel.condition:
+            channel.last_event_id += 1
+            channel.events.append({"id": channel.last_event_id, "type": _event_type(delta), "data": payload})
+            if delta.get("status") in TERMINAL_STATUSES:
+                channel.finished_at = time.time()
+            elif "status" in delta:
+                channel.finished_at = None
+            channel.condition.notify_all()
+            listeners = list(channel.listeners)
+            event_id = channel.last_event_id
+        for listener in listeners:
+            listener()
+        return event_id
+
+    def snapshot(self, task_id):
+        """Returns (full status, id of the last event folded into it), or None if unknown."""
+        channel = self._channels.get(task_id)
+        if channel is None or not super().__contains__(task_id):
+            return None
+        with channel.condition:
+            return json.loads(json.dumps(dict(self[task_id]), default=str)), channel.last_event_id
+
+    def wait_for_events(self, task_id, after_id, timeout):
+        """
+        Blocks until the task has events newer than after_id or timeout elapses.
+        Returns the new events, an empty list on timeout, or None if after_id has
+        already been evicted from the history and the caller must resync from a snapshot.
+        """
+        channel = self._channels.get(task_id)
+        if channel is None:
+            return []
+        with channel.condition:
+            if channel.last_event_id == after_id and channel.finished_at is None and timeout:
+                channel.condition.wait(timeout)
+            return self._events_after(channel, after_id)
+
+    def _events_after(self, channel, after_id):
+        if after_id > channel.last_event_id:
+            # An id this task never issued, e.g. from before a server restart.
+            return None
+        if channel.events and channel.events[0]["id"] > after_id + 1:
+            return None
+        return [event for event in channel.events if event["id"] > after_id]
+
+    def add_listener(self, task_id, callback):
+        """
+        Registers callback() to be called on the publishing thread after every event
+        of task_id. Used by the async server, which cannot block on the Condition.
+        """
+        channel = self._channels.get(task_id)
+        if channel is None:
+            return False
+        with channel.condition:
+            channel.listeners.add(callback)
+        return True
+
+    def remove_listener(self, task_id, callback):
+        channel = self._channels.get(task_id)
+        if channel is not None:
+            with channel.condition:
+                channel.listeners.discard(callback)
+
+    def is_finished(self, task_id):
+        channel = self._channels.get(task_id)
+        return channel is not None and channel.finished_at is not None
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [task_id for task_id, channel in self._channels.items()
+                   if channel.finished_at is not None and now - channel.finished_at > self._ttl]
+        for task_id in expired:
+            del self._channels[task_id]
+            super().pop(task_id, None)
+
+def format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+def _parse_last_event_id(last_event_id):
+    if last_event_id is None:
+        return None
+    try:
+        return int(last_event_id)
+    except ValueError:
+        return None
+
+def _stream_step(store, task_id, after_id, events):
+    """
+    Turns the result of one wait into SSE chunks.
+    Returns (chunks, new after_id, finished).
+    """
+    if events is None:
+        # Fell too far behind the history buffer: resync with a full snapshot.
+        snapshot = store.snapshot(task_id)
+        if snapshot is None:
+            return [], after_id, True
+        state, after_id = snapshot
+        return [format_sse(after_id, "snapshot", state)], after_id, state.get("status") in TERMINAL_STATUSES
+    if not events:
+        if store.snapshot(task_id) is None or store.is_finished(task_id):
+            return [], after_id, True
+        return [": heartbeat\n\n"], after_id, False
+    chunks = []
+    for event in events:
+        after_id = event["id"]
+        chunks.append(format_sse(event["id"], event["type"], event["data"]))
+        if event["type"] in ("completed", "failed"):
+            return chunks, after_id, True
+    return chunks, after_id, False
+
+def stream_task_events(store, task_id, last_event_id=None, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL):
+    """
+    SSE generator for one subscriber: a snapshot (unless resuming from a still-buffered
+    Last-Event-ID), then deltas as they are published, with comment heartbeats while idle.
+    Ends after the task's terminal event.
+    """
+    after_id = _parse_last_event_id(last_event_id)
+    events = None if after_id is None else store.wait_for_events(task_id, after_id, 0)
+    while True:
+        chunks, after_id, finished = _stream_step(store, task_id, after_id or 0, events)
+        yield from chunks
+        if finished:
+            return
+        events = store.wait_for_events(task_id, after_id, heartbeat_interval)
+
+async def astream_task_events(store, task_id, last_event_id=None, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL):
+    """
+    Coroutine version of stream_task_events for the ASGI server. Instead of parking a
+    thread on the task's Condition it awaits an asyncio.Event that the publishing
+    thread sets through the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    def on_event():
+        loop.call_soon_threadsafe(wakeup.set)
+
+    if not store.add_listener(task_id, on_event):
+        return
+    try:
+        after_id = _parse_last_event_id(last_event_id)
+        events = None if after_id is None else store.wait_for_events(task_id, after_id, 0)
+        while True:
+            chunks, after_id, finished = _stream_step(store, task_id, after_id or 0, events)
+            for chunk in chunks:
+                yield chunk
+            if finished:
+                return
+            wakeup.clear()
+            events = store.wait_for_events(task_id, after_id, 0)
+            if events == [] and not store.is_finished(task_id):
+                try:
+                    await asyncio.wait_for(wakeup.wait(), heartbeat_interval)
+                except asyncio.TimeoutError:
+                    pass
+                events = store.wait_for_events(task_id, after_id, 0)
+    finally:
+        store.remove_listener(task_id, on_event)
@@ -0,0 +1,132 @@
+import os
+import math
+
+import numpy as np
+
+from utils.ffmpeg_utils import timedelta_string_to_seconds
+
+# The finest level has one (min, max) pair per 256 samples (16 ms at 16 kHz); each level
+# above is 4x coarser, so the coarsest pair covers about 4 s. An hour at 8 bits is
+# about 450 KB at the finest level and 600 KB for the whole pyramid.
+BASE_SAMPLES_PER_PEAK = 256
+LEVEL_FACTOR = 4
+LEVEL_COUNT = 5
+PEAK_DTYPES = {8: "<i1", 16: "<i2"}
+# Peaks of this many base frames are computed at a time, so memory stays flat on long inputs.
+CHUNK_FRAMES = 4096
+
+def _base_peaks(audio_buffer):
+    mins, maxs = [], []
+    samples = audio_buffer.samples()
+    chunk = CHUNK_FRAMES * BASE_SAMPLES_PER_PEAK
+    for start in range(0, len(samples), chunk):
+        view = samples[start:start + chunk]
+        whole = len(view) // BASE_SAMPLES_PER_PEAK * BASE_SAMPLES_PER_PEAK
+        frames = view[:whole].reshape(-1, BASE_SAMPLES_PER_PEAK)
+        mins.append(frames.min(axis=1))
+        maxs.append(frames.max(axis=1))
+        if whole < len(view):
+            mins.append(view[whole:].min(keepdims=True))
+            maxs.append(view[whole:].max(keepdims=True))
+    if not mins:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+    return np.concatenate(mins), np.concatenate(maxs)
+
+def _quantize(mins, maxs, dtype):
+    """Rounds outward (min down, max up) so the quantized envelope still contains every sample."""
+    scale = np.iinfo(dtype).max
+    peaks = np.empty((len(mins), 2), dtype=dtype)
+    peaks[:, 0] = np.clip(np.floor(mins * scale), -scale - 1, scale)
+    peaks[:, 1] = np.clip(np.ceil(maxs * scale), -scale - 1, scale)
+    return peaks
+
+def build_peak_pyramid(audio_buffer, output_path, bits=8):
+    """
+    Writes a min/max peak pyramid of an AudioBuffer to output_path: level 0 (finest)
+    first, each level's (min, max) pairs interleaved as little-endian int8 or int16
+    scaled to full range. Returns the index a client needs to Range-read any level.
+    """
+    if bits not in PEAK_DTYPES:
+        raise ValueError(f"Unsupported waveform bits: {bits} (expected one of {sorted(PEAK_DTYPES)})")
+    dtype = np.dtype(PEAK_DTYPES[bits])
+    mins, maxs = _base_peaks(audio_buffer)
+    levels = []
+    offset = 0
+    samples_per_peak = BASE_SAMPLES_PER_PEAK
+    temp_path = output_path + ".part"
+    with open(temp_path, "wb") as f:
+        for level in range(LEVEL_COUNT):
+            if level:
+                groups = np.arange(0, len(mins), LEVEL_FACTOR)
+                if len(groups):
+                    mins, maxs = np.minimum.reduceat(mins, groups), np.maximum.reduceat(maxs, groups)
+                samples_per_peak *= LEVEL_FACTOR
+            data = _quantize(mins, maxs, dtype).tobytes()
+            f.write(data)
+            levels.append({
+                "samples_per_peak": samples_per_peak,
+                "seconds_per_peak": samples_per_peak / audio_buffer.sample_rate,
+                "offset": offset,
+                "count": len(mins),
+            })
+            offset += len(data)
+    os.replace(temp_path, output_path)
+    return {
+        "format": "minmax",
+        "bits": bits,
+        "sample_rate": audio_buffer.sample_rate,
+        "duration": audio_buffer.duration,
+        "levels": levels,
+    }
+
+def peak_window(index, start=None, end=None, pixels=None):
+    """
+    The level and byte range to read for [start, end) seconds at about `pixels` peaks:
+    the coarsest level that still has at least one peak per pixel (the finest level if
+    none does). Without pixels, the finest level.
+    """
+    start = max(0.0, start or 0.0)
+    end = index["duration"] if end is None else min(end, index["duration"])
+    end = max(start, end)
+    level_number = 0
+    if pixels:
+        for number, level in enumerate(index["levels"]):
+            if level["seconds_per_peak"] * pixels <= end - start:
+                level_number = number
+    level = index["levels"][level_number]
+    first = min(int(start / level["seconds_per_peak"]), level["count"])
+    last = min(math.ceil(end / level["seconds_per_peak"]), level["count"])
+    peak_bytes = 2 * np.dtype(PEAK_DTYPES[index["bits"]]).itemsize
+    return {
+        "level": level_number,
+        "seconds_per_peak": level["seconds_per_peak"],
+        "start": first * level["seconds_per_peak"],
+        "first_peak": first,
+        "peak_count": last - first,
+        # Inclusive, as in an HTTP Range header; empty when the window holds no peaks.
+        "byte_range": [level["offset"] + first * peak_bytes, level["offset"] + last * peak_bytes - 1] if last > first else None,
+    }
+
+def _overlaps(interval, start, end):
+    return interval["end"] > start and (end is None or interval["start"] < end)
+
+def review_intervals(silence_intervals, filler_words, retakes, start=None, end=None):
+    """The analysis' proposed cuts in seconds, limited to those overlapping [start, end)."""
+    start = start or 0.0
+    intervals = {
+        "silence": [
+            {"start": timedelta_string_to_seconds(interval["start"]), "end": timedelta_string_to_seconds(interval["end"])}
+            for interval in silence_intervals or []
+        ],
+        "filler_words": [
+            {"start": timedelta_string_to_seconds(word["start"]), "end": timedelta_string_to_seconds(word["end"]),
+             "word": word.get("word"), "can_be_removed": word.get("can_be_removed", False)}
+            for word in filler_words or []
+        ],
+        "retakes": [
+            {"start": timedelta_string_to_seconds(retake["start"]), "end": timedelta_string_to_seconds(retake["end"]),
+             "reasoning": retake.get("reasoning")}
+            for retake in retakes or []
+        ],
+    }
+    return {kind: [interval for interval in items if _overlaps(interval, start, end)] for kind, items in intervals.items()}
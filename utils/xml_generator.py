@@ -1,139 +1,218 @@
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
 import os
 
-def generate_premiere_xml(output_path, video_metadata, segments_to_keep, video_filename):
-    frame_rate = video_metadata.get("frame_rate", 30)
-    width = video_metadata.get("width", 1920)
-    height = video_metadata.get("height", 1080)
-    audio_sample_rate = video_metadata.get("audio", {}).get("sample_rate", 44100)
-    audio_channels = video_metadata.get("audio", {}).get("channels", 1)
-    video_duration_frames = int(video_metadata.get("duration", 0) * frame_rate)
-
-    xmeml = ET.Element("xmeml", version="4")
-    sequence = ET.SubElement(xmeml, "sequence", id="sequence-1")
-    ET.SubElement(sequence, "name").text = os.path.splitext(video_filename)[0]
-    
-    rate = ET.SubElement(sequence, "rate")
-    ET.SubElement(rate, "timebase").text = str(int(frame_rate))
-    ET.SubElement(rate, "ntsc").text = "TRUE"
-
-    media = ET.SubElement(sequence, "media")
-    video = ET.SubElement(media, "video")
-    video_format = ET.SubElement(video, "format")
-    video_sample_char = ET.SubElement(video_format, "samplecharacteristics")
-    ET.SubElement(video_sample_char, "width").text = str(width)
-    ET.SubElement(video_sample_char, "height").text = str(height)
-    ET.SubElement(video_sample_char, "anamorphic").text = "FALSE"
-    ET.SubElement(video_sample_char, "pixelaspectratio").text = "square"
-    ET.SubElement(video_sample_char, "fielddominance").text = "none"
-    ET.SubElement(video_sample_char, "colordepth").text = "24"
-    v_rate = ET.SubElement(video_sample_char, "rate")
-    ET.SubElement(v_rate, "timebase").text = str(int(frame_rate))
-    ET.SubElement(v_rate, "ntsc").text = "TRUE"
-
-    video_track = ET.SubElement(video, "track")
-    
-    audio = ET.SubElement(media, "audio")
-    ET.SubElement(audio, "numOutputChannels").text = "2"
-    audio_format = ET.SubElement(audio, "format")
-    audio_sample_char = ET.SubElement(audio_format, "samplecharacteristics")
-    ET.SubElement(audio_sample_char, "depth").text = "16"
-    ET.SubElement(audio_sample_char, "samplerate").text = str(audio_sample_rate)
-    audio_track = ET.SubElement(audio, "track")
-
-    timeline_cursor = 0
+# Large write buffer: the writer emits many tiny strings.
+_WRITE_BUFFER_SIZE = 1024 * 1024
+
+def _escape(text):
+    # Same escaping minidom applies, so output stays byte-identical to the previous
+    # ElementTree/minidom pretty-printer that Premiere has been importing.
+    return str(text).replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+class XmlStreamWriter:
+    """
+    Minimal indenting XML writer that streams straight to a file. Opening tags are held
+    back until the first child arrives so childless elements collapse to <tag/>.
+    """
+
+    def __init__(self, f, indent="  "):
+        self._f = f
+        self._indent = indent
+        self._stack = []
+        self._open_tag_pending = False
+
+    def declaration(self):
+        self._f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+
+    def _attributes(self, attrs):
+        return "".join(f' {name}="{_escape(value)}"' for name, value in attrs.items())
+
+    def _close_pending(self):
+        if self._open_tag_pending:
+            self._f.write(">\n")
+            self._open_tag_pending = False
+
+    def start(self, tag, **attrs):
+        self._close_pending()
+        self._f.write(f"{self._indent * len(self._stack)}<{tag}{self._attributes(attrs)}")
+        self._stack.append(tag)
+        self._open_tag_pending = True
+
+    def end(self):
+        tag = self._stack.pop()
+        if self._open_tag_pending:
+            self._f.write("/>\n")
+            self._open_tag_pending = False
+        else:
+            self._f.write(f"{self._indent * len(self._stack)}</{tag}>\n")
+
+    def element(self, tag, text=None, **attrs):
+        self._close_pending()
+        prefix = f"{self._indent * len(self._stack)}<{tag}{self._attributes(attrs)}"
+        if text is None:
+            self._f.write(f"{prefix}/>\n")
+        else:
+            self._f.write(f"{prefix}>{_escape(text)}</{tag}>\n")
+
+def _write_rate(writer, frame_rate):
+    writer.start("rate")
+    writer.element("timebase", int(frame_rate))
+    writer.element("ntsc", "TRUE")
+    writer.end()
+
+def _write_file_definition(writer, file_id, source):
+    metadata = source["metadata"]
+    frame_rate = metadata.get("frame_rate", 30)
+    writer.start("file", id=file_id)
+    writer.element("name", source["filename"])
+    writer.element("pathurl", source["filename"])
+    writer.element("duration", int(metadata.get("duration", 0) * frame_rate))
+    _write_rate(writer, frame_rate)
+    writer.start("media")
+    writer.start("video")
+    writer.start("samplecharacteristics")
+    writer.element("width", metadata.get("width", 1920))
+    writer.element("height", metadata.get("height", 1080))
+    writer.end()
+    writer.end()
+    writer.start("audio")
+    writer.start("samplecharacteristics")
+    writer.element("depth", "16")
+    writer.element("samplerate", metadata.get("audio", {}).get("sample_rate", 44100))
+    writer.end()
+    writer.element("channelcount", metadata.get("audio", {}).get("channels", 1))
+    writer.end()
+    writer.end()
+    writer.end()
+
+def _write_link(writer, clip, mediatype):
+    writer.start("link")
+    if mediatype == "video":
+        writer.element("linkclipref", clip["video_id"])
+        writer.element("mediatype", "video")
+        writer.element("trackindex", clip["track"])
+        writer.element("clipindex", clip["clipindex"])
+    else:
+        writer.element("linkclipref", clip["audio_id"])
+        writer.element("mediatype", "audio")
+        writer.element("trackindex", clip["track"])
+        writer.element("clipindex", clip["clipindex"])
+        writer.element("groupindex", "1")
+    writer.end()
+
+def _write_clipitem(writer, clip, mediatype):
+    clip_id = clip["video_id"] if mediatype == "video" else clip["audio_id"]
+    writer.start("clipitem", id=clip_id)
+    writer.element("name", clip["source"]["filename"])
+    writer.element("enabled", "TRUE")
+    writer.element("duration", clip["duration"])
+    writer.element("start", clip["start"])
+    writer.element("end", clip["start"] + clip["duration"])
+    writer.element("in", clip["in"])
+    writer.element("out", clip["out"])
+    if mediatype == "video":
+        _write_file_definition(writer, clip["file_id"], clip["source"])
+    else:
+        writer.element("file", id=clip["file_id"])
+    _write_link(writer, clip, "video")
+    _write_link(writer, clip, "audio")
+    writer.end()
+
+def _plan_clips(segments_to_keep, frame_rate, video_filename, video_metadata, sources):
+    """
+    Lays segments out on their tracks. A segment may name a "source" (key into sources,
+    each {"filename", "metadata"}) and a 1-based "track"; segments on the same track
+    follow each other unless they carry an explicit "timeline_start" in seconds.
+    """
+    default_source = {"filename": video_filename, "metadata": video_metadata}
+    file_ids = {}
+    track_cursors = {}
+    track_clip_counts = {}
+    clips = []
     clip_counter = 1
-
-    file_id_map = {}
-    file_counter = 1
-
     for segment in segments_to_keep:
+        source_key = segment.get("source")
+        source = sources[source_key] if source_key is not None else default_source
+        if source["filename"] not in file_ids:
+            file_ids[source["filename"]] = f"file-{len(file_ids) + 1}"
+        track = int(segment.get("track", 1))
+
         in_point = int(segment['start'] * frame_rate)
         out_point = int(segment['end'] * frame_rate)
-        clip_duration = out_point - in_point
-
-        # --- Video Clip --- 
-        video_clipitem = ET.SubElement(video_track, "clipitem", id=f"clipitem-{clip_counter}")
-        ET.SubElement(video_clipitem, "name").text = video_filename
-        ET.SubElement(video_clipitem, "enabled").text = "TRUE"
-        ET.SubElement(video_clipitem, "duration").text = str(clip_duration)
-        ET.SubElement(video_clipitem, "start").text = str(timeline_cursor)
-        ET.SubElement(video_clipitem, "end").text = str(timeline_cursor + clip_duration)
-        ET.SubElement(video_clipitem, "in").text = str(in_point)
-        ET.SubElement(video_clipitem, "out").text = str(out_point)
-
-        if video_filename not in file_id_map:
-            file_id_map[video_filename] = f"file-{file_counter}"
-            file_counter += 1
-        
-        file_id = file_id_map[video_filename]
-        file_element = ET.SubElement(video_clipitem, "file", id=file_id)
-
-        if file_id == f"file-{file_counter-1}": # Only add full file info for the first time
-            ET.SubElement(file_element, "name").text = video_filename
-            ET.SubElement(file_element, "pathurl").text = video_filename
-            ET.SubElement(file_element, "duration").text = str(video_duration_frames)
-            f_rate = ET.SubElement(file_element, "rate")
-            ET.SubElement(f_rate, "timebase").text = str(int(frame_rate))
-            ET.SubElement(f_rate, "ntsc").text = "TRUE"
-            f_media = ET.SubElement(file_element, "media")
-            f_video = ET.SubElement(f_media, "video")
-            f_video_sample = ET.SubElement(f_video, "samplecharacteristics")
-            ET.SubElement(f_video_sample, "width").text = str(width)
-            ET.SubElement(f_video_sample, "height").text = str(height)
-            f_audio = ET.SubElement(f_media, "audio")
-            f_audio_sample = ET.SubElement(f_audio, "samplecharacteristics")
-            ET.SubElement(f_audio_sample, "depth").text = "16"
-            ET.SubElement(f_audio_sample, "samplerate").text = str(audio_sample_rate)
-            ET.SubElement(f_audio, "channelcount").text = str(audio_channels)
-
-        # --- Audio Clip --- 
-        audio_clipitem = ET.SubElement(audio_track, "clipitem", id=f"clipitem-{clip_counter+1}")
-        ET.SubElement(audio_clipitem, "name").text = video_filename
-        ET.SubElement(audio_clipitem, "enabled").text = "TRUE"
-        ET.SubElement(audio_clipitem, "duration").text = str(clip_duration)
-        ET.SubElement(audio_clipitem, "start").text = str(timeline_cursor)
-        ET.SubElement(audio_clipitem, "end").text = str(timeline_cursor + clip_duration)
-        ET.SubElement(audio_clipitem, "in").text = str(in_point)
-        ET.SubElement(audio_clipitem, "out").text = str(out_point)
-        ET.SubElement(audio_clipitem, "file", id=file_id)
-
-        # --- Linking --- 
-        link1 = ET.SubElement(video_clipitem, "link")
-        ET.SubElement(link1, "linkclipref").text = f"clipitem-{clip_counter}"
-        ET.SubElement(link1, "mediatype").text = "video"
-        ET.SubElement(link1, "trackindex").text = "1"
-        ET.SubElement(link1, "clipindex").text = str(len(video_track))
-
-        link2 = ET.SubElement(video_clipitem, "link")
-        ET.SubElement(link2, "linkclipref").text = f"clipitem-{clip_counter+1}"
-        ET.SubElement(link2, "mediatype").text = "audio"
-        ET.SubElement(link2, "trackindex").text = "1"
-        ET.SubElement(link2, "clipindex").text = str(len(audio_track))
-        ET.SubElement(link2, "groupindex").text = "1"
-
-        link3 = ET.SubElement(audio_clipitem, "link")
-        ET.SubElement(link3, "linkclipref").text = f"clipitem-{clip_counter}"
-        ET.SubElement(link3, "mediatype").text = "video"
-        ET.SubElement(link3, "trackindex").text = "1"
-        ET.SubElement(link3, "clipindex").text = str(len(video_track))
-
-        link4 = ET.SubElement(audio_clipitem, "link")
-        ET.SubElement(link4, "linkclipref").text = f"clipitem-{clip_counter+1}"
-        ET.SubElement(link4, "mediatype").text = "audio"
-        ET.SubElement(link4, "trackindex").text = "1"
-        ET.SubElement(link4, "clipindex").text = str(len(audio_track))
-        ET.SubElement(link4, "groupindex").text = "1"
-
-        timeline_cursor += clip_duration
+        if "timeline_start" in segment:
+            timeline_start = int(segment["timeline_start"] * frame_rate)
+        else:
+            timeline_start = track_cursors.get(track, 0)
+        track_clip_counts[track] = track_clip_counts.get(track, 0) + 1
+        clip = {
+            "source": source,
+            "file_id": file_ids[source["filename"]],
+            "track": track,
+            "clipindex": track_clip_counts[track],
+            "video_id": f"clipitem-{clip_counter}",
+            "audio_id": f"clipitem-{clip_counter + 1}",
+            "in": in_point,
+            "out": out_point,
+            "duration": out_point - in_point,
+            "start": timeline_start,
+        }
+        track_cursors[track] = max(track_cursors.get(track, 0), timeline_start + clip["duration"])
+        clips.append(clip)
         clip_counter += 2
+    return clips, track_cursors
 
-    ET.SubElement(sequence, "duration").text = str(timeline_cursor)
+def _write_tracks(writer, clips, track_count, mediatype):
+    for track in range(1, track_count + 1):
+        writer.start("track")
+        for clip in clips:
+            if clip["track"] == track:
+                _write_clipitem(writer, clip, mediatype)
+        writer.end()
 
-    xml_str = ET.tostring(xmeml, encoding='utf-8', method='xml')
-    reparsed = minidom.parseString(xml_str)
-    pretty_xml_str = reparsed.toprettyxml(indent="  ", encoding="utf-8").decode('utf-8')
+def generate_premiere_xml(output_path, video_metadata, segments_to_keep, video_filename, sources=None):
+    frame_rate = video_metadata.get("frame_rate", 30)
+    width = video_metadata.get("width", 1920)
+    height = video_metadata.get("height", 1080)
+    audio_sample_rate = video_metadata.get("audio", {}).get("sample_rate", 44100)
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(pretty_xml_str)
+    clips, track_cursors = _plan_clips(segments_to_keep, frame_rate, video_filename, video_metadata, sources or {})
+    track_count = max(track_cursors.keys(), default=1)
+
+    with open(output_path, "w", encoding="utf-8", buffering=_WRITE_BUFFER_SIZE) as f:
+        writer = XmlStreamWriter(f)
+        writer.declaration()
+        writer.start("xmeml", version="4")
+        writer.start("sequence", id="sequence-1")
+        writer.element("name", os.path.splitext(video_filename)[0])
+        _write_rate(writer, frame_rate)
+
+        writer.start("media")
+        writer.start("video")
+        writer.start("format")
+        writer.start("samplecharacteristics")
+        writer.element("width", width)
+        writer.element("height", height)
+        writer.element("anamorphic", "FALSE")
+        writer.element("pixelaspectratio", "square")
+        writer.element("fielddominance", "none")
+        writer.element("colordepth", "24")
+        _write_rate(writer, frame_rate)
+        writer.end()
+        writer.end()
+        _write_tracks(writer, clips, track_count, "video")
+        writer.end()
+
+        writer.start("audio")
+        writer.element("numOutputChannels", "2")
+        writer.start("format")
+        writer.start("samplecharacteristics")
+        writer.element("depth", "16")
+        writer.element("samplerate", audio_sample_rate)
+        writer.end()
+        writer.end()
+        _write_tracks(writer, clips, track_count, "audio")
+        writer.end()
+        writer.end()
+
+        writer.element("duration", max(track_cursors.values(), default=0))
+        writer.end()
+        writer.end()
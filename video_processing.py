@@ -1,13 +1,29 @@
 import os
+import re
 import requests
 from urllib.parse import urlparse
 import logging
 import json
-from utils.ffmpeg_utils import get_video_metadata, apply_noise_reduction, cut_video_segments, timedelta_string_to_seconds, burn_srt_to_video
+from contextlib import ExitStack
+from utils.ffmpeg_utils import get_video_metadata, mux_audio, analysis_proxy_settings, create_audio_proxy, create_video_proxy, AUDIO_PROXY_KEYS, cut_video_segments, timedelta_string_to_seconds, burn_srt_to_video, plan_rendition, render_renditions
 from utils.xml_generator import generate_premiere_xml
+from utils.parallel_render import get_parallel_render_settings, parallel_cut_video_segments, parallel_burn_srt_to_video, parallel_denoise_audio, output_timeline_segments
+from utils.checkpoint import TaskCheckpoint, StageFailed, recipe_subset, load_manifest
+from utils.batch import effective_analysis, analysis_recipe
+from utils.task_events import TERMINAL_STATUSES
+from utils.metrics import ACTIVE_JOBS
+from utils.ffmpeg_runner import monitor_ffmpeg
+from utils.audio_buffer import AudioBuffer
+from utils.media_probe import load_media_index
+from utils.waveform import build_peak_pyramid
+from utils.artifacts import describe_artifacts
+from utils.cancellation import TaskCancellation, TaskCancelled, check_cancelled, LEASE_LOST
 from services.transcription_service import transcribe_video
 from services.classification_service import classify_content, detect_filler_words, suggest_b_roll, detect_silence_with_gemini, detect_retakes
 
+# Aspect ratios plan_rendition can frame; get_metadata_step passes the source's through, which may be "unknown" or e.g. "1.85:1".
+RENDITION_ASPECT_RATIO = re.compile(r"^[1-9]\d*:[1-9]\d*$")
+
 def download_video(task_id, video_url, video_path, task_status):
     task_status[task_id].update({"status": "DOWNLOADING", "progress": 10, "message": f"Attempting to download video from: {video_url}"})
     logging.info(f"[{task_id}] Attempting to download video from: {video_url}")
@@ -15,17 +31,39 @@ def download_video(task_id, video_url, video_path, task_status):
         r.raise_for_status()
         with open(video_path, 'wb') as f:
             for chunk in r.iter_content(chunk_size=8192):
+                check_cancelled()
                 f.write(chunk)
     task_status[task_id].update({"status": "DOWNLOADED", "progress": 20, "message": f"Video downloaded successfully to: {video_path}"})
     logging.info(f"[{task_id}] Video downloaded successfully to: {video_path}")
 
-def apply_noise_reduction_step(task_id, video_path, recipe, task_status):
-    if recipe.get("apply_noise_reduction", False):
-        noise_reduced_video_path = os.path.splitext(video_path)[0] + "_nr.mp4"
-        if apply_noise_reduction(video_path, noise_reduced_video_path, task_id, task_status):
-            return noise_reduced_video_path
-        else:
-            logging.warning(f"[{task_id}] Noise reduction failed or was skipped, continuing with original video.")
+def apply_noise_reduction_step(task_id, video_path, video_metadata, recipe, task_status):
+    """
+    Cleans the audio track only, in parallel chunks; analysis reads the result right
+    away and the render muxes it in. Returns its path, or None to keep the source audio.
+    """
+    if not recipe.get("apply_noise_reduction", False) or not video_metadata.get("audio"):
+        return None
+    task_status[task_id].update({"status": "NOISE_REDUCTION", "progress": 51, "message": f"Applying noise reduction to the audio of {video_path}"})
+    clean_audio_path = os.path.splitext(video_path)[0] + "_nr.flac"
+    logging.info(f"[{task_id}] Applying noise reduction to the audio of {video_path}, output to {clean_audio_path}")
+    if parallel_denoise_audio(video_path, clean_audio_path, video_metadata.get("duration"), os.cpu_count() or 1):
+        task_status[task_id].update({"status": "NOISE_REDUCTION_COMPLETE", "progress": 52, "message": "Noise reduction applied successfully."})
+        logging.info(f"[{task_id}] Noise reduction applied successfully.")
+        return clean_audio_path
+    task_status[task_id].update({"status": "NOISE_REDUCTION_FAILED", "progress": 52, "message": "Noise reduction failed, continuing with the original audio."})
+    logging.warning(f"[{task_id}] Noise reduction failed, continuing with original audio.")
+    return None
+
+def mux_audio_step(task_id, video_path, clean_audio_path, video_metadata, task_status):
+    """The source with the cleaned audio muxed in, for outputs that use the whole source."""
+    if not clean_audio_path:
+        return video_path
+    task_status[task_id].update({"status": "MUXING_AUDIO", "progress": 99, "message": "Muxing noise-reduced audio..."})
+    muxed_video_path = os.path.splitext(video_path)[0] + "_nr.mp4"
+    logging.info(f"[{task_id}] Muxing {clean_audio_path} into {muxed_video_path}")
+    if mux_audio(video_path, clean_audio_path, muxed_video_path, duration=video_metadata.get("duration")):
+        return muxed_video_path
+    logging.warning(f"[{task_id}] Muxing the noise-reduced audio failed, using the original audio.")
     return video_path
 
 def get_metadata_step(task_id, video_path, task_status):
@@ -46,11 +84,64 @@ def get_metadata_step(task_id, video_path, task_status):
     logging.info(f"[{task_id}] Available aspect ratios: {available_aspect_ratios}")
     return video_metadata, available_aspect_ratios
 
-def transcribe_step(task_id, video_path, recipe, srt_path, task_status):
+def needs_audio_proxy(recipe):
+    wanted = effective_analysis(recipe)
+    return wanted["transcribe"] or wanted["detect_filler_words"]
+
+def audio_buffer_step(task_id, video_path, clean_audio_path, video_metadata, recipe, task_status):
+    """Decodes the audio (cleaned, if it was) once into the task's shared PCM buffer, for the audio proxy and local analysis."""
+    if not (needs_audio_proxy(recipe) or recipe.get("waveform", False)):
+        return None
+    audio_source_path = clean_audio_path or video_path
+    task_status[task_id].update({"status": "DECODING_AUDIO", "progress": 53, "message": "Decoding audio for analysis..."})
+    logging.info(f"[{task_id}] Decoding audio buffer from: {audio_source_path}")
+    audio_buffer = AudioBuffer.decode(audio_source_path, os.path.splitext(video_path)[0] + "_pcm.f32",
+                                      analysis_proxy_settings(recipe)["audio_sample_rate"], duration=video_metadata.get("duration"))
+    if audio_buffer is None:
+        logging.warning(f"[{task_id}] Could not decode audio from {audio_source_path}.")
+        return None
+    return {"path": audio_buffer.path, "sample_rate": audio_buffer.sample_rate}
+
+def waveform_step(task_id, video_path, audio_buffer_output, recipe, task_status):
+    if not recipe.get("waveform", False) or audio_buffer_output is None:
+        return None
+    audio_buffer = AudioBuffer(**audio_buffer_output)
+    task_status[task_id].update({"status": "BUILDING_WAVEFORM", "progress": 54, "message": "Building waveform peaks..."})
+    logging.info(f"[{task_id}] Building waveform peak pyramid from: {audio_buffer.path}")
+    waveform_path = os.path.splitext(video_path)[0] + "_peaks.bin"
+    return {"path": waveform_path, **build_peak_pyramid(audio_buffer, waveform_path, bits=int(recipe.get("waveform_bits", 8)))}
+
+def audio_proxy_step(task_id, video_path, clean_audio_path, video_metadata, audio_buffer_output, recipe, task_status):
+    if not needs_audio_proxy(recipe):
+        return None
+    audio_buffer = AudioBuffer(**audio_buffer_output) if audio_buffer_output else None
+    task_status[task_id].update({"status": "CREATING_PROXIES", "progress": 55, "message": "Extracting speech audio for analysis..."})
+    logging.info(f"[{task_id}] Extracting speech audio proxy from: {clean_audio_path or video_path}")
+    audio_path = create_audio_proxy(clean_audio_path or video_path, os.path.splitext(video_path)[0] + "_speech", analysis_proxy_settings(recipe),
+                                    duration=video_metadata.get("duration"), audio_buffer=audio_buffer)
+    if audio_path is None:
+        logging.warning(f"[{task_id}] Could not extract audio from {video_path}.")
+    return audio_path
+
+def video_proxy_step(task_id, video_path, clean_audio_path, video_metadata, recipe, task_status):
+    if not recipe.get("detect_silence", False):
+        return None
+    settings = analysis_proxy_settings(recipe)
+    if not settings["enabled"]:
+        return video_path
+    task_status[task_id].update({"status": "CREATING_PROXIES", "progress": 57, "message": "Rendering analysis proxy video..."})
+    logging.info(f"[{task_id}] Rendering analysis proxy of: {video_path}")
+    proxy_path = os.path.splitext(video_path)[0] + "_proxy.mp4"
+    if create_video_proxy(video_path, proxy_path, settings, duration=video_metadata.get("duration"), audio_path=clean_audio_path):
+        return proxy_path
+    logging.warning(f"[{task_id}] Video proxy failed, analyzing the source video instead.")
+    return video_path
+
+def transcribe_step(task_id, audio_path, recipe, srt_path, task_status):
     if recipe.get("transcribe", False):
         task_status[task_id].update({"status": "TRANSCRIBING", "progress": 60, "message": "Transcribing video..."})
-        logging.info(f"[{task_id}] Transcribing video: {video_path}")
-        srt_content = transcribe_video(video_path)
+        logging.info(f"[{task_id}] Transcribing audio: {audio_path}")
+        srt_content = transcribe_video(audio_path) if audio_path else None
         if srt_content is None:
             task_status[task_id].update({"status": "FAILED", "progress": 70, "message": "Transcription failed."})
             logging.error(f"[{task_id}] Transcription failed, returned None.")
@@ -76,11 +167,11 @@ def classify_content_step(task_id, srt_content, recipe, task_status):
         return classification
     return None
 
-def detect_filler_words_step(task_id, video_path, recipe, task_status):
+def detect_filler_words_step(task_id, audio_path, recipe, task_status):
     if recipe.get("detect_filler_words", False):
         task_status[task_id].update({"status": "DETECTING_FILLER_WORDS", "progress": 99, "message": "Detecting filler words from audio..."})
-        logging.info(f"[{task_id}] Detecting filler words from audio: {video_path}")
-        filler_words_detected = detect_filler_words(video_path)
+        logging.info(f"[{task_id}] Detecting filler words from audio: {audio_path}")
+        filler_words_detected = detect_filler_words(audio_path) if audio_path else []
         task_status[task_id].update({"status": "FILLER_WORD_DETECTION_COMPLETE", "progress": 100, "message": f"Filler word detection complete. Found {len(filler_words_detected)} filler words."})
         logging.info(f"[{task_id}] Filler word detection complete. Found {len(filler_words_detected)} filler words.")
         return filler_words_detected
@@ -121,7 +212,7 @@ def export_to_premiere_step(task_id, video_path, segments_to_keep, video_metadat
         return xml_output_path
     return None
 
-def cut_video_step(task_id, video_path, segments_to_keep, video_duration, recipe, task_status):
+def cut_video_step(task_id, video_path, clean_audio_path, segments_to_keep, video_metadata, recipe, task_status):
     if recipe.get("cut_video", False):
         task_status[task_id].update({"status": "PREPARING_CUTS", "progress": 99, "message": "Preparing video cuts..."})
         logging.info(f"[{task_id}] Preparing video cuts.")
@@ -129,143 +220,447 @@ def cut_video_step(task_id, video_path, segments_to_keep, video_duration, recipe
         trimmed_video_path = os.path.splitext(video_path)[0] + "_trimmed.mp4"
         task_status[task_id].update({"status": "CUTTING_VIDEO", "progress": 99, "message": "Cutting video segments..."})
         logging.info(f"[{task_id}] Cutting video segments to: {trimmed_video_path}")
-        if cut_video_segments(video_path, segments_to_keep, trimmed_video_path):
+        cut_engine = recipe.get("cut_engine", "auto")
+        parallel_settings = get_parallel_render_settings(recipe)
+        if parallel_settings:
+            logging.info(f"[{task_id}] Parallel render enabled with up to {parallel_settings['chunks']} chunks.")
+            cut_ok = parallel_cut_video_segments(video_path, segments_to_keep, trimmed_video_path, video_metadata.get("frame_rate", 30), parallel_settings["chunks"], engine=cut_engine, min_chunk_duration=parallel_settings["min_chunk_duration"],
+                                                 media_index=load_media_index(video_metadata), audio_path=clean_audio_path)
+        else:
+            cut_ok = cut_video_segments(video_path, segments_to_keep, trimmed_video_path, engine=cut_engine, audio_path=clean_audio_path)
+        if cut_ok:
             logging.info("Video cutting complete.")
             return trimmed_video_path
         else:
             logging.warning("Video cutting failed or was skipped.")
     return video_path
 
-def burn_captions_step(task_id, video_path, recipe, task_status):
+def retranscribe_step(task_id, video_path, recipe, task_status):
+    task_status[task_id].update({"status": "RETRANSCRIBING_TRIMMED_VIDEO", "progress": 99, "message": "Re-transcribing trimmed video..."})
+    logging.info(f"[{task_id}] Re-transcribing trimmed video: {video_path}")
+    audio_path = create_audio_proxy(video_path, os.path.splitext(video_path)[0] + "_speech", analysis_proxy_settings(recipe))
+    trimmed_srt_content = transcribe_video(audio_path) if audio_path else None
+    if audio_path:
+        os.remove(audio_path)
+
+    if trimmed_srt_content is None:
+        return None
+
+    trimmed_srt_path = os.path.splitext(video_path)[0] + ".srt"
+    with open(trimmed_srt_path, 'w', encoding='utf-8') as f:
+        f.write(trimmed_srt_content)
+    logging.info(f"[{task_id}] Trimmed SRT saved to: {trimmed_srt_path}")
+    return trimmed_srt_path
+
+def retranscribe_stage(task_id, video_path, recipe, task_status):
     if recipe.get("burn_captions", False):
-        task_status[task_id].update({"status": "RETRANSCRIBING_TRIMMED_VIDEO", "progress": 99, "message": "Re-transcribing trimmed video..."})
-        logging.info(f"[{task_id}] Re-transcribing trimmed video: {video_path}")
-        trimmed_srt_content = transcribe_video(video_path)
-
-        if trimmed_srt_content is None:
-            logging.warning(f"[{task_id}] Transcription of trimmed video failed, skipping caption burning.")
-            return video_path
-
-        trimmed_srt_path = os.path.splitext(video_path)[0] + ".srt"
-        with open(trimmed_srt_path, 'w', encoding='utf-8') as f:
-            f.write(trimmed_srt_content)
-        logging.info(f"[{task_id}] Trimmed SRT saved to: {trimmed_srt_path}")
+        trimmed_srt_path = retranscribe_step(task_id, video_path, recipe, task_status)
+        if trimmed_srt_path is None:
+            logging.warning(f"[{task_id}] Transcription of trimmed video failed, rendering without captions.")
+        return trimmed_srt_path
+    return None
+
+def burn_captions_step(task_id, video_path, trimmed_srt_path, recipe, task_status, video_metadata=None, timeline_segments=None):
+    if recipe.get("burn_captions", False) and trimmed_srt_path:
+
         task_status[task_id].update({"status": "BURNING_CAPTIONS", "progress": 99, "message": "Burning captions to video..."})
         logging.info(f"[{task_id}] Burning captions to video: {video_path}")
         final_video_path = os.path.splitext(video_path)[0] + "_captioned.mp4"
         ass_style = recipe.get("ass_style")
-        if burn_srt_to_video(video_path, trimmed_srt_path, final_video_path, ass_style=ass_style):
+        play_res = (1920, 1080)
+        if video_metadata and video_metadata.get("width") and video_metadata.get("height"):
+            play_res = (video_metadata["width"], video_metadata["height"])
+        parallel_settings = get_parallel_render_settings(recipe)
+        if parallel_settings and video_metadata and timeline_segments:
+            burn_ok = parallel_burn_srt_to_video(video_path, trimmed_srt_path, final_video_path, video_metadata.get("frame_rate", 30), timeline_segments, parallel_settings["chunks"], ass_style=ass_style, min_chunk_duration=parallel_settings["min_chunk_duration"], play_res=play_res)
+        else:
+            burn_ok = burn_srt_to_video(video_path, trimmed_srt_path, final_video_path, ass_style=ass_style, play_res=play_res)
+        if burn_ok:
             logging.info("Captions burned to video successfully.")
             return final_video_path
         else:
             logging.warning("Burning captions failed or was skipped.")
     return video_path
 
-def process_video_with_recipe(task_id, video_url, recipe, task_status):
-    task_status[task_id] = {"status": "PENDING", "progress": 0, "message": "Starting video processing..."}
+def requested_renditions(recipe, available_aspect_ratios):
+    requested = recipe.get("renditions", False)
+    if not requested:
+        return []
+    if requested is True:
+        candidates = list(available_aspect_ratios)
+    else:
+        candidates = [aspect_ratio for aspect_ratio in requested if aspect_ratio in available_aspect_ratios]
+    aspect_ratios = []
+    for aspect_ratio in candidates:
+        if isinstance(aspect_ratio, str) and RENDITION_ASPECT_RATIO.match(aspect_ratio):
+            aspect_ratios.append(aspect_ratio)
+        else:
+            logging.warning(f"Skipping rendition with malformed aspect ratio {aspect_ratio!r}.")
+    return aspect_ratios
 
-    video_filename = os.path.basename(urlparse(video_url).path) if os.path.basename(urlparse(video_url).path) else "input.mp4"
-    video_path = video_filename
-    srt_path = os.path.splitext(video_path)[0] + ".srt"
+def render_renditions_step(task_id, video_path, srt_path, recipe, task_status, video_metadata, aspect_ratios):
+    task_status[task_id].update({"status": "RENDERING_RENDITIONS", "progress": 99, "message": f"Rendering {', '.join(aspect_ratios)} renditions..."})
+    logging.info(f"[{task_id}] Rendering renditions {aspect_ratios} from: {video_path}")
+    renditions = []
+    for aspect_ratio in aspect_ratios:
+        rendition = plan_rendition(video_metadata["width"], video_metadata["height"], aspect_ratio)
+        rendition["output_path"] = f"{os.path.splitext(video_path)[0]}_{aspect_ratio.replace(':', 'x')}.mp4"
+        renditions.append(rendition)
 
-    try:
-        download_video(task_id, video_url, video_path, task_status)
-        video_path = apply_noise_reduction_step(task_id, video_path, recipe, task_status)
-        video_metadata, available_aspect_ratios = get_metadata_step(task_id, video_path, task_status)
-        video_duration = video_metadata.get("duration")
-        srt_content = transcribe_step(task_id, video_path, recipe, srt_path, task_status)
-        if srt_content is None and recipe.get("transcribe", False):
-            return # Stop processing if transcription failed
-
-        silence_intervals = []
-        if recipe.get("detect_silence", False):
-            task_status[task_id].update({"status": "DETECTING_SILENCE", "progress": 85, "message": "Detecting silence with Gemini..."})
-            logging.info(f"[{task_id}] Detecting silence in video with Gemini: {video_path}")
-            silence_intervals = detect_silence_with_gemini(video_path)
-            task_status[task_id].update({"status": "SILENCE_DETECTION_COMPLETE", "progress": 90, "message": f"Silence detection complete. Found {len(silence_intervals)} intervals."})
-            logging.info(f"[{task_id}] Silence detection complete. Found {len(silence_intervals)} intervals.")
-
-        classification = classify_content_step(task_id, srt_content, recipe, task_status)
-        filler_words_detected = detect_filler_words_step(task_id, video_path, recipe, task_status)
-        b_roll_suggestions = suggest_b_roll_step(task_id, srt_content, recipe, task_status)
-        retakes_detected = detect_retakes_step(task_id, srt_content, recipe, task_status)
-
-        intervals_to_remove = []
-        if recipe.get("remove_silence", False):
-            for interval in silence_intervals:
-                start_sec = timedelta_string_to_seconds(interval["start"])
-                end_sec = timedelta_string_to_seconds(interval["end"])
-                intervals_to_remove.append({"start": start_sec, "end": end_sec})
-        if recipe.get("remove_filler_words", False):
-            for filler_word in filler_words_detected:
-                if filler_word["can_be_removed"]:
-                    start_sec = timedelta_string_to_seconds(filler_word["start"])
-                    end_sec = timedelta_string_to_seconds(filler_word["end"])
-                    intervals_to_remove.append({"start": start_sec, "end": end_sec})
-        if recipe.get("remove_retakes", False):
-            for retake in retakes_detected:
-                start_sec = timedelta_string_to_seconds(retake["start"])
-                end_sec = timedelta_string_to_seconds(retake["end"])
+    if not render_renditions(video_path, renditions, srt_path=srt_path, ass_style=recipe.get("ass_style")):
+        logging.warning(f"[{task_id}] Rendering renditions failed.")
+        return {}
+    logging.info(f"[{task_id}] Renditions rendered successfully.")
+    return {rendition["aspect_ratio"]: rendition["output_path"] for rendition in renditions}
+
+def detect_silence_step(task_id, video_path, recipe, task_status):
+    if recipe.get("detect_silence", False):
+        task_status[task_id].update({"status": "DETECTING_SILENCE", "progress": 85, "message": "Detecting silence with Gemini..."})
+        logging.info(f"[{task_id}] Detecting silence in video with Gemini: {video_path}")
+        silence_intervals = detect_silence_with_gemini(video_path)
+        task_status[task_id].update({"status": "SILENCE_DETECTION_COMPLETE", "progress": 90, "message": f"Silence detection complete. Found {len(silence_intervals)} intervals."})
+        logging.info(f"[{task_id}] Silence detection complete. Found {len(silence_intervals)} intervals.")
+        return silence_intervals
+    return []
+
+def plan_segments_to_keep(recipe, video_duration, silence_intervals, filler_words_detected, retakes_detected):
+    intervals_to_remove = []
+    if recipe.get("remove_silence", False):
+        for interval in silence_intervals:
+            start_sec = timedelta_string_to_seconds(interval["start"])
+            end_sec = timedelta_string_to_seconds(interval["end"])
+            intervals_to_remove.append({"start": start_sec, "end": end_sec})
+    if recipe.get("remove_filler_words", False):
+        for filler_word in filler_words_detected:
+            if filler_word["can_be_removed"]:
+                start_sec = timedelta_string_to_seconds(filler_word["start"])
+                end_sec = timedelta_string_to_seconds(filler_word["end"])
                 intervals_to_remove.append({"start": start_sec, "end": end_sec})
+    if recipe.get("remove_retakes", False):
+        for retake in retakes_detected:
+            start_sec = timedelta_string_to_seconds(retake["start"])
+            end_sec = timedelta_string_to_seconds(retake["end"])
+            intervals_to_remove.append({"start": start_sec, "end": end_sec})
 
-        segments_to_keep = []
+    segments_to_keep = []
+    if intervals_to_remove:
+        intervals_to_remove.sort(key=lambda x: x["start"])
+        merged_intervals_to_remove = []
         if intervals_to_remove:
-            intervals_to_remove.sort(key=lambda x: x["start"])
-            merged_intervals_to_remove = []
-            if intervals_to_remove:
-                current_interval = intervals_to_remove[0]
-                for i in range(1, len(intervals_to_remove)):
-                    next_interval = intervals_to_remove[i]
-                    if next_interval["start"] <= current_interval["end"]:
-                        current_interval["end"] = max(current_interval["end"], next_interval["end"])
-                    else:
-                        merged_intervals_to_remove.append(current_interval)
-                        current_interval = next_interval
-                merged_intervals_to_remove.append(current_interval)
-            
-            current_time = 0.0
-            for interval_to_remove in merged_intervals_to_remove:
-                if current_time < interval_to_remove["start"]:
-                    segments_to_keep.append({"start": current_time, "end": interval_to_remove["start"]})
-                current_time = max(current_time, interval_to_remove["end"])
-            if current_time < video_duration:
-                segments_to_keep.append({"start": current_time, "end": video_duration})
-        else:
-            segments_to_keep.append({"start": 0, "end": video_duration})
+            current_interval = intervals_to_remove[0]
+            for i in range(1, len(intervals_to_remove)):
+                next_interval = intervals_to_remove[i]
+                if next_interval["start"] <= current_interval["end"]:
+                    current_interval["end"] = max(current_interval["end"], next_interval["end"])
+                else:
+                    merged_intervals_to_remove.append(current_interval)
+                    current_interval = next_interval
+            merged_intervals_to_remove.append(current_interval)
+        
+        current_time = 0.0
+        for interval_to_remove in merged_intervals_to_remove:
+            if current_time < interval_to_remove["start"]:
+                segments_to_keep.append({"start": current_time, "end": interval_to_remove["start"]})
+            current_time = max(current_time, interval_to_remove["end"])
+        if current_time < video_duration:
+            segments_to_keep.append({"start": current_time, "end": video_duration})
+    else:
+        segments_to_keep.append({"start": 0, "end": video_duration})
+    return segments_to_keep
 
-        xml_file_path = None
-        if recipe.get("export_to_premiere", False):
-            xml_file_path = export_to_premiere_step(task_id, video_path, segments_to_keep, video_metadata, recipe, task_status)
-            final_video_path = video_path # No new video is created
+def transcribe_stage(task_id, audio_path, recipe, srt_path, task_status):
+    srt_content = transcribe_step(task_id, audio_path, recipe, srt_path, task_status)
+    if srt_content is None and recipe.get("transcribe", False):
+        raise StageFailed("Transcription failed.")
+    return srt_path if srt_content is not None else None
+
+def cut_stage(task_id, video_path, clean_audio_path, segments_to_keep, video_metadata, recipe, task_status):
+    # The cut reads the cleaned audio directly; only an uncut render needs a separate mux.
+    cut_video_path = cut_video_step(task_id, video_path, clean_audio_path, segments_to_keep, video_metadata, recipe, task_status)
+    if cut_video_path != video_path:
+        return {"video_path": cut_video_path, "cut": True, "timeline_segments": output_timeline_segments(segments_to_keep)}
+    return {"video_path": mux_audio_step(task_id, video_path, clean_audio_path, video_metadata, task_status), "cut": False,
+            "timeline_segments": [{"start": 0, "end": video_metadata.get("duration")}]}
+
+def captions_stage(task_id, video_path, trimmed_srt_path, timeline_segments, video_metadata, available_aspect_ratios, recipe, task_status):
+    rendition_paths = {}
+    rendition_aspect_ratios = requested_renditions(recipe, available_aspect_ratios)
+    if rendition_aspect_ratios:
+        rendition_paths = render_renditions_step(task_id, video_path, trimmed_srt_path, recipe, task_status, video_metadata, rendition_aspect_ratios)
+        source_aspect_ratio = video_metadata.get("aspect_ratio")
+        final_video_path = rendition_paths.get(source_aspect_ratio) or next(iter(rendition_paths.values()), video_path)
+    else:
+        final_video_path = burn_captions_step(task_id, video_path, trimmed_srt_path, recipe, task_status, video_metadata, timeline_segments)
+    return {"final_video_path": final_video_path, "renditions": rendition_paths}
+
+def analyze_source(task_id, video_url, recipe, task_status, checkpoint):
+    """Download, clean-up, metadata and every analysis stage: everything that depends only on the source."""
+    video_filename = os.path.basename(urlparse(video_url).path) if os.path.basename(urlparse(video_url).path) else "input.mp4"
+    video_path = checkpoint.path(video_filename)
+
+    def download_stage():
+        download_video(task_id, video_url, video_path, task_status)
+        return video_path
+    video_path = checkpoint.run_stage("download", download_stage, task_status, {"video_url": video_url})
+    video_metadata, available_aspect_ratios = checkpoint.run_stage("metadata", lambda: get_metadata_step(task_id, video_path, task_status), task_status, {"video_path": video_path})
+    # Only the audio is cleaned; the source video is used as downloaded until the render.
+    clean_audio_path = checkpoint.run_stage("noise_reduction", lambda: apply_noise_reduction_step(task_id, video_path, video_metadata, recipe, task_status), task_status,
+                                            {"video_path": video_path, "video_metadata": video_metadata, **recipe_subset(recipe, "apply_noise_reduction")})
+    # Everything uploaded to Gemini is a proxy; the source is only read again to render.
+    proxy_settings = analysis_proxy_settings(recipe)
+    audio_buffer_output = checkpoint.run_stage("audio_buffer", lambda: audio_buffer_step(task_id, video_path, clean_audio_path, video_metadata, recipe, task_status), task_status,
+                                               {"video_path": video_path, "clean_audio_path": clean_audio_path, **recipe_subset(recipe, "transcribe", "detect_filler_words", "waveform"),
+                                                "sample_rate": proxy_settings["audio_sample_rate"]})
+    # Local audio analysis maps this buffer; views of it share the same pages.
+    waveform = checkpoint.run_stage("waveform", lambda: waveform_step(task_id, video_path, audio_buffer_output, recipe, task_status), task_status,
+                                    {"audio_buffer": audio_buffer_output, **recipe_subset(recipe, "waveform", "waveform_bits")})
+    audio_path = checkpoint.run_stage("audio_proxy", lambda: audio_proxy_step(task_id, video_path, clean_audio_path, video_metadata, audio_buffer_output, recipe, task_status), task_status,
+                                      {"video_path": video_path, "clean_audio_path": clean_audio_path, "audio_buffer": audio_buffer_output, **recipe_subset(recipe, "transcribe", "detect_filler_words"),
+                                       "analysis_proxy": {key: proxy_settings[key] for key in AUDIO_PROXY_KEYS}})
+    analysis_video_path = checkpoint.run_stage("video_proxy", lambda: video_proxy_step(task_id, video_path, clean_audio_path, video_metadata, recipe, task_status), task_status,
+                                               {"video_path": video_path, "clean_audio_path": clean_audio_path, **recipe_subset(recipe, "detect_silence"), "analysis_proxy": proxy_settings})
+    transcript_path = os.path.splitext(video_path)[0] + ".srt"
+    srt_path = checkpoint.run_stage("transcribe", lambda: transcribe_stage(task_id, audio_path, recipe, transcript_path, task_status), task_status,
+                                    {"audio_path": audio_path, **recipe_subset(recipe, "transcribe")})
+    srt_content = None
+    if srt_path:
+        checkpoint.materialize(srt_path)
+        with open(srt_path, 'r', encoding='utf-8') as f:
+            srt_content = f.read()
+
+    analysis = {
+        "video_path": video_path,
+        "clean_audio_path": clean_audio_path,
+        "video_metadata": video_metadata,
+        "available_aspect_ratios": available_aspect_ratios,
+        "srt_path": srt_path,
+        "waveform": waveform,
+        "silence_intervals": checkpoint.run_stage("detect_silence", lambda: detect_silence_step(task_id, analysis_video_path, recipe, task_status), task_status,
+                                                  {"video_path": analysis_video_path, **recipe_subset(recipe, "detect_silence")}),
+        "classification": checkpoint.run_stage("classify_content", lambda: classify_content_step(task_id, srt_content, recipe, task_status), task_status,
+                                               {"srt_path": srt_path, **recipe_subset(recipe, "classify_content")}),
+        "filler_words": checkpoint.run_stage("detect_filler_words", lambda: detect_filler_words_step(task_id, audio_path, recipe, task_status), task_status,
+                                             {"audio_path": audio_path, **recipe_subset(recipe, "detect_filler_words")}),
+        "b_roll_suggestions": checkpoint.run_stage("suggest_b_roll", lambda: suggest_b_roll_step(task_id, srt_content, recipe, task_status), task_status,
+                                                   {"srt_path": srt_path, **recipe_subset(recipe, "suggest_b_roll")}),
+        "retakes": checkpoint.run_stage("detect_retakes", lambda: detect_retakes_step(task_id, srt_content, recipe, task_status), task_status,
+                                        {"srt_path": srt_path, **recipe_subset(recipe, "detect_retakes")}),
+    }
+    if not recipe.get("keep_intermediates", False):
+        # Only the Gemini stages read these; the render works from the source.
+        checkpoint.release(["audio_buffer", "audio_proxy", "video_proxy"])
+    return analysis
+
+def render_task(task_id, analysis, recipe, task_status, checkpoint):
+    """Cut, captions, renditions or Premiere export for one recipe, from an analysis that may be shared."""
+    # A shared analysis may have run more stages than this recipe asked for; only use what it asked for.
+    wanted = effective_analysis(recipe)
+    video_path = checkpoint.link_artifact(analysis["video_path"])
+    clean_audio_path = checkpoint.link_artifact(analysis["clean_audio_path"]) if analysis.get("clean_audio_path") else None
+    video_metadata = analysis["video_metadata"]
+    available_aspect_ratios = analysis["available_aspect_ratios"]
+    srt_path = analysis["srt_path"] if wanted["transcribe"] else None
+    silence_intervals = analysis["silence_intervals"] if wanted["detect_silence"] else []
+    classification = analysis["classification"] if wanted["classify_content"] else None
+    filler_words_detected = analysis["filler_words"] if wanted["detect_filler_words"] else []
+    b_roll_suggestions = analysis["b_roll_suggestions"] if wanted["suggest_b_roll"] else []
+    retakes_detected = analysis["retakes"] if wanted["detect_retakes"] else []
+
+    segments_to_keep = plan_segments_to_keep(recipe, video_metadata.get("duration"), silence_intervals, filler_words_detected, retakes_detected)
+
+    xml_file_path = None
+    rendition_paths = {}
+    # What a re-render starts from; kept with the outputs so changing only the captions costs one render.
+    render_inputs = [video_path, clean_audio_path]
+    if recipe.get("export_to_premiere", False):
+        # Premiere edits the whole source, so it gets the source with the cleaned audio.
+        export_video_path = checkpoint.run_stage("mux_audio", lambda: mux_audio_step(task_id, video_path, clean_audio_path, video_metadata, task_status), task_status,
+                                                 {"video_path": video_path, "clean_audio_path": clean_audio_path})
+        xml_file_path = checkpoint.run_stage("export_to_premiere", lambda: export_to_premiere_step(task_id, export_video_path, segments_to_keep, video_metadata, recipe, task_status), task_status,
+                                             {"video_path": export_video_path, "segments_to_keep": segments_to_keep, "video_metadata": video_metadata})
+        final_video_path = export_video_path # No new video is created
+        render_inputs.append(export_video_path)
+    else:
+        cut_output = checkpoint.run_stage("cut_video", lambda: cut_stage(task_id, video_path, clean_audio_path, segments_to_keep, video_metadata, recipe, task_status), task_status,
+                                          {"video_path": video_path, "clean_audio_path": clean_audio_path, "segments_to_keep": segments_to_keep, "video_metadata": video_metadata,
+                                           **recipe_subset(recipe, "cut_video", "cut_engine", "parallel_render")})
+        cut_video_path = cut_output["video_path"]
+        if not recipe.get("burn_captions", False):
+            trimmed_srt_path = None # Renditions are only captioned when burn_captions is on.
+        elif not cut_output["cut"] and srt_path:
+            trimmed_srt_path = srt_path # Nothing was cut, so the original transcript still lines up.
         else:
-            video_path = cut_video_step(task_id, video_path, segments_to_keep, video_duration, recipe, task_status)
-            final_video_path = burn_captions_step(task_id, video_path, recipe, task_status)
-
-        absolute_path = os.path.abspath(srt_path) if srt_content else None
-        final_absolute_path = os.path.abspath(final_video_path)
-        xml_absolute_path = os.path.abspath(xml_file_path) if xml_file_path else None
-
-        task_status[task_id].update({
-            "status": "COMPLETED",
-            "progress": 100,
-            "message": "Video processing completed successfully!",
-            "result": {
-                "srt_path": absolute_path,
-                "final_video_path": final_absolute_path,
-                "premiere_xml_path": xml_absolute_path,
-                "classification": classification,
-                "silence_intervals": silence_intervals,
-                "filler_words": filler_words_detected,
-                "b_roll_suggestions": b_roll_suggestions,
-                "retakes": retakes_detected,
-                "available_aspect_ratios": available_aspect_ratios
-            }
-        })
-        logging.info(f"[{task_id}] Video processing completed successfully.")
-
-    except requests.exceptions.RequestException as e:
+            trimmed_srt_path = checkpoint.run_stage("retranscribe", lambda: retranscribe_stage(task_id, cut_video_path, recipe, task_status), task_status,
+                                                    {"video_path": cut_video_path, **recipe_subset(recipe, "burn_captions", "analysis_proxy")})
+        captions_output = checkpoint.run_stage("captions", lambda: captions_stage(task_id, cut_video_path, trimmed_srt_path, cut_output["timeline_segments"], video_metadata, available_aspect_ratios, recipe, task_status), task_status,
+                                               {"video_path": cut_video_path, "srt_path": trimmed_srt_path, "timeline_segments": cut_output["timeline_segments"],
+                                                "video_metadata": video_metadata, "available_aspect_ratios": available_aspect_ratios,
+                                                **recipe_subset(recipe, "burn_captions", "ass_style", "renditions", "parallel_render")})
+        final_video_path = captions_output["final_video_path"]
+        rendition_paths = captions_output["renditions"]
+        render_inputs += [cut_video_path, trimmed_srt_path]
+
+    result = {
+        "srt_path": os.path.abspath(srt_path) if srt_path else None,
+        "final_video_path": os.path.abspath(final_video_path),
+        "premiere_xml_path": os.path.abspath(xml_file_path) if xml_file_path else None,
+        "classification": classification,
+        "silence_intervals": silence_intervals,
+        "filler_words": filler_words_detected,
+        "b_roll_suggestions": b_roll_suggestions,
+        "retakes": retakes_detected,
+        "available_aspect_ratios": available_aspect_ratios,
+        "waveform": {**analysis["waveform"], "path": os.path.abspath(analysis["waveform"]["path"])} if wanted["waveform"] and analysis["waveform"] else None,
+        "renditions": {aspect_ratio: os.path.abspath(path) for aspect_ratio, path in rendition_paths.items()},
+        "timings": checkpoint.timing_breakdown()
+    }
+    # Outputs reused from a run whose files were since released or expired are rebuilt here.
+    output_paths = [path for path in (srt_path, final_video_path, xml_file_path, *rendition_paths.values()) if path]
+    if result["waveform"]:
+        output_paths.append(result["waveform"]["path"])
+    checkpoint.materialize(output_paths)
+    result["artifacts"] = describe_artifacts(task_id, result, previous=checkpoint.manifest.get("result"))
+    if not recipe.get("keep_intermediates", False):
+        # The render inputs stay until the task expires or is evicted (see utils/retention.py).
+        checkpoint.release(keep=output_paths + [path for path in render_inputs if path])
+    checkpoint.finish("COMPLETED", result=result)
+    task_status[task_id].update({
+        "status": "COMPLETED",
+        "progress": 100,
+        "message": "Video processing completed successfully!",
+        "result": result
+    })
+    logging.info(f"[{task_id}] Video processing completed successfully.")
+
+def handle_task_failure(task_id, checkpoint, task_status, e):
+    checkpoint.finish("FAILED", error=str(e))
+    if isinstance(e, StageFailed):
+        task_status[task_id].update({"status": "FAILED", "message": str(e), "error": str(e)})
+        logging.error(f"[{task_id}] {e}")
+    elif isinstance(e, requests.exceptions.RequestException):
         task_status[task_id].update({"status": "FAILED", "message": f"Failed to download video: {str(e)}", "error": str(e)})
         logging.error(f"[{task_id}] Failed to download video: {e}", exc_info=True)
-    except Exception as e:
+    else:
         task_status[task_id].update({"status": "FAILED", "message": f"An unexpected error occurred: {str(e)}", "error": str(e)})
-        logging.error(f"[{task_id}] An unexpected error occurred: {e}", exc_info=True)
\ No newline at end of file
+        logging.error(f"[{task_id}] An unexpected error occurred: {e}", exc_info=True)
+
+def handle_task_cancelled(task_id, checkpoint, task_status, e):
+    if e.reason == LEASE_LOST:
+        # Another worker has taken the job over and now owns the task directory and status.
+        logging.warning(f"[{task_id}] Stopped after losing the job's lease; leaving the task to its new worker.")
+        return
+    # Cancelled tasks give their disk back right away; a retry re-runs the media stages
+    # but reuses the Gemini analysis recorded in the manifest.
+    checkpoint.discard_artifacts()
+    if e.reason == "deadline":
+        status, error, message = "FAILED", "deadline_exceeded", "Task ran past its deadline and was stopped."
+    else:
+        status, error, message = "CANCELLED", "cancelled", "Task cancelled."
+    checkpoint.finish(status, error=error)
+    task_status[task_id].update({"status": status, "message": message, "error": error})
+    logging.info(f"[{task_id}] {message}")
+
+def analyze_shared_source(source_task_id, video_url, recipes, task_status):
+    """
+    Runs (or reuses) the analysis of a source shared by several batch tasks, covering
+    every analysis stage any of `recipes` or the source's earlier consumers needed.
+    """
+    source_manifest = load_manifest(source_task_id)
+    if source_manifest is not None:
+        recipes = list(recipes) + [source_manifest["recipe"]]
+    recipe = analysis_recipe(recipes)
+    if source_task_id not in task_status or task_status[source_task_id].get("status") in TERMINAL_STATUSES:
+        task_status[source_task_id] = {"status": "PENDING", "progress": 0, "message": "Starting shared analysis..."}
+    checkpoint = TaskCheckpoint(source_task_id, video_url, recipe)
+    try:
+        with monitor_ffmpeg(source_task_id, task_status):
+            analysis = analyze_source(source_task_id, video_url, recipe, task_status, checkpoint)
+            # Members link the source video and cleaned audio, and serve the waveform from here.
+            checkpoint.materialize([analysis["video_path"], analysis["clean_audio_path"], analysis["waveform"]])
+    except TaskCancelled as e:
+        handle_task_cancelled(source_task_id, checkpoint, task_status, e)
+        raise
+    except Exception as e:
+        handle_task_failure(source_task_id, checkpoint, task_status, e)
+        raise
+    checkpoint.finish("COMPLETED", result=analysis)
+    task_status[source_task_id].update({"status": "COMPLETED", "progress": 100, "message": "Shared analysis complete.", "result": {"timings": checkpoint.timing_breakdown()}})
+    return analysis
+
+def process_video_with_recipe(task_id, video_url, recipe, task_status):
+    task_status[task_id] = {"status": "PENDING", "progress": 0, "message": "Starting video processing..."}
+
+    # Every stage checkpoints its output in the task directory, so running the same
+    # task_id again (POST /task/<id>/retry or /rerender, or a worker taking over an
+    # expired lease) only recomputes stages that are incomplete or whose inputs changed.
+    checkpoint = TaskCheckpoint(task_id, video_url, recipe)
+    source_task_id = checkpoint.manifest.get("source_task_id")
+    with ACTIVE_JOBS.track_inprogress():
+        try:
+            # DELETE /task/<id> and the recipe's deadline_seconds cancel the task through this.
+            with TaskCancellation(task_id, recipe.get("deadline_seconds")) as cancellation, cancellation.active():
+                if source_task_id:
+                    # Part of a batch: the source and its analysis live with the shared source task.
+                    analysis = analyze_shared_source(source_task_id, video_url, [recipe], task_status)
+                else:
+                    with monitor_ffmpeg(task_id, task_status):
+                        analysis = analyze_source(task_id, video_url, recipe, task_status, checkpoint)
+                with monitor_ffmpeg(task_id, task_status):
+                    render_task(task_id, analysis, recipe, task_status, checkpoint)
+        except TaskCancelled as e:
+            handle_task_cancelled(task_id, checkpoint, task_status, e)
+        except Exception as e:
+            handle_task_failure(task_id, checkpoint, task_status, e)
+
+def process_source_group(source_task_id, video_url, members, task_status):
+    """
+    Batch work for one source: download and analyze it once under source_task_id, then
+    render each member ({"task_id", "recipe"}) from that shared analysis.
+    """
+    with ACTIVE_JOBS.track_inprogress():
+        _process_source_group(source_task_id, video_url, members, task_status)
+
+def _process_source_group(source_task_id, video_url, members, task_status):
+    checkpoints = {}
+    for member in members:
+        task_status[member["task_id"]] = {"status": "PENDING", "progress": 0, "message": "Waiting for shared analysis of the source video..."}
+        checkpoints[member["task_id"]] = TaskCheckpoint(member["task_id"], video_url, member["recipe"], source_task_id=source_task_id)
+
+    with ExitStack() as stack:
+        cancellations = {
+            member["task_id"]: stack.enter_context(TaskCancellation(member["task_id"], member["recipe"].get("deadline_seconds")))
+            for member in members
+        }
+        # Members' deadlines count from now, so the shared analysis may run until the last of them.
+        deadlines = [cancellation.deadline_seconds for cancellation in cancellations.values()]
+        source_cancellation = stack.enter_context(TaskCancellation(source_task_id, max(deadlines) if all(deadlines) else None))
+
+        def cancel_unwanted_analysis():
+            if all(cancellation.cancelled for cancellation in cancellations.values()):
+                source_cancellation.cancel()
+        for cancellation in cancellations.values():
+            cancellation.add_callback(cancel_unwanted_analysis)
+
+        try:
+            with source_cancellation.active():
+                analysis = analyze_shared_source(source_task_id, video_url, [member["recipe"] for member in members], task_status)
+        except TaskCancelled as e:
+            for member in members:
+                # A member cancelled on its own (or past its own deadline) keeps that reason.
+                reason = cancellations[member["task_id"]].reason or e.reason
+                handle_task_cancelled(member["task_id"], checkpoints[member["task_id"]], task_status, TaskCancelled(reason))
+            return
+        except Exception as e:
+            for member in members:
+                handle_task_failure(member["task_id"], checkpoints[member["task_id"]], task_status, e)
+            return
+
+        for member in members:
+            task_id = member["task_id"]
+            try:
+                with cancellations[task_id].active(), monitor_ffmpeg(task_id, task_status):
+                    render_task(task_id, analysis, member["recipe"], task_status, checkpoints[task_id])
+            except TaskCancelled as e:
+                handle_task_cancelled(task_id, checkpoints[task_id], task_status, e)
+            except Exception as e:
+                handle_task_failure(task_id, checkpoints[task_id], task_status, e)
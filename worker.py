@@ -0,0 +1,153 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from dotenv import load_dotenv
+from prometheus_client import start_http_server
+
+from utils.job_queue import JobQueue, QueueTaskStatus, LeaseLost, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, DEFAULT_SJF_AGING
+
+# Configure logging
+log_file = 'worker.log'
+file_handler = RotatingFileHandler(log_file, maxBytes=1024 * 1024 * 10, backupCount=5) # 10 MB per file, 5 backup files
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(process)d - %(levelname)s - %(message)s'))
+
+logging.basicConfig(level=logging.INFO, handlers=[file_handler])
+
+from video_processing import process_video_with_recipe, process_source_group
+from utils.cancellation import request_cancel, discard_cancel_request, LEASE_LOST
+from utils.retention import collect_garbage, GC_INTERVAL
+
+# How often a running job looks for DELETE /task/<id> requests in the queue.
+CANCEL_POLL_INTERVAL = 1.0
+
+def _heartbeat_loop(queue, task_ids, worker_id, stop_event, lease_lost):
+    task_id = task_ids[0]
+    interval = queue.lease_seconds / 3
+    next_heartbeat = time.monotonic() + interval
+    cancelled = set()
+    while not stop_event.wait(min(interval, CANCEL_POLL_INTERVAL)):
+        try:
+            for requested in queue.cancel_requests(task_ids) - cancelled:
+                logging.info(f"[{requested}] Cancellation requested, stopping it on worker {worker_id}.")
+                request_cancel(requested)
+                cancelled.add(requested)
+        except Exception as e:
+            logging.warning(f"[{task_id}] Checking for cancellation failed, will retry: {e}")
+        if time.monotonic() < next_heartbeat:
+            continue
+        next_heartbeat += interval
+        try:
+            queue.heartbeat(task_id, worker_id)
+        except LeaseLost:
+            logging.error(f"[{task_id}] Worker {worker_id} lost its lease; stopping the job so another worker can take it over.")
+            lease_lost.set()
+            # The source task first, so its shared analysis stops with the lease reason too.
+            for lost_id in task_ids:
+                request_cancel(lost_id, LEASE_LOST)
+            return
+        except Exception as e:
+            logging.warning(f"[{task_id}] Heartbeat failed, will retry: {e}")
+
+def _job_state(final_status):
+    return final_status if final_status in ("COMPLETED", "CANCELLED") else "FAILED"
+
+def run_job(queue, worker_id, job):
+    task_id = job["task_id"]
+    logging.info(f"[{task_id}] Worker {worker_id} claimed job (attempt {job['attempts']}).")
+    stop_event = threading.Event()
+    lease_lost = threading.Event()
+    task_ids = [task_id] + [member["task_id"] for member in job["members"] or []]
+    heartbeat = threading.Thread(target=_heartbeat_loop, args=(queue, task_ids, worker_id, stop_event, lease_lost), daemon=True)
+    heartbeat.start()
+
+    task_status = QueueTaskStatus(queue, worker_id, task_id)
+    try:
+        if job["members"]:
+            process_source_group(task_id, job["video_url"], job["members"], task_status)
+        else:
+            process_video_with_recipe(task_id, job["video_url"], job["recipe"], task_status)
+    except Exception as e:
+        # The pipeline reports its own failures; this is a crash it did not catch.
+        logging.exception(f"[{task_id}] Worker {worker_id} crashed running the job: {e}")
+        if not lease_lost.is_set():
+            for failed_id in task_ids:
+                if failed_id not in task_status:
+                    task_status[failed_id] = {"status": "FAILED", "message": str(e), "error": str(e)}
+                elif task_status[failed_id].get("status") not in ("COMPLETED", "CANCELLED"):
+                    task_status[failed_id].update({"status": "FAILED", "message": str(e), "error": str(e)})
+    finally:
+        stop_event.set()
+        heartbeat.join()
+        for cancelled_id in task_ids:
+            discard_cancel_request(cancelled_id)
+
+    if lease_lost.is_set():
+        return
+    if job["members"]:
+        queue.finish_members({
+            member["task_id"]: _job_state(task_status.get(member["task_id"], {}).get("status"))
+            for member in job["members"]
+        })
+    final_status = task_status.get(task_id, {}).get("status")
+    queue.finish(task_id, worker_id, _job_state(final_status))
+    logging.info(f"[{task_id}] Worker {worker_id} finished job with status {final_status}.")
+
+def worker_loop(queue_path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, sjf_aging=DEFAULT_SJF_AGING, poll_interval=2.0, metrics_port=None):
+    load_dotenv()
+    if metrics_port:
+        start_http_server(metrics_port)
+    queue = JobQueue(queue_path, lease_seconds=lease_seconds, max_attempts=max_attempts, sjf_aging=sjf_aging)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    logging.info(f"Worker {worker_id} polling {queue_path}.")
+    next_gc = 0
+    while True:
+        if time.monotonic() >= next_gc:
+            # Expired and over-quota outputs go before a new job needs the space.
+            try:
+                collect_garbage()
+            except Exception as e:
+                logging.error(f"Artifact GC failed: {e}")
+            next_gc = time.monotonic() + GC_INTERVAL
+        job = queue.claim(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        run_job(queue, worker_id, job)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Storyboard AI worker processes against the shared job queue.")
+    parser.add_argument("--queue", default=os.getenv("JOB_QUEUE_PATH", "jobs.db"), help="Path of the SQLite job queue shared with the API.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to start; each runs one job at a time.")
+    parser.add_argument("--lease-seconds", type=float, default=float(os.getenv("JOB_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)))
+    parser.add_argument("--max-attempts", type=int, default=int(os.getenv("JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)))
+    parser.add_argument("--sjf-aging", type=float, default=float(os.getenv("JOB_SJF_AGING", DEFAULT_SJF_AGING)),
+                        help="Seconds taken off a queued job's estimated run time for each second it has waited.")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port (port + n for the n-th extra process).")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        worker_loop(args.queue, args.lease_seconds, args.max_attempts, args.sjf_aging, metrics_port=args.metrics_port)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=worker_loop,
+            kwargs={"queue_path": args.queue, "lease_seconds": args.lease_seconds, "max_attempts": args.max_attempts, "sjf_aging": args.sjf_aging,
+                    "metrics_port": args.metrics_port + n if args.metrics_port else None},
+            daemon=False,
+        )
+        for n in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+if __name__ == '__main__':
+    main()